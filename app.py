@@ -9,7 +9,9 @@
     :license: BSD, see LICENSE for more details.
 """
 
-from mtapi.mtapi import Mtapi
+from mtapi.mtapi import Mtapi, EARTH_RADIUS_MILES, FUZZY_MIN_SCORE
+from mtaproto.feedresponse import TZ
+from mtapi._jsonwriter import BackgroundJSONWriter
 from flask import Flask, jsonify, request, Response, render_template, abort, redirect, url_for
 import json
 from datetime import datetime
@@ -17,7 +19,6 @@ from functools import wraps, reduce
 import logging
 import os
 from flask_socketio import SocketIO
-from math import radians, sin, cos, sqrt, atan2
 import json
 import heapq
 from collections import deque
@@ -29,7 +30,16 @@ app.config.update(
     MAX_TRAINS=10,
     MAX_MINUTES=30,
     CACHE_SECONDS=60,
-    THREADED=True
+    THREADED=True,
+    FETCH_WORKERS=8,
+    FETCH_TIMEOUT=10,
+    FETCH_DEADLINE=30,
+    TRAIN_TIERS={},
+    FEED_URLS=None,
+    STATION_ROUTES_FILE='./data/stations_test.json',
+    STATION_GRAPH_FILE=None,
+    PATH_MATRIX_DIR='./cache',
+    PATH_MATRIX_DELAY=30
 )
 socketio = SocketIO(app)
 
@@ -65,85 +75,64 @@ mta = Mtapi(
     max_trains=app.config['MAX_TRAINS'],
     max_minutes=app.config['MAX_MINUTES'],
     expires_seconds=app.config['CACHE_SECONDS'],
-    threaded=app.config['THREADED'])
+    threaded=app.config['THREADED'],
+    fetch_workers=app.config['FETCH_WORKERS'],
+    fetch_timeout=app.config['FETCH_TIMEOUT'],
+    fetch_deadline=app.config['FETCH_DEADLINE'],
+    train_tiers=app.config['TRAIN_TIERS'],
+    feed_urls=app.config['FEED_URLS'],
+    graph_file=app.config['STATION_GRAPH_FILE'],
+    path_matrix_dir=app.config['PATH_MATRIX_DIR'],
+    path_matrix_delay=app.config['PATH_MATRIX_DELAY'])
+
+
+# Load the stations from stations_test.json
+with open(app.config['STATION_ROUTES_FILE'], 'r') as file:
+    stations = json.load(file)
 
+station_routes_writer = BackgroundJSONWriter(app.config['STATION_ROUTES_FILE'])
 
-# Load the stations from stations.json
-with open('./data/stations_test.json', 'r') as file:
-    stations = json.load(file)
+# Record each station's live routes in the stations file whenever an update
+# changes them; the file is rewritten atomically off the request path
+def persist_station_routes(snapshot):
+    if not len(snapshot.arrivals):
+        return  # no feed has loaded yet
 
-def get_routes_for_station(station_id):
-    routes = set()  # Initialize an empty set to store unique routes
-    
-    # Loop through each station object in the station data
-    station_data = mta.get_by_id(station_id)
-    
-    for station_obj in station_data:  
-        routes.update(station_obj['routes'])
-    return list(routes)
-
-# Update stations with routes
-def update_stations_with_routes():
-    for station_id, station_data in stations.items():
-        ids = station_id.split(',')
-        routes = get_routes_for_station(ids)
-        station_data['route'] = routes
-    # Write the updated station data back to the JSON file
-    with open('./data/stations_test.json', 'w') as file:
-        json.dump(stations, file)
-
-def create_adjacency_map(stations_data):
-    # Extract routes for each station using station names as keys
-    stations_routes = {details['name']: details['routes'] for _, details in stations_data.items()}
-
-    # Create an adjacency map where keys are station names and values are sets of adjacent station names
-    adjacency_map = {}
-
-    for station_name, routes in stations_routes.items():
-        adjacency_map[station_name] = list()
-        for other_station_name, other_routes in stations_routes.items():
-            if station_name != other_station_name and set(routes).intersection(other_routes):
-                adjacency_map[station_name].append(other_station_name)
-
-    return adjacency_map
-
-def find_shortest_path(graph, start, goal):
-    queue = deque([[start]])
-    
-    visited = set()
-
-    while queue:
-        path = queue.popleft()
-        vertex = path[-1]
-        if vertex == goal:
-            return path
-        elif vertex not in visited:
-            visited.add(vertex)
-            for current_neighbour in graph.get(vertex, []):
-                new_path = list(path)
-                new_path.append(current_neighbour)
-                queue.append(new_path)
-    return "No path found."
-
-def calculate_path(source_name, destination_name):    
-    adjacency_map = create_adjacency_map(stations)
-    shortest_path = find_shortest_path(adjacency_map, source_name, destination_name)  
-    # Print results
-    print("Shortest distance from", source_name, "to", destination_name, ":", shortest_path)
-    return shortest_path
+    changed = False
+    for station_id, routes in snapshot.station_routes.items():
+        station = stations.get(station_id)
+        if station is not None and station.get('route') != list(routes):
+            station['route'] = list(routes)
+            changed = True
+
+    if changed:
+        station_routes_writer.submit({ k: dict(v) for k, v in stations.items() })
+
+mta.add_update_listener(persist_station_routes)
+persist_station_routes(mta.snapshot())
+
+# Plan on the live trains, falling back to the fewest-stops route when no
+# predicted trip gets there
+def calculate_path(source_name, destination_name):
+    try:
+        return mta.plan_trip(source_name, destination_name) or mta.plan_route(source_name, destination_name)
+    except KeyError:
+        return None
+
+@app.template_filter('clock')
+def clock_filter(epoch):
+    return datetime.fromtimestamp(epoch, TZ).strftime('%H:%M')
 
 @app.route('/',methods=['GET'])
 def index():
-    update_stations_with_routes()
     routes_json = get_routes()  # Assuming routes() returns a JSON string
     routes_data = json.loads(routes_json)  # Parse JSON string into dictionary
     return render_template('index.html', routes=routes_data)
 
 @app.route('/plan-route', methods=['GET'])
 def route_planner():
-    # Extract station names from station data
-    station_names = set([stations[station]['name'] for station in stations])
-    return render_template('route_planner.html', stations=station_names)
+    # station names are completed from /api/station-names as the user types
+    return render_template('route_planner.html')
 
 @app.route('/plan-route', methods=['POST'])
 def plan_route():
@@ -169,23 +158,7 @@ def by_location():
     except ValueError as e:
         return render_template('error.html', error='Invalid lat/lon values')
 
-    data = mta.get_by_point((lat, lon), 5)
-    updated = mta.last_update()
-        # Calculate the remaining minutes for each train
-    for station in data:
-        for direction in ['N', 'S']:  # Handling both directions
-            if direction in station:
-                for train in station[direction]:
-                    # Check if train['time'] is already a datetime object
-                    if isinstance(train['time'], datetime):
-                        train_time = train['time']
-                    elif isinstance(train['time'], str):
-                        train_time = datetime.fromisoformat(train['time'])
-                    else:
-                        continue  # Skip or handle unexpected data type
-                    
-                    remaining_minutes = int((train_time - updated).total_seconds() / 60)
-                    train['remaining_minutes'] = remaining_minutes
+    data = mta.get_by_point((lat, lon), 5, tier=request.args.get('tier'))
     return render_template('bylocation.html', data=data, updated=mta.last_update())
 
 @app.route('/find-station', methods=['GET'])
@@ -198,36 +171,8 @@ def find_station():
     except ValueError:
         return render_template('error.html', error="Invalid latitude or longitude format.")
 
-    distance=[]
-    nearest_station, curr_dist = find_nearest_station(lat, lon)
-    distance.append(curr_dist)
-    station_lat = None
-    station_lon = None
-    for station_id, station_info in stations.items():
-        if station_info['name'] == nearest_station['name']:
-            station_lat = float(station_info['location'][0])
-            station_lon = float(station_info['location'][1])
-            break
-    data = mta.get_by_point((station_lat,station_lon ), 5)
-    updated = mta.last_update()
-        # Calculate the remaining minutes for each train
-    for station in data:
-        distance.append(calculate_distance(lat,lon,float(station['location'][0]),float(station['location'][1])))
-        for direction in ['N', 'S']:  # Handling both directions
-            if direction in station:
-                for train in station[direction]:
-                    # Check if train['time'] is already a datetime object
-                    if isinstance(train['time'], datetime):
-                        train_time = train['time']
-                    elif isinstance(train['time'], str):
-                        train_time = datetime.fromisoformat(train['time'])
-                    else:
-                        continue  # Skip or handle unexpected data type
-                    
-                    remaining_minutes = int((train_time - updated).total_seconds() / 60)
-                    train['remaining_minutes'] = remaining_minutes
-
-    return render_template('nearestStation.html', data=data, station=nearest_station,lat=lat,lon=lon ,distance=distance)
+    data = mta.get_nearest((lat, lon), 5, tier=request.args.get('tier'), earth_radius=EARTH_RADIUS_MILES)
+    return render_template('nearestStation.html', data=data, station=data[0] if data else None, lat=lat, lon=lon)
 
 @app.route('/by-route/<route>', methods=['GET'])
 def by_route(route):
@@ -235,28 +180,8 @@ def by_route(route):
         return redirect(request.host_url + 'by-route/' + route.upper(), code=301)
 
     try:
-        data = mta.get_by_route(route)
+        data = mta.get_by_route(route, tier=request.args.get('tier'))
         updated = mta.last_update()
-        
-        # Convert updated to datetime if it's a string
-        if isinstance(updated, str):
-            updated = datetime.fromisoformat(updated)
-
-        # Calculate the remaining minutes for each train
-        for station in data:
-            for direction in ['N', 'S']:  # Handling both directions
-                if direction in station:
-                    for train in station[direction]:
-                        # Check if train['time'] is already a datetime object
-                        if isinstance(train['time'], datetime):
-                            train_time = train['time']
-                        elif isinstance(train['time'], str):
-                            train_time = datetime.fromisoformat(train['time'])
-                        else:
-                            continue  # Skip or handle unexpected data type
-                        
-                        remaining_minutes = int((train_time - updated).total_seconds() / 60)
-                        train['remaining_minutes'] = remaining_minutes
 
         return render_template('byRoute.html', data=data, updated=updated, route=route)
     except KeyError:
@@ -264,26 +189,24 @@ def by_route(route):
 
 @app.route('/by-stations', methods=['GET', 'POST'])
 def by_stations():
-     # Extract station names from station data
-    station_names = set([stations[station]['name'] for station in stations])
     if request.method == 'POST':
         station_name = request.form['station_name']
-        # Search for the station by name and fetch the location
-        for station_id, station_info in stations.items():
-            if station_info['name'].lower() == station_name.lower():  # Case insensitive match
-                location = station_info['location']
-                lat, lon = location
-                return redirect(url_for('by_location', lat=lat, lon=lon))
-            
-        # return f"Search result for: {station_name}"
-    return render_template('by_stations.html', stations=station_names)
+        # Search for the station by name, or the closest name, and fetch the location
+        matches = mta.stations_named(station_name) or \
+            [ station for _, station in mta.search_stations(station_name, 1, FUZZY_MIN_SCORE) ]
+        if matches:
+            lat, lon = matches[0]['location']
+            return redirect(url_for('by_location', lat=lat, lon=lon))
+
+        return render_template('error.html', error='No station matches "%s"' % station_name)
+    return render_template('by_stations.html')
 
 
 @app.route('/by-id/<id_string>', methods=['GET'])
 def by_index(id_string):
     ids = id_string.split(',')
     try:
-        data = mta.get_by_id(ids)
+        data = mta.get_by_id(ids, tier=request.args.get('tier'))
         return render_template('byId.html', data=data)
     except KeyError as e:
         return render_template('error.html', error='Station not found')
@@ -293,28 +216,112 @@ def get_routes():
     routes_data = sorted(mta.get_routes())
     return json.dumps(routes_data)
 
+# JSON API, as documented in docs/endpoints.md. Responses are assembled from
+# fragments the Mtapi caches per snapshot, and carry an ETag naming the
+# snapshot generation so unchanged data costs clients a 304.
+
+_ETAG_PREFIX = '%x' % int(datetime.now().timestamp() * 1000)
+
+def snapshot_or_304(snapshot=None):
+    if snapshot is None:
+        snapshot = mta.snapshot()
+    etag = '%s-%d' % (_ETAG_PREFIX, snapshot.generation)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return snapshot, etag, response
+    return snapshot, etag, None
+
+def json_response(snapshot, etag, data):
+    body = '{"data": %s, "updated": %s}' % (data, json.dumps(snapshot.last_update.isoformat()))
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+def json_error(error, status):
+    response = jsonify({ 'error': error })
+    response.status_code = status
+    return response
+
+@app.route('/api/by-location', methods=['GET'])
+def api_by_location():
+    try:
+        location = (float(request.args['lat']), float(request.args['lon']))
+    except (KeyError, ValueError):
+        return json_error('Missing or invalid lat/lon parameters', 400)
 
+    snapshot, etag, not_modified = snapshot_or_304()
+    if not_modified:
+        return not_modified
 
-def find_nearest_station(lat, lon):
-    min_distance = None
-    nearest_station = None
-    for station_id, station_info in stations.items():
-        station_lat, station_lon = station_info['location']
-        dist = calculate_distance(lat, lon, station_lat, station_lon)
-        if min_distance is None or dist < min_distance:
-            min_distance = dist
-            nearest_station = station_info
+    stations = [ station for _, station in mta.stations_near(location, 5) ]
+    data = '[%s]' % ', '.join(mta.encode_stations(snapshot, stations, tier=request.args.get('tier')))
+    return json_response(snapshot, etag, data)
 
-    return nearest_station, min_distance
+@app.route('/api/by-route/<route>', methods=['GET'])
+def api_by_route(route):
+    snapshot = mta.snapshot()
+    try:
+        stations = snapshot.route_stations[route.upper()]
+    except KeyError:
+        return json_error('Route not found', 404)
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    R = 3959  # Earth radius in miles
-    dLat = radians(lat2 - lat1)
-    dLon = radians(lon2 - lon1)
-    a = sin(dLat/2) * sin(dLat/2) + cos(radians(lat1)) * cos(radians(lat2)) * sin(dLon/2) * sin(dLon/2)
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    distance = R * c
-    return distance 
+    snapshot, etag, not_modified = snapshot_or_304(snapshot)
+    if not_modified:
+        return not_modified
+
+    data = '[%s]' % ', '.join(mta.encode_stations(snapshot, stations, tier=request.args.get('tier')))
+    return json_response(snapshot, etag, data)
+
+@app.route('/api/by-id/<id_string>', methods=['GET'])
+def api_by_id(id_string):
+    snapshot = mta.snapshot()
+    try:
+        stations = [ snapshot.stations[k] for k in id_string.split(',') ]
+    except KeyError:
+        return json_error('Station not found', 404)
+
+    snapshot, etag, not_modified = snapshot_or_304(snapshot)
+    if not_modified:
+        return not_modified
+
+    data = '[%s]' % ', '.join(mta.encode_stations(snapshot, stations, tier=request.args.get('tier')))
+    return json_response(snapshot, etag, data)
+
+@app.route('/api/routes', methods=['GET'])
+def api_routes():
+    snapshot, etag, not_modified = snapshot_or_304()
+    if not_modified:
+        return not_modified
+
+    return json_response(snapshot, etag, mta.encode_routes(snapshot))
+
+@app.route('/api/station-names', methods=['GET'])
+def api_station_names():
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 50))
+    except ValueError:
+        return json_error('Invalid limit', 400)
+
+    # names only change with the stations file, so these can be cached freely
+    response = jsonify({ 'data': mta.complete_station_name(request.args.get('q', ''), limit) })
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response
+
+@app.route('/api/station-search', methods=['GET'])
+def api_station_search():
+    try:
+        limit = max(1, min(int(request.args.get('limit', 5)), 50))
+    except ValueError:
+        return json_error('Invalid limit', 400)
+
+    results = mta.search_stations(request.args.get('q', ''), limit)
+    response = jsonify({ 'data': [ { 'id': station['id'], 'name': station['name'], 'score': round(score, 3) }
+                                   for score, station in results ] })
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response
 
 
 # WebSocket event handlers
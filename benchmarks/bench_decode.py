@@ -0,0 +1,67 @@
+# Compares extracting arrivals from parsed feeds through the Trip/TripStop
+# wrappers (what Mtapi._update used to do) with FeedResponse.stop_times().
+#
+#   python -m benchmarks.bench_decode [feed.pb ...] [--rounds 20]
+#
+# With no files, the synthetic numbered-line feed (8 routes x 40 trips, up to 30
+# stops) is used.
+
+import argparse, statistics, time
+
+from mtaproto.feedresponse import FeedResponse, Trip, TripStop
+from benchmarks.synthetic import SyntheticFeedGenerator
+
+def wrapped(feed):
+    out = []
+    for entity in feed.entity:
+        trip = Trip(entity)
+        if not trip.is_valid():
+            continue
+
+        direction = trip.direction[0]
+        route_id = trip.route_id.upper()
+
+        for update in entity.trip_update.stop_time_update:
+            trip_stop = TripStop(update)
+            train_time = trip_stop.time
+            if train_time is None:
+                continue
+            out.append((trip_stop.stop_id, route_id, direction, train_time))
+    return out
+
+def fast(feed):
+    return list(feed.stop_times())
+
+def bench(fn, feeds, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        count = sum(len(fn(feed)) for feed in feeds)
+        samples.append(time.perf_counter() - start)
+    return count, statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark arrival extraction from GTFS-RT feeds')
+    parser.add_argument('feeds', nargs='*', help='raw protobuf feed bodies')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.feeds:
+        bodies = [ open(path, 'rb').read() for path in args.feeds ]
+    else:
+        bodies = [ SyntheticFeedGenerator(trips_per_route=40).feed(0) ]
+
+    feeds = [ FeedResponse(body) for body in bodies ]
+
+    results = {}
+    for label, fn in (('wrapped', wrapped), ('stop_times', fast)):
+        count, median = bench(fn, feeds, args.rounds)
+        results[label] = median
+        print('%-10s %6d stop times  median %.2fms  (%.2fus/update)' % (
+            label, count, median * 1000, median / count * 1e6))
+
+    print('speedup %.1fx' % (results['wrapped'] / results['stop_times']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# Measures wall-clock time of a full Mtapi._update against a local stand-in feed
+# server, fetching the eight feeds sequentially (one worker, the old behaviour)
+# versus concurrently.
+#
+#   python -m benchmarks.bench_fetch [--delay 0.2] [--rounds 5]
+
+import argparse, statistics, time, logging
+import os
+
+from mtapi import Mtapi
+from mtapi._feedserver import StandInFeedServer
+from benchmarks.synthetic import SyntheticFeedGenerator
+
+STATIONS_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'stations.json')
+
+def time_updates(mta, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        mta._update()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sequential vs concurrent feed refresh')
+    parser.add_argument('--delay', type=float, default=0.2, help='base per-feed server latency in seconds')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    with StandInFeedServer() as server:
+        # vary latency per feed so the slowest one dominates the concurrent case
+        generator = SyntheticFeedGenerator(trips_per_route=2, stops_per_trip=5)
+        urls = []
+        for i, feed_url in enumerate(Mtapi._FEED_URLS):
+            urls.append(server.set_feed(feed_url, generator.feed(i), delay=args.delay * (1 + i / 4.0)))
+
+        print('per-feed delays: %s' % ', '.join('%.2fs' % (args.delay * (1 + i / 4.0)) for i in range(len(urls))))
+
+        for label, workers in (('sequential', 1), ('concurrent', args.workers)):
+            mta = Mtapi('', STATIONS_FILE, feed_urls=urls, fetch_workers=workers, expires_seconds=None)
+            samples = time_updates(mta, args.rounds)
+            print('%-10s workers=%d  median %.3fs  min %.3fs  max %.3fs' % (
+                label, workers, statistics.median(samples), min(samples), max(samples)))
+
+
+if __name__ == '__main__':
+    main()
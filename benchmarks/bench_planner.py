@@ -0,0 +1,125 @@
+# Compares route planners across every pair of station names:
+#
+#   legacy         the original app.py planner: a "shares any route" adjacency
+#                  map over station names and a BFS that copies the whole path
+#                  for every edge it queues (only run on a sample, it is slow)
+#   forward        one-directional BFS with parent pointers over the compiled
+#                  _TransitGraph
+#   bidirectional  _TransitGraph.shortest_path, which Mtapi.plan_route uses
+#                  until the path matrix is ready
+#   matrix         reading the path off the graph's _PathMatrix
+#
+#   python -m benchmarks.bench_planner [--archive recordings/monday] [--legacy-pairs 500]
+#
+# The searches and the matrix must agree on every path length.
+
+import argparse, itertools, json, random, time
+from collections import deque
+
+from mtapi import Mtapi
+from mtapi._replay import ReplayFeedSource
+from mtapi._pathmatrix import _PathMatrix
+from benchmarks.synthetic import SyntheticFeedGenerator, SyntheticFeedSource, STATIONS_FILE
+
+def legacy_adjacency_map(stations_data):
+    stations_routes = {details['name']: details['routes'] for _, details in stations_data.items()}
+
+    adjacency_map = {}
+    for station_name, routes in stations_routes.items():
+        adjacency_map[station_name] = list()
+        for other_station_name, other_routes in stations_routes.items():
+            if station_name != other_station_name and set(routes).intersection(other_routes):
+                adjacency_map[station_name].append(other_station_name)
+
+    return adjacency_map
+
+def legacy_shortest_path(graph, start, goal):
+    queue = deque([[start]])
+    visited = set()
+
+    while queue:
+        path = queue.popleft()
+        vertex = path[-1]
+        if vertex == goal:
+            return path
+        elif vertex not in visited:
+            visited.add(vertex)
+            for current_neighbour in graph.get(vertex, []):
+                new_path = list(path)
+                new_path.append(current_neighbour)
+                queue.append(new_path)
+    return "No path found."
+
+def forward_shortest_path(graph, sources, targets):
+    targets = set(targets)
+    adjacency = graph._adjacency
+    parent = { i: i for i in sources }
+    frontier = list(sources)
+    while frontier:
+        following = []
+        for i in frontier:
+            if i in targets:
+                path = [i]
+                while parent[path[-1]] != path[-1]:
+                    path.append(parent[path[-1]])
+                return path[::-1]
+            for j in adjacency[i]:
+                if j not in parent:
+                    parent[j] = i
+                    following.append(j)
+        frontier = following
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark route planners across all station pairs')
+    parser.add_argument('--archive', help='recorded feed archive to build the graph from')
+    parser.add_argument('--legacy-pairs', type=int, default=500, help='pairs to sample for the legacy planner')
+    args = parser.parse_args()
+
+    if args.archive:
+        source = ReplayFeedSource(args.archive)
+    else:
+        source = SyntheticFeedSource(SyntheticFeedGenerator(), cycles=1)
+    mta = Mtapi('', STATIONS_FILE, feed_source=source, clock=source.clock, expires_seconds=None)
+    graph = mta.transit_graph()
+
+    names = sorted(set(graph.names))
+    pairs = list(itertools.product(names, names))
+    endpoints = [ (graph.stations_named(a), graph.stations_named(b)) for a, b in pairs ]
+    print('%d stations, %d edges, %d name pairs' % (len(graph), graph.n_edges, len(pairs)))
+
+    start = time.perf_counter()
+    matrix = _PathMatrix.build(graph)
+    print('path matrix built in %.2fs' % (time.perf_counter() - start))
+
+    results = {}
+    searches = (('forward', lambda a, b: forward_shortest_path(graph, a, b)),
+                ('bidirectional', graph.shortest_path),
+                ('matrix', matrix.shortest_path))
+    for label, search in searches:
+        start = time.perf_counter()
+        results[label] = [ search(a, b) for a, b in endpoints ]
+        elapsed = time.perf_counter() - start
+        print('%-14s %8.2fs total  %8.1fus/query' % (label, elapsed, elapsed / len(pairs) * 1e6))
+
+    mismatched = sum(1 for f, b, m in zip(results['forward'], results['bidirectional'], results['matrix'])
+                     if len(set(len(p) if p is not None else None for p in (f, b, m))) > 1)
+    print('path length mismatches: %d' % mismatched)
+
+    with open('./data/stations_test.json', 'r') as f:
+        stations_data = json.load(f)
+    sample = random.Random(0).sample(pairs, min(args.legacy_pairs, len(pairs)))
+    start = time.perf_counter()
+    adjacency_map = legacy_adjacency_map(stations_data)
+    for a, b in sample:
+        legacy_shortest_path(adjacency_map, a, b)
+    elapsed = time.perf_counter() - start
+    print('%-14s %8.2fs for %d pairs  %8.1fus/query  (adjacency map built once)' % (
+        'legacy', elapsed, len(sample), elapsed / len(sample) * 1e6))
+
+    if mismatched:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
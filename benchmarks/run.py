@@ -0,0 +1,244 @@
+# Offline benchmark suite: feed ingest, Mtapi queries, route planning and Flask
+# endpoint latency, on synthetic feeds or a recorded archive.
+#
+#   python -m benchmarks.run                          # synthetic feeds at 1x
+#   python -m benchmarks.run --scale 5 --rounds 50
+#   python -m benchmarks.run --archive recordings/monday
+#   python -m benchmarks.run --output results.json --check
+#   python -m benchmarks.run --save-baseline
+#
+# Results are written as JSON (median/p90/min milliseconds per benchmark) and
+# compared against benchmarks/baseline.json; a median more than --tolerance
+# slower than the baseline is reported as a regression, and --check makes the
+# run exit non-zero when there is one.
+
+import argparse, json, os, platform, random, shutil, statistics, sys, tempfile, time, logging
+
+import numpy
+from google.protobuf.internal import api_implementation
+
+from mtapi import Mtapi
+from mtapi.mtapi import EARTH_RADIUS_MILES
+from mtapi._feedserver import StandInFeedServer
+from mtapi._replay import FeedArchive, ReplayFeedSource
+from benchmarks.synthetic import SyntheticFeedGenerator, SyntheticFeedSource
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+STATIONS_FILE = os.path.join(ROOT, 'data', 'stations.json')
+BASELINE_FILE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'median_ms': round(statistics.median(samples) * 1000, 4),
+        'p90_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.9))] * 1000, 4),
+        'min_ms': round(samples[0] * 1000, 4),
+        'rounds': len(samples)
+    }
+
+def timed(fn, rounds, args=lambda i: ()):
+    samples = []
+    for i in range(rounds):
+        a = args(i)
+        start = time.perf_counter()
+        fn(*a)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def feed_source(args):
+    if args.archive:
+        source = ReplayFeedSource(args.archive, loop=True)
+    else:
+        generator = SyntheticFeedGenerator(scale=args.scale)
+        source = SyntheticFeedSource(generator, cycles=min(args.rounds, 8))
+    return source
+
+def bench_update(args, results):
+    source = feed_source(args)
+    mta = Mtapi('', STATIONS_FILE, feed_source=source, clock=source.clock, expires_seconds=None)
+    # the path matrix is built in the background; let it finish before timing
+    mta.path_matrix(timeout=600)
+
+    stages = {}
+    for _ in range(args.rounds):
+        mta._update()
+        for stage, seconds in mta.update_timings().items():
+            stages.setdefault(stage, []).append(seconds)
+
+    for stage, samples in stages.items():
+        results['update.%s' % stage] = summarize(samples)
+
+    return mta
+
+def bench_queries(args, results, mta):
+    rng = random.Random(0)
+    stations = mta.snapshot().stations
+    ids = sorted(stations)
+    routes = sorted(mta.get_routes())
+    points = [ (40.58 + rng.random() * 0.3, -74.05 + rng.random() * 0.3) for _ in range(args.rounds) ]
+    # exact, spelled-out, misspelled and one-letter station names
+    searches = ['jay st metrotech', 'times sq', '14th st', 'bleeker', 'grand centrl', 's']
+
+    results['query.get_by_point'] = timed(mta.get_by_point, args.rounds, lambda i: (points[i], 5))
+    results['query.get_nearest'] = timed(mta.get_nearest, args.rounds,
+                                         lambda i: (points[i], 5, None, EARTH_RADIUS_MILES))
+    results['query.get_by_route'] = timed(mta.get_by_route, args.rounds, lambda i: (routes[i % len(routes)],))
+    results['query.get_by_id'] = timed(mta.get_by_id, args.rounds,
+                                       lambda i: ([ ids[(i * 7 + k) % len(ids)] for k in range(5) ],))
+    results['query.search_stations'] = timed(mta.search_stations, args.rounds,
+                                             lambda i: (searches[i % len(searches)],))
+    results['query.plan_trip'] = timed(mta.plan_trip, args.rounds,
+                                       lambda i: (ids[(i * 7) % len(ids)], ids[(i * 13 + 5) % len(ids)]))
+
+def write_settings(feed_urls, station_routes_file):
+    settings = tempfile.NamedTemporaryFile('w', suffix='.cfg', delete=False)
+    settings.write('\n'.join([
+        'MTA_KEY = \'\'',
+        'STATIONS_FILE = %r' % STATIONS_FILE,
+        'STATION_ROUTES_FILE = %r' % station_routes_file,
+        'PATH_MATRIX_DIR = %r' % os.path.dirname(station_routes_file),
+        'PATH_MATRIX_DELAY = 0',
+        'FEED_URLS = %r' % feed_urls,
+        'THREADED = False',
+        'CACHE_SECONDS = None',
+        'DEBUG = False',
+        ''
+    ]))
+    settings.close()
+    return settings.name
+
+def bench_app(args, results):
+    '''Route planning and endpoint latency through the Flask test client,
+    with the app polling a local stand-in feed server.'''
+    # the app records live routes per station; keep that away from data/
+    station_routes_file = os.path.join(tempfile.mkdtemp(), 'stations_test.json')
+    shutil.copy(os.path.join(ROOT, 'data', 'stations_test.json'), station_routes_file)
+
+    with StandInFeedServer() as server:
+        if args.archive:
+            feed_urls = server.play(FeedArchive(args.archive), speed=1, rebase=True)
+        else:
+            generator = SyntheticFeedGenerator(scale=args.scale)
+            feed_urls = [ server.set_feed(url, data) for url, data in generator.feeds().items() ]
+
+        os.environ['MTAPI_SETTINGS'] = write_settings(feed_urls, station_routes_file)
+        try:
+            import app as webapp
+        finally:
+            os.unlink(os.environ.pop('MTAPI_SETTINGS'))
+        webapp.mta.path_matrix(timeout=600)
+
+        rng = random.Random(0)
+        names = sorted(set(s['name'] for s in webapp.stations.values()))
+        pairs = [ (rng.choice(names), rng.choice(names)) for _ in range(args.rounds) ]
+        points = [ (40.58 + rng.random() * 0.3, -74.05 + rng.random() * 0.3) for _ in range(args.rounds) ]
+
+        results['app.calculate_path'] = timed(webapp.calculate_path, args.rounds, lambda i: pairs[i])
+
+        client = webapp.app.test_client()
+        station_id = sorted(webapp.stations)[0]
+
+        def get(url):
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+
+        def post(url, data):
+            response = client.post(url, data=data)
+            assert response.status_code == 200, (url, response.status_code)
+
+        endpoints = [
+            ('http.by_location', lambda i: get('/by-location?lat=%f&lon=%f' % points[i])),
+            ('http.find_station', lambda i: get('/find-station?lat=%f&lon=%f' % points[i])),
+            ('http.by_route', lambda i: get('/by-route/1')),
+            ('http.by_id', lambda i: get('/by-id/%s' % station_id)),
+            ('http.routes', lambda i: get('/routes')),
+            ('http.index', lambda i: get('/')),
+            ('http.plan_route_form', lambda i: get('/plan-route')),
+            ('http.by_stations_form', lambda i: get('/by-stations')),
+            ('http.api_by_location', lambda i: get('/api/by-location?lat=%f&lon=%f' % points[i])),
+            ('http.api_by_route', lambda i: get('/api/by-route/1')),
+            ('http.api_by_id', lambda i: get('/api/by-id/%s' % station_id)),
+            ('http.api_routes', lambda i: get('/api/routes')),
+            ('http.api_station_names', lambda i: get('/api/station-names?q=%s' % names[i % len(names)][:3])),
+            ('http.api_station_search', lambda i: get('/api/station-search?q=%s' % names[i % len(names)].lower()))
+        ]
+        for name, fn in endpoints:
+            results[name] = timed(fn, args.rounds, lambda i: (i,))
+
+        results['http.plan_route'] = timed(
+            lambda i: post('/plan-route', { 'source': pairs[i][0], 'destination': pairs[i][1] }),
+            args.rounds, lambda i: (i,))
+
+    webapp.station_routes_writer.flush(10)
+    shutil.rmtree(os.path.dirname(station_routes_file), ignore_errors=True)
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print('%-28s %12s %12s %8s' % ('benchmark', 'median ms', 'baseline', 'ratio'))
+    for name in sorted(results):
+        median = results[name]['median_ms']
+        base = baseline.get(name, {}).get('median_ms')
+        if base:
+            ratio = median / base
+            flag = '  REGRESSION' if ratio > 1 + tolerance else ''
+            if flag:
+                regressions.append(name)
+            print('%-28s %12.3f %12.3f %7.2fx%s' % (name, median, base, ratio, flag))
+        else:
+            print('%-28s %12.3f %12s %8s' % (name, median, '-', '-'))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the offline benchmark suite')
+    parser.add_argument('--archive', help='recorded feed archive to use instead of synthetic feeds')
+    parser.add_argument('--scale', type=float, default=1.0, help='synthetic trip volume multiple')
+    parser.add_argument('--rounds', type=int, default=30)
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='overwrite the baseline with these results')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before flagging')
+    parser.add_argument('--check', action='store_true', help='exit 1 if any benchmark regressed')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    os.chdir(ROOT)
+
+    results = {}
+    mta = bench_update(args, results)
+    bench_queries(args, results, mta)
+    bench_app(args, results)
+
+    report = {
+        'meta': {
+            'time': int(time.time()),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'protobuf': api_implementation.Type(),
+            'source': args.archive or 'synthetic x%g' % args.scale,
+            'rounds': args.rounds
+        },
+        'results': results
+    }
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, sort_keys=True, indent=4)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, sort_keys=True, indent=4)
+
+    if regressions:
+        print('%d regression(s): %s' % (len(regressions), ', '.join(regressions)))
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
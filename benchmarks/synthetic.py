@@ -0,0 +1,172 @@
+# Generates synthetic but valid NYCT GTFS-RT feeds for scale benchmarks.
+#
+# Trips run along real stop IDs from data/stations.json, grouped per route by
+# stop ID prefix (1xx for the 1, Axx for the A/C, ...), with the NYCT trip
+# descriptor extension carrying the direction. `scale` multiplies the number of
+# trips so ingest can be measured at 2x, 5x or 10x today's volume.
+#
+#   python -m benchmarks.synthetic recordings/synthetic-5x --scale 5 --cycles 10
+#
+# writes a FeedArchive that ReplayFeedSource and serve_feeds.py can play back.
+
+import argparse, json, os, random, time
+
+from mtaproto import gtfs_realtime_pb2, nyct_subway_pb2
+from mtapi import Mtapi
+from mtapi._feedfetcher import FeedResult
+from mtapi._replay import FeedArchive
+
+STATIONS_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'stations.json')
+
+# routes carried by each feed, in Mtapi._FEED_URLS order
+FEED_ROUTES = [
+    ['1', '2', '3', '4', '5', '6', '7', 'GS'],
+    ['L'],
+    ['N', 'Q', 'R', 'W'],
+    ['B', 'D', 'F', 'M'],
+    ['A', 'C', 'E'],
+    ['SI'],
+    ['J', 'Z'],
+    ['G']
+]
+
+# stop ID prefixes each route runs along
+ROUTE_PREFIXES = {
+    '1': '1', '2': '2', '3': '2', '4': '4', '5': '5', '6': '6', '7': '7', 'GS': '9',
+    'L': 'L', 'N': 'R', 'Q': 'D', 'R': 'R', 'W': 'R',
+    'B': 'D', 'D': 'D', 'F': 'F', 'M': 'M',
+    'A': 'A', 'C': 'A', 'E': 'F', 'SI': 'S', 'J': 'J', 'Z': 'J', 'G': 'G'
+}
+
+DIRECTIONS = {
+    'N': nyct_subway_pb2.NyctTripDescriptor.NORTH,
+    'S': nyct_subway_pb2.NyctTripDescriptor.SOUTH
+}
+
+class SyntheticFeedGenerator(object):
+    '''Builds FeedMessage payloads for the feeds in Mtapi._FEED_URLS.
+
+    Each route gets `trips_per_route * scale` trips, half in each direction,
+    placed at random points along the line, each listing up to
+    `stops_per_trip` upcoming stops `stop_interval` seconds apart. With
+    `direction_extension` off, trips omit the NYCT descriptor as non-NYCT
+    feeds do.'''
+
+    def __init__(self, stations_file=STATIONS_FILE, trips_per_route=20, stops_per_trip=30, scale=1.0,
+                 stop_interval=90, direction_extension=True, seed=0):
+        self.trips_per_route = max(1, int(round(trips_per_route * scale)))
+        self.stops_per_trip = stops_per_trip
+        self.stop_interval = stop_interval
+        self.direction_extension = direction_extension
+        self._random = random.Random(seed)
+
+        with open(stations_file, 'r') as f:
+            stops = sorted(stop_id for station in json.load(f).values() for stop_id in station['stops'])
+
+        self.route_stops = {}
+        for route_id, prefix in ROUTE_PREFIXES.items():
+            self.route_stops[route_id] = [ s for s in stops if s.startswith(prefix) ] or stops[:stops_per_trip]
+
+    def feed_message(self, routes, now):
+        msg = gtfs_realtime_pb2.FeedMessage()
+        msg.header.gtfs_realtime_version = '1.0'
+        msg.header.timestamp = int(now)
+
+        for route_id in routes:
+            line = self.route_stops[route_id]
+            for t in range(self.trips_per_route):
+                direction = 'N' if t % 2 == 0 else 'S'
+                stops = line if direction == 'S' else line[::-1]
+
+                # trips are spread along the line, each with its remaining stops
+                start = self._random.randrange(len(stops))
+                stops = stops[start:start + self.stops_per_trip]
+                first_arrival = int(now) + self._random.randrange(self.stop_interval)
+
+                entity = msg.entity.add()
+                entity.id = '%s_%s_%d' % (route_id, direction, t)
+                trip = entity.trip_update.trip
+                trip.trip_id = entity.id
+                trip.route_id = route_id
+                if self.direction_extension:
+                    trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor].direction = DIRECTIONS[direction]
+
+                for i, stop_id in enumerate(stops):
+                    update = entity.trip_update.stop_time_update.add()
+                    update.stop_id = stop_id + direction
+                    update.arrival.time = first_arrival + i * self.stop_interval
+                    update.departure.time = update.arrival.time + 30
+
+        return msg
+
+    def feed(self, feed_index, now=None):
+        '''Serialized payload for Mtapi._FEED_URLS[feed_index].'''
+        now = time.time() if now is None else now
+        return self.feed_message(FEED_ROUTES[feed_index], now).SerializeToString()
+
+    def feeds(self, urls=None, now=None):
+        '''{url: payload} for every feed.'''
+        urls = urls or Mtapi._FEED_URLS
+        return { url: self.feed(i, now) for i, url in enumerate(urls) }
+
+    def write_archive(self, root, cycles=10, interval=30, start=None):
+        archive = FeedArchive(root)
+        start = time.time() if start is None else start
+        for c in range(cycles):
+            captured_at = start + c * interval
+            for url, data in self.feeds(now=captured_at).items():
+                archive.write(url, captured_at, data)
+        return archive
+
+
+class SyntheticFeedSource(object):
+    '''An Mtapi feed_source serving `cycles` pre-generated rounds of feeds in
+    turn, `interval` seconds of simulated time apart, so every update decodes
+    all eight feeds without paying for generating them:
+
+        source = SyntheticFeedSource(SyntheticFeedGenerator(scale=5))
+        mta = Mtapi('', stations_file, feed_source=source, clock=source.clock)
+    '''
+
+    def __init__(self, generator, cycles=4, interval=30, start=None, urls=None):
+        start = time.time() if start is None else start
+        urls = urls or Mtapi._FEED_URLS
+        self._frames = []
+        for c in range(cycles):
+            now = start + c * interval
+            self._frames.append((now, [ generator.feed(i % len(FEED_ROUTES), now) for i in range(len(urls)) ]))
+        self._frame = -1
+
+    def clock(self):
+        return self._frames[max(self._frame, 0)][0]
+
+    def fetch_all(self, urls):
+        self._frame = (self._frame + 1) % len(self._frames)
+        payloads = self._frames[self._frame][1]
+        return [ FeedResult(url, payloads[i % len(payloads)], 0.0) for i, url in enumerate(urls) ]
+
+    def forget(self, url):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic GTFS-RT feed archive')
+    parser.add_argument('archive', help='directory to write')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiple of the base trip volume')
+    parser.add_argument('--trips', type=int, default=20, help='trips per route at scale 1')
+    parser.add_argument('--stops', type=int, default=30, help='upcoming stops per trip')
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=30)
+    parser.add_argument('--no-direction', action='store_true', help='omit the NYCT direction extension')
+    args = parser.parse_args()
+
+    generator = SyntheticFeedGenerator(trips_per_route=args.trips, stops_per_trip=args.stops, scale=args.scale,
+                                       direction_extension=not args.no_direction)
+    generator.write_archive(args.archive, cycles=args.cycles, interval=args.interval)
+
+
+if __name__ == '__main__':
+    main()
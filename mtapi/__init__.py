@@ -0,0 +1 @@
+from mtapi.mtapi import Mtapi
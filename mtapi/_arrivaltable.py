@@ -0,0 +1,116 @@
+import numpy as np
+
+
+DIRECTIONS = ('N', 'S')
+DIRECTION_CODES = { d: i for i, d in enumerate(DIRECTIONS) }
+
+class _ArrivalTable(object):
+    '''Every upcoming arrival in a snapshot, stored as parallel arrays sorted by
+    (station, direction, time).
+
+    `offsets[i]:offsets[i + 1]` is the block of rows for station index i, so a
+    station's next trains in one direction are a slice rather than a sort.
+    Routes are stored as small integer codes into `route_names`. Feed slices
+    are truncated per station during ingest, so `station_routes` carries the
+    full set of routes seen at each station index.
+
+    `minutes` is each arrival's whole minutes after `reference_time`, the
+    update clock's "now" when the table was built (not a feed's header time),
+    so ETAs are computed once per snapshot.'''
+
+    __slots__ = ('station', 'route', 'direction', 'time', 'minutes', 'reference_time', 'offsets',
+                 'last_update', 'route_names', 'station_routes')
+
+    def __init__(self, station, route, direction, time, n_stations, route_names, last_update=None,
+                 station_routes=None, reference_time=None, presorted=False):
+        if not presorted:
+            order = np.lexsort((time, direction, station))
+            station, route, direction, time = station[order], route[order], direction[order], time[order]
+        self.station = station
+        self.route = route
+        self.direction = direction
+        self.time = time
+        self.reference_time = reference_time
+        if reference_time is None:
+            self.minutes = np.zeros(len(self.time), dtype=np.int32)
+        else:
+            self.minutes = ((self.time - reference_time) // 60).astype(np.int32)
+        self.offsets = np.searchsorted(self.station, np.arange(n_stations + 1))
+        self.route_names = tuple(route_names)
+        self.last_update = last_update if last_update is not None else np.zeros(n_stations, dtype=np.int64)
+        self.station_routes = station_routes if station_routes is not None else {}
+
+        for column in (self.station, self.route, self.direction, self.time, self.minutes, self.offsets,
+                       self.last_update):
+            column.flags.writeable = False
+
+    @classmethod
+    def from_slices(cls, feed_slices, n_stations, route_names, min_time=None):
+        '''Merge the columns of several feed slices, dropping rows before `min_time`,
+        which is also the reference time for `minutes`. Each station's
+        last_update is the newest timestamp of the feeds serving it.'''
+        feed_slices = [ s for s in feed_slices if len(s.time) ]
+        last_update = np.zeros(n_stations, dtype=np.int64)
+
+        station_routes = {}
+        for feed_slice in feed_slices:
+            for station_index, routes in feed_slice.station_routes.items():
+                if station_index in station_routes:
+                    station_routes[station_index] = station_routes[station_index] | routes
+                else:
+                    station_routes[station_index] = routes
+
+        if not feed_slices:
+            empty = np.empty(0, dtype=np.int64)
+            return cls(empty.astype(np.int32), empty.astype(np.int16), empty.astype(np.int8), empty,
+                       n_stations, route_names, last_update, station_routes, min_time)
+
+        for feed_slice in feed_slices:
+            np.maximum.at(last_update, feed_slice.station, feed_slice.timestamp)
+
+        station = np.concatenate([ s.station for s in feed_slices ])
+        route = np.concatenate([ s.route for s in feed_slices ])
+        direction = np.concatenate([ s.direction for s in feed_slices ])
+        time = np.concatenate([ s.time for s in feed_slices ])
+
+        if min_time is not None:
+            keep = time >= min_time
+            station, route, direction, time = station[keep], route[keep], direction[keep], time[keep]
+
+        return cls(station, route, direction, time, n_stations, route_names, last_update, station_routes, min_time)
+
+    def since(self, min_time):
+        '''The same table without rows before `min_time`, which becomes the
+        reference time. Rows stay in order, so nothing is sorted again.'''
+        keep = self.time >= min_time
+        return _ArrivalTable(self.station[keep], self.route[keep], self.direction[keep], self.time[keep],
+                             len(self.offsets) - 1, self.route_names, self.last_update, self.station_routes,
+                             min_time, presorted=True)
+
+    def __len__(self):
+        return len(self.time)
+
+    def _bounds(self, station_index, direction):
+        start, end = self.offsets[station_index], self.offsets[station_index + 1]
+        split = start + np.searchsorted(self.direction[start:end], 1)
+        return (start, split) if direction == 'N' else (split, end)
+
+    def trains(self, station_index, direction, limit=None):
+        '''(route, epoch_seconds, minutes) of the next trains, soonest first.'''
+        start, end = self._bounds(station_index, direction)
+        if limit is not None:
+            end = min(end, start + limit)
+
+        names = self.route_names
+        return [ (names[r], t, m) for r, t, m in zip(self.route[start:end].tolist(),
+                                                     self.time[start:end].tolist(),
+                                                     self.minutes[start:end].tolist()) ]
+
+    def routes(self, station_index):
+        '''Names of every route with an arrival at the station.'''
+        return set(self.station_routes.get(station_index, ()))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, c).nbytes for c in ('station', 'route', 'direction', 'time', 'minutes', 'offsets',
+                                                     'last_update'))
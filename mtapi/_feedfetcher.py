@@ -0,0 +1,213 @@
+import concurrent.futures, time, logging, hashlib
+import http.client, urllib.parse
+import queue, threading
+from mtaproto.feedresponse import header_timestamp
+
+
+logger = logging.getLogger(__name__)
+
+class FeedHTTPError(Exception):
+    def __init__(self, code, reason):
+        super(FeedHTTPError, self).__init__('HTTP %d %s' % (code, reason))
+        self.code = code
+
+
+class FeedResult(object):
+    '''Outcome of fetching one feed: the raw body (or None on failure), how long
+    the request took and the error, if any. `not_modified` is set when the feed
+    is known to be unchanged since the last successful fetch, in which case
+    `data` is None and the caller should reuse what it already has.'''
+
+    def __init__(self, url, data=None, latency=None, error=None, not_modified=False):
+        self.url = url
+        self.data = data
+        self.latency = latency
+        self.error = error
+        self.not_modified = not_modified
+
+    def __bool__(self):
+        return self.data is not None
+
+
+class _ConnectionPool(object):
+    '''Keeps idle keep-alive connections per (scheme, host, port) so repeated
+    polls of the same endpoint skip the TCP and TLS handshakes.'''
+
+    def __init__(self, timeout, max_idle=8):
+        self.TIMEOUT = timeout
+        self.MAX_IDLE = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _queue(self, origin):
+        with self._lock:
+            if origin not in self._idle:
+                self._idle[origin] = queue.LifoQueue(self.MAX_IDLE)
+            return self._idle[origin]
+
+    def get(self, origin):
+        '''Return (connection, reused).'''
+        try:
+            return self._queue(origin).get_nowait(), True
+        except queue.Empty:
+            scheme, host, port = origin
+            cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            return cls(host, port, timeout=self.TIMEOUT), False
+
+    def put(self, origin, conn):
+        try:
+            self._queue(origin).put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for q in idle.values():
+            while not q.empty():
+                q.get_nowait().close()
+
+
+class _FeedFetcher(object):
+    '''Fetches a set of feed URLs concurrently on a long-lived thread pool.
+
+    Each request is bounded by `timeout` seconds; the whole batch is bounded by
+    `deadline` seconds, after which feeds still in flight are reported as
+    failed and left to finish (or time out) in the background.
+
+    Connections are pooled and requests are conditional: a 304, an identical
+    body or an unchanged FeedMessage header timestamp all come back as
+    `not_modified` so the caller can skip decoding the feed again. Feeds
+    that miss the deadline are forgotten, and a request given up on that
+    completes later doesn't store validators for a body nobody decoded.
+
+    If a `recorder` is given, every new body is passed to its record() method
+    along with the time the batch started.'''
+
+    def __init__(self, key, workers=8, timeout=10, deadline=30, recorder=None):
+        self._KEY = key
+        self.WORKERS = workers
+        self.TIMEOUT = timeout
+        self.DEADLINE = deadline
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='mtapi-fetch')
+        self._pool = _ConnectionPool(timeout, max_idle=workers)
+        self._validators = {}
+        # bumped by forget(), so requests already in flight can tell their
+        # result was discarded
+        self._generations = {}
+        self._validators_lock = threading.Lock()
+        self._recorder = recorder
+
+    def _request(self, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        origin = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+
+        conn, reused = self._pool.get(origin)
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            if not reused:
+                raise
+            # the server may have dropped an idle keep-alive connection
+            return self._request(url, headers)
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._pool.put(origin, conn)
+
+        return response, data
+
+    def fetch_one(self, url):
+        start = time.monotonic()
+        with self._validators_lock:
+            generation = self._generations.get(url, 0)
+            validators = self._validators.get(url, {})
+
+        headers = { 'x-api-key': self._KEY }
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            headers['If-Modified-Since'] = validators['last_modified']
+
+        try:
+            response, data = self._request(url, headers)
+        except (http.client.HTTPException, OSError) as e:
+            return FeedResult(url, None, time.monotonic() - start, e)
+
+        latency = time.monotonic() - start
+
+        if response.status == 304:
+            return FeedResult(url, None, latency, not_modified=True)
+        elif response.status != 200:
+            return FeedResult(url, None, latency, FeedHTTPError(response.status, response.reason))
+
+        digest = hashlib.sha1(data).digest()
+        timestamp = header_timestamp(data)
+        unchanged = validators.get('digest') == digest or \
+            (timestamp is not None and validators.get('timestamp') == timestamp)
+
+        stored = {
+            'digest': digest,
+            'timestamp': timestamp
+        }
+        if response.getheader('ETag'):
+            stored['etag'] = response.getheader('ETag')
+        if response.getheader('Last-Modified'):
+            stored['last_modified'] = response.getheader('Last-Modified')
+
+        with self._validators_lock:
+            if self._generations.get(url, 0) == generation:
+                self._validators[url] = stored
+
+        if unchanged:
+            return FeedResult(url, None, latency, not_modified=True)
+
+        return FeedResult(url, data, latency)
+
+    def forget(self, url):
+        '''Drop the stored validators for `url`, so its next fetch is unconditional.'''
+        with self._validators_lock:
+            self._validators.pop(url, None)
+            self._generations[url] = self._generations.get(url, 0) + 1
+
+    def fetch_all(self, urls):
+        '''Fetch every URL, returning FeedResults in the same order as `urls`.'''
+        captured_at = time.time()
+        start = time.monotonic()
+        futures = [ self._executor.submit(self.fetch_one, url) for url in urls ]
+        concurrent.futures.wait(futures, timeout=self.DEADLINE)
+
+        results = []
+        for url, future in zip(urls, futures):
+            if future.done():
+                result = future.result()
+            else:
+                # the request is most likely running already and can't be cancelled
+                future.cancel()
+                self.forget(url)
+                result = FeedResult(url, None, time.monotonic() - start,
+                                    TimeoutError('deadline of %ss exceeded' % self.DEADLINE))
+            results.append(result)
+
+        for result in results:
+            if result.error:
+                logger.error('Couldn\'t load feed %s (%.3fs): %s', result.url, result.latency, result.error)
+            elif result.not_modified:
+                logger.info('Feed %s not modified (%.3fs)', result.url, result.latency)
+            else:
+                logger.info('Loaded feed %s in %.3fs', result.url, result.latency)
+
+        if self._recorder:
+            self._recorder.record(captured_at, results)
+
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._pool.close()
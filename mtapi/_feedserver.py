@@ -0,0 +1,166 @@
+import threading, time, logging, hashlib
+import urllib.parse
+from email.utils import formatdate
+from mtapi._replay import rebase_feed
+from mtaproto.feedresponse import header_timestamp
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+logger = logging.getLogger(__name__)
+
+class _FeedRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        feed = self.server.feeds.get(urllib.parse.unquote(self.path))
+        if feed is None:
+            self.send_error(404)
+            return
+
+        data, delay, hold, etag, last_modified = feed
+        if delay:
+            time.sleep(delay)
+        if hold is not None:
+            hold()
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-protobuf')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class StandInFeedServer(object):
+    '''A local HTTP server standing in for the MTA feed endpoint, for tests and
+    benchmarks. Feeds are registered by their real URL and served at the same
+    path on localhost, optionally after an artificial delay or a `hold`
+    callable returns, or played back from a FeedArchive with play().'''
+
+    PLAYER_POLL = 0.01
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._httpd = ThreadingHTTPServer((host, port), _FeedRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.feeds = {}
+        self._httpd.connections = 0
+        self._httpd.stats_lock = threading.Lock()
+        self._thread = None
+        self._player = None
+        self._stopping = threading.Event()
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    @property
+    def connections(self):
+        '''Number of TCP connections accepted so far.'''
+        return self._httpd.connections
+
+    def url_for(self, feed_url):
+        '''Local URL serving the feed registered as `feed_url`.'''
+        return self.base_url + urllib.parse.urlsplit(feed_url).path
+
+    def set_feed(self, feed_url, data, delay=0, hold=None):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(feed_url).path)
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        self._httpd.feeds[path] = (data, delay, hold, etag, formatdate(usegmt=True))
+        return self.url_for(feed_url)
+
+    def play(self, archive, speed=1.0, rebase=False, loop=False, clock=None):
+        '''Serve the recorded cycles of a FeedArchive in a background thread,
+        switching feeds as recorded time passes at `speed` times real time.
+        With `rebase`, timestamps inside each feed are shifted so the recording
+        looks live. Returns the local URL of every recorded feed.
+
+        `clock` replaces time.time as the source of real time, which lets a
+        test move playback along by setting the time; the player then checks
+        it every PLAYER_POLL seconds rather than sleeping until a cycle is due.'''
+        feeds = archive.feeds()
+        cycles = []
+        for key, feed_url in feeds.items():
+            cycles.extend((t, feed_url, key) for t in archive.captures(key))
+        cycles.sort()
+        if not cycles:
+            raise ValueError('No recorded feeds in %s' % archive.root)
+
+        first = cycles[0][0]
+        ready = threading.Event()
+        published = {}
+        poll = None if clock is None else self.PLAYER_POLL
+        clock = clock or time.time
+
+        def publish(captured_at, feed_url, key):
+            data = archive.read(key, captured_at)
+            if rebase:
+                # shift the header to now, but keep it increasing per feed: at
+                # high speeds several cycles land in the same second, and a
+                # repeated header timestamp reads as an unchanged feed
+                recorded = header_timestamp(data)
+                if recorded is None:
+                    offset = clock() - captured_at
+                else:
+                    offset = max(int(clock()), published.get(key, 0) + 1) - recorded
+                    published[key] = recorded + offset
+                data = rebase_feed(data, offset)
+            self.set_feed(feed_url, data)
+
+        def run():
+            started = clock()
+            while True:
+                for captured_at, feed_url, key in cycles:
+                    wait = started + (captured_at - first) / speed - clock()
+                    while wait > 0:
+                        ready.set()
+                        if self._stopping.wait(wait if poll is None else min(wait, poll)):
+                            return
+                        wait = started + (captured_at - first) / speed - clock()
+                    publish(captured_at, feed_url, key)
+
+                ready.set()
+                if not loop or self._stopping.is_set() or cycles[-1][0] == first:
+                    return
+                started = clock()
+
+        self._player = threading.Thread(target=run)
+        self._player.daemon = True
+        self._player.start()
+
+        # the first cycle is being served before play() returns
+        ready.wait()
+        return [ self.url_for(feed_url) for feed_url in feeds.values() ]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
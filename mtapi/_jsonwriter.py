@@ -0,0 +1,59 @@
+import os, json, tempfile, threading, logging
+
+
+logger = logging.getLogger(__name__)
+
+class BackgroundJSONWriter(object):
+    '''Writes JSON documents to one file from a background thread.
+
+    Each write goes to a temporary file in the same directory that is then
+    renamed over the target, so readers never see a half-written file. If
+    several documents are submitted while a write is in progress, only the
+    newest is written.'''
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = None
+        self._writing = False
+        self._lock = threading.Condition()
+
+    def submit(self, data):
+        with self._lock:
+            self._pending = data
+            if self._writing:
+                return
+            self._writing = True
+
+        thread = threading.Thread(target=self._run, name='json-writer')
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                data, self._pending = self._pending, None
+                if data is None:
+                    self._writing = False
+                    self._lock.notify_all()
+                    return
+
+            try:
+                self._write(data)
+            except (IOError, OSError, TypeError, ValueError) as e:
+                logger.error('Couldn\'t write %s: %s', self.path, e)
+
+    def _write(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def flush(self, timeout=None):
+        '''Wait until every submitted document has been written.'''
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._writing, timeout)
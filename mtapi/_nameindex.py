@@ -0,0 +1,83 @@
+import bisect, re, unicodedata
+from collections import defaultdict
+
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+def normalize(name):
+    '''Lowercase with accents stripped and every run of other characters than
+    letters and digits as one space: "Times Sq-42 St" is "times sq 42 st".'''
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c)).lower()
+    return _NON_WORD.sub(' ', name).strip()
+
+class _NameIndex(object):
+    '''Station names for exact lookup and prefix completion, by normalized name.
+
+    `lookup` finds stations by their whole name or by one part of a complex's
+    "A / B" name. For completion every station is also filed under each
+    later word of those, in one sorted list searched by bisection; matches at
+    the start of the whole name rank first, then the start of a part, then a
+    later word, then shorter names.'''
+
+    __slots__ = ('names', '_exact', '_keys', '_entries', '_short')
+
+    def __init__(self, names):
+        '''`names` are the stations' names in index order.'''
+        self.names = tuple(names)
+        self._exact = defaultdict(list)
+
+        keyed = []
+        for i, name in enumerate(self.names):
+            full = normalize(name)
+            parts = [ p for p in (normalize(p) for p in name.split('/')) if p ]
+            for key in set([full] + parts):
+                self._exact[key].append(i)
+
+            keyed.append((full, 0, i))
+            for part in parts:
+                words = part.split(' ')
+                for w in range(len(words)):
+                    key = ' '.join(words[w:])
+                    if key != full:
+                        keyed.append((key, 1 if w == 0 else 2, i))
+
+        keyed.sort()
+        self._keys = [ key for key, _, _ in keyed ]
+        self._entries = [ (rank, len(self.names[i]), self.names[i]) for _, rank, i in keyed ]
+        # one or two letters match a large share of the list; those are ranked
+        # once, in full, per prefix
+        self._short = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, name):
+        '''Indices of the stations called `name`, in any case or punctuation.'''
+        return list(self._exact.get(normalize(name), ()))
+
+    def complete(self, prefix, limit=10):
+        '''Up to `limit` distinct station names matching what has been typed so
+        far, best first.'''
+        prefix = normalize(prefix)
+        if not prefix or limit < 1:
+            return []
+        if len(prefix) <= 2:
+            if prefix not in self._short:
+                self._short[prefix] = self._complete(prefix, None)
+            return self._short[prefix][:limit]
+        return self._complete(prefix, limit)
+
+    def _complete(self, prefix, limit):
+        start = bisect.bisect_left(self._keys, prefix)
+        end = bisect.bisect_left(self._keys, prefix + '\x7f', start)
+
+        out = []
+        seen = set()
+        for _, _, name in sorted(self._entries[start:end]):
+            if name not in seen:
+                seen.add(name)
+                out.append(name)
+                if len(out) == limit:
+                    break
+        return out
@@ -0,0 +1,151 @@
+import os, tempfile, logging
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+class _PathMatrix(object):
+    '''Fewest-stops paths between every pair of stations of a _TransitGraph,
+    precomputed as three int16 station x station matrices:
+
+        hops[s, t]       stops from s to t, -1 if t can't be reached
+        transfers[s, t]  changes of route needed on the path next_hop gives
+        next_hop[s, t]   the station after s on the way to t, -1 at t itself
+
+    Following next_hop from s reaches t in hops[s, t] steps. Among the
+    shortest paths to each target, the next hops are picked to keep
+    transfers low, but one next hop per pair can't always continue on the
+    route that the fewest transfers from an earlier station ride in on.
+
+    The matrices are saved under a name made from the graph's digest, so a
+    changed graph gets a new file and the old one is removed. Loading maps
+    the file instead of reading it.'''
+
+    __slots__ = ('hops', 'transfers', 'next_hop', 'digest')
+
+    def __init__(self, data, digest):
+        self.hops, self.transfers, self.next_hop = data
+        self.digest = digest
+
+    @classmethod
+    def build(cls, graph):
+        '''Breadth-first from every target over the graph's edges. A station's
+        next hop is chosen among its neighbours one stop closer to the target,
+        by the fewest legs needed from there on: the rest of that neighbour's
+        path, continued on one of the routes that can start it; the first
+        neighbour found wins a tie. Routes that can start the path are only
+        kept from the chosen neighbour, so transfers always count along the
+        path next_hop follows.'''
+        n = len(graph)
+        data = np.full((3, n, n), -1, dtype=np.int16)
+        hops, transfers, next_hop = data
+
+        # route codes on each edge, and each station's distinct neighbours
+        edge_routes = {}
+        for a in range(n):
+            start, end = graph.indptr[a], graph.indptr[a + 1]
+            for b, route in zip(graph.indices[start:end].tolist(), graph.edge_routes[start:end].tolist()):
+                edge_routes.setdefault((a, b), set()).add(route)
+        adjacency = [ [] for _ in range(n) ]
+        for a, b in edge_routes:
+            adjacency[a].append(b)
+
+        for target in range(n):
+            # per station reached: legs to the target, and the routes that can
+            # ride the first of them
+            legs = { target: 0 }
+            starts = { target: None }
+            frontier = [target]
+            depth = 0
+            hops[target, target] = 0
+            while frontier:
+                depth += 1
+                candidates = {}
+                for p in frontier:
+                    for v in adjacency[p]:
+                        if v in legs:
+                            continue
+                        routes = edge_routes[v, p]
+                        if starts[p] is None:
+                            cost, first = 1, routes
+                        elif routes & starts[p]:
+                            cost, first = legs[p], routes & starts[p]
+                        else:
+                            cost, first = legs[p] + 1, routes
+                        best = candidates.get(v)
+                        if best is None or cost < best[0]:
+                            candidates[v] = (cost, first, p)
+
+                frontier = sorted(candidates)
+                for v in frontier:
+                    cost, first, p = candidates[v]
+                    legs[v], starts[v] = cost, first
+                    hops[v, target] = depth
+                    transfers[v, target] = cost - 1
+                    next_hop[v, target] = p
+
+        transfers[np.arange(n), np.arange(n)] = 0
+        return cls(data, graph.digest())
+
+    @classmethod
+    def load(cls, graph, cache_dir):
+        '''The matrices for `graph` from `cache_dir`, built and saved there
+        first if no file matches the graph.'''
+        digest = graph.digest()
+        path = os.path.join(cache_dir, 'pathmatrix-%s.npy' % digest)
+        if os.path.isfile(path):
+            try:
+                return cls(np.load(path, mmap_mode='r'), digest)
+            except (IOError, OSError, ValueError) as e:
+                logger.error('Couldn\'t load %s: %s', path, e)
+
+        matrix = cls.build(graph)
+        try:
+            matrix.save(path)
+        except (IOError, OSError) as e:
+            logger.error('Couldn\'t save %s: %s', path, e)
+            return matrix
+
+        for name in os.listdir(cache_dir):
+            if name.startswith('pathmatrix-') and name.endswith('.npy') and name != os.path.basename(path):
+                try:
+                    os.unlink(os.path.join(cache_dir, name))
+                except OSError:
+                    pass  # still mapped elsewhere
+        return matrix
+
+    def save(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.stack([ self.hops, self.transfers, self.next_hop ]))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def path(self, source, target):
+        '''Station indices from source to target, or None if not connected.'''
+        if self.hops[source, target] < 0:
+            return None
+
+        path = [source]
+        next_hop = self.next_hop
+        while path[-1] != target:
+            path.append(int(next_hop[path[-1], target]))
+        return path
+
+    def shortest_path(self, sources, targets):
+        '''The fewest-stops path from any of `sources` to any of `targets`, with
+        the fewest transfers among those, or None if they aren't connected.'''
+        hops, transfers = self.hops, self.transfers
+        best = None
+        for s in sources:
+            for t in targets:
+                h = int(hops[s, t])
+                if h >= 0 and (best is None or (h, int(transfers[s, t])) < best[0]):
+                    best = ((h, int(transfers[s, t])), s, t)
+
+        return None if best is None else self.path(best[1], best[2])
@@ -0,0 +1,192 @@
+from mtapi._transitgraph import TRANSFER
+
+
+TRANSFER_SECONDS = 60
+
+class Journey(object):
+    '''A planned trip through the transit graph.
+
+    `stations` and `names` list every station passed, in order. `legs` split
+    the trip into rides on one route, each {'route', 'from', 'to', 'stops'}
+    with station IDs, and `transfers` are the stations where one leg ends and
+    the next begins.
+
+    A journey planned on live trips also has `depart` and `arrive` epoch
+    seconds, and each of its legs adds the 'trip' ridden, its 'depart' and
+    'arrive' times and the seconds spent waiting for it, 'wait'.'''
+
+    def __init__(self, graph, path, legs, depart=None, arrive=None):
+        self.stations = [ graph.ids[i] for i in path ]
+        self.names = [ graph.names[i] for i in path ]
+        self.legs = legs
+        self.routes = [ leg['route'] for leg in legs ]
+        self.transfers = [ leg['from'] for leg in legs[1:] ]
+        self.depart = depart
+        self.arrive = arrive
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def serialize(self):
+        out = {
+            'stations': [ { 'id': i, 'name': name } for i, name in zip(self.stations, self.names) ],
+            'legs': [ dict(leg) for leg in self.legs ],
+            'routes': list(self.routes),
+            'transfers': list(self.transfers)
+        }
+        if self.arrive is not None:
+            out['depart'] = self.depart
+            out['arrive'] = self.arrive
+        return out
+
+
+def _legs(graph, path):
+    '''Cover the path with as few single-route legs as possible: each leg takes
+    the route that runs furthest from where it starts, which is optimal for a
+    fixed sequence of stations.'''
+    hops = [ graph.routes_between(a, b) for a, b in zip(path, path[1:]) ]
+
+    legs = []
+    start = 0
+    while start < len(hops):
+        best_route, best_end = None, start
+        for route in sorted(hops[start]):
+            end = start
+            while end < len(hops) and route in hops[end]:
+                end += 1
+            if end > best_end:
+                best_route, best_end = route, end
+
+        legs.append({
+            'route': best_route,
+            'from': graph.ids[path[start]],
+            'to': graph.ids[path[best_end]],
+            'stops': best_end - start
+        })
+        start = best_end
+
+    return legs
+
+def plan(graph, sources, targets, matrix=None):
+    '''The fewest-stops Journey from any station index in `sources` to any in
+    `targets`, or None if the graph doesn't connect them. With the graph's
+    _PathMatrix the path is read off it rather than searched for.'''
+    if matrix is not None:
+        path = matrix.shortest_path(sources, targets)
+    else:
+        path = graph.shortest_path(sources, targets)
+    if path is None:
+        return None
+    return Journey(graph, path, _legs(graph, path))
+
+def earliest_arrival(graph, timetable, sources, targets, depart, transfer_seconds=TRANSFER_SECONDS):
+    '''The Journey on live trips that reaches any station index in `targets`
+    soonest, leaving any in `sources` at or after `depart`, or None if no
+    trip in the timetable gets there.
+
+    This is a connection scan: rides are walked once in departure order, a
+    trip becomes usable at the first stop where it can be caught, and a
+    station's arrival time improves whenever a usable ride reaches it sooner.
+    Changing trains takes the station's own transfer time from the graph, or
+    `transfer_seconds` where it has none; staying on board takes none.
+    Transfers to other stations are walked as soon as a station is reached.
+    The scan stops at the first ride leaving after the best arrival found.'''
+    targets = set(targets)
+    if targets.intersection(sources):
+        first = min(targets.intersection(sources))
+        return Journey(graph, [first], [], depart, depart)
+
+    never = float('inf')
+    arrival = [never] * len(graph)
+    ready = [never] * len(graph)
+    change = [ s if s >= 0 else transfer_seconds for s in graph.transfer_seconds.tolist() ]
+    # per station, the (boarding, alighting) rows of the ride that reached it,
+    # or (None, station) for a transfer walked from another station
+    via = [None] * len(graph)
+    boarded = [-1] * len(timetable.trip_ids)
+    best = never
+
+    def walk(a, time):
+        # relaxes every transfer out of a; returns the best target arrival
+        reached = never
+        for b, seconds in graph.footpaths(a):
+            if time + seconds < arrival[b]:
+                arrival[b] = ready[b] = time + seconds
+                via[b] = (None, a)
+                if b in targets:
+                    reached = min(reached, time + seconds)
+        return reached
+
+    for i in sources:
+        arrival[i] = ready[i] = depart
+    for i in sources:
+        best = min(best, walk(i, depart))
+
+    rows = timetable.rows
+    for c in range(timetable.first_departing(depart), len(rows)):
+        dep_time, arr_time, a, b, trip = rows[c]
+        if dep_time >= best:
+            break
+        if boarded[trip] < 0:
+            if ready[a] > dep_time:
+                continue
+            boarded[trip] = c
+        if arr_time < arrival[b]:
+            arrival[b] = arr_time
+            ready[b] = arr_time + change[b]
+            via[b] = (boarded[trip], c)
+            if b in targets and arr_time < best:
+                best = arr_time
+            if graph.footpaths(b):
+                best = min(best, walk(b, arr_time))
+
+    if best == never:
+        return None
+
+    # walk back from the target, one leg at a time
+    steps = []
+    station = min(targets, key=arrival.__getitem__)
+    while via[station] is not None:
+        steps.append((via[station], station))
+        board, alight = via[station]
+        station = alight if board is None else rows[board][2]
+    steps.reverse()
+
+    path = [station]
+    legs = []
+    previous = depart
+    for (board, alight), station in steps:
+        if board is None:
+            legs.append({
+                'route': TRANSFER,
+                'from': graph.ids[path[-1]],
+                'to': graph.ids[station],
+                'stops': 1,
+                'trip': None,
+                'depart': previous,
+                'arrive': arrival[station],
+                'wait': 0
+            })
+            previous = arrival[station]
+            path.append(station)
+            continue
+
+        trip = rows[board][4]
+        stops = [ rows[c][3] for c in range(board, alight + 1) if rows[c][4] == trip ]
+        legs.append({
+            'route': timetable.route_names[int(timetable.route[board])],
+            'from': graph.ids[path[-1]],
+            'to': graph.ids[station],
+            'stops': len(stops),
+            'trip': timetable.trip_ids[trip],
+            'depart': rows[board][0],
+            'arrive': rows[alight][1],
+            'wait': rows[board][0] - previous
+        })
+        previous = rows[alight][1]
+        path.extend(stops)
+
+    return Journey(graph, path, legs, depart, best)
@@ -0,0 +1,173 @@
+import os, json, time, bisect, logging
+import urllib.parse
+from mtaproto import nyct_subway_pb2
+from mtapi._feedfetcher import FeedResult
+
+
+logger = logging.getLogger(__name__)
+
+def feed_key(feed_url):
+    '''Archive directory name for a feed URL, e.g. nyct-gtfs-l. The host is
+    ignored so recordings replay under any base URL.'''
+    path = urllib.parse.unquote(urllib.parse.urlsplit(feed_url).path)
+    return path.strip('/').rsplit('mtagtfsfeeds/', 1)[-1].replace('/', '-')
+
+
+class FeedArchive(object):
+    '''A directory of raw feed bodies, one subdirectory per feed and one file per
+    poll cycle named by the cycle's epoch time in milliseconds:
+
+        <root>/feeds.json               feed key -> original URL
+        <root>/nyct-gtfs-l/1700000000000.pb
+    '''
+
+    INDEX = 'feeds.json'
+
+    def __init__(self, root):
+        self.root = root
+        self._urls = {}
+        index = os.path.join(root, self.INDEX)
+        if os.path.isfile(index):
+            with open(index, 'r') as f:
+                self._urls = json.load(f)
+
+    def feeds(self):
+        '''Feed keys in the archive, mapped to the URL they were recorded from.'''
+        return dict(self._urls)
+
+    def captures(self, key):
+        '''Sorted capture times (epoch seconds) recorded for a feed.'''
+        directory = os.path.join(self.root, key)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(name[:-3]) / 1000.0 for name in os.listdir(directory) if name.endswith('.pb'))
+
+    def path(self, key, captured_at):
+        return os.path.join(self.root, key, '%d.pb' % round(captured_at * 1000))
+
+    def read(self, key, captured_at):
+        with open(self.path(key, captured_at), 'rb') as f:
+            return f.read()
+
+    def write(self, feed_url, captured_at, data):
+        key = feed_key(feed_url)
+        os.makedirs(os.path.join(self.root, key), exist_ok=True)
+        with open(self.path(key, captured_at), 'wb') as f:
+            f.write(data)
+
+        if self._urls.get(key) != feed_url:
+            self._urls[key] = feed_url
+            with open(os.path.join(self.root, self.INDEX), 'w') as f:
+                json.dump(self._urls, f, sort_keys=True, indent=4)
+
+
+class FeedRecorder(object):
+    '''Archives every new feed body a _FeedFetcher downloads. Bodies fetched in
+    the same fetch_all call share the cycle's capture time.'''
+
+    def __init__(self, root):
+        self.archive = FeedArchive(root)
+
+    def record(self, captured_at, results):
+        for result in results:
+            if result:
+                self.archive.write(result.url, captured_at, result.data)
+
+
+class ReplayFeedSource(object):
+    '''Serves archived feeds in place of _FeedFetcher, so Mtapi can run offline:
+
+        source = ReplayFeedSource('recordings/monday')
+        mta = Mtapi(key, stations_file, feed_source=source, clock=source.clock)
+
+    With `speed` None every fetch_all steps to the next recorded cycle. With a
+    speed, recorded time advances with the wall clock at that multiple from
+    `start` (default: the first cycle). clock() returns the current recorded
+    time, which Mtapi should use as "now" so recorded arrivals aren't in the
+    past.'''
+
+    def __init__(self, root, speed=None, start=None, loop=False):
+        self.archive = FeedArchive(root)
+        self.speed = speed
+        self.loop = loop
+        self._captures = { key: self.archive.captures(key) for key in self.archive.feeds() }
+        self._cycles = sorted(set(t for times in self._captures.values() for t in times))
+        if not self._cycles:
+            raise ValueError('No recorded feeds in %s' % root)
+
+        self._start = start if start is not None else self._cycles[0]
+        self._started = time.monotonic()
+        self._cycle = bisect.bisect_right(self._cycles, self._start) - 1
+        self._stepped = False
+        self._served = {}
+
+    def clock(self):
+        if self.speed is None:
+            return self._cycles[max(self._cycle, 0)]
+
+        elapsed = (time.monotonic() - self._started) * self.speed
+        now = self._start + elapsed
+        if self.loop:
+            span = self._cycles[-1] - self._start
+            if span > 0:
+                now = self._start + elapsed % span
+        return now
+
+    def _advance(self):
+        if self.speed is not None:
+            return
+        if self._stepped:
+            if self._cycle + 1 < len(self._cycles):
+                self._cycle += 1
+            elif self.loop:
+                self._cycle = 0
+        self._stepped = True
+
+    def fetch_one(self, url, now):
+        key = feed_key(url)
+        times = self._captures.get(key, [])
+        i = bisect.bisect_right(times, now) - 1
+        if i < 0:
+            return FeedResult(url, None, 0.0, LookupError('no recording of %s before %s' % (key, now)))
+
+        if self._served.get(url) == times[i]:
+            return FeedResult(url, None, 0.0, not_modified=True)
+
+        self._served[url] = times[i]
+        return FeedResult(url, self.archive.read(key, times[i]), 0.0)
+
+    def fetch_all(self, urls):
+        self._advance()
+        now = self.clock()
+        return [ self.fetch_one(url, now) for url in urls ]
+
+    def forget(self, url):
+        self._served.pop(url, None)
+
+    def shutdown(self):
+        pass
+
+
+def rebase_feed(data, offset):
+    '''Shift every timestamp in a serialized FeedMessage by `offset` seconds, so
+    an old recording looks current to a client using the wall clock.'''
+    msg = nyct_subway_pb2.gtfs__realtime__pb2.FeedMessage()
+    msg.ParseFromString(data)
+    offset = int(offset)
+
+    if msg.header.timestamp:
+        msg.header.timestamp += offset
+
+    for entity in msg.entity:
+        if entity.HasField('trip_update'):
+            if entity.trip_update.timestamp:
+                entity.trip_update.timestamp += offset
+            for update in entity.trip_update.stop_time_update:
+                if update.arrival.time:
+                    update.arrival.time += offset
+                if update.departure.time:
+                    update.departure.time += offset
+        if entity.HasField('vehicle') and entity.vehicle.timestamp:
+            entity.vehicle.timestamp += offset
+
+    return msg.SerializeToString()
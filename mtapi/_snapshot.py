@@ -0,0 +1,45 @@
+import types
+
+
+class _Snapshot(object):
+    '''Station data published by one update. A snapshot is never modified after
+    it is created: the updater builds a new one and swaps the reference, so
+    readers can hold on to whichever snapshot they picked up without locking.
+
+    `generation` increases by one with every published snapshot and can be used
+    as a cache key for anything derived from it.
+
+    `route_stations` lists each route's stations once, in line order, and
+    `station_routes` maps every station ID to the sorted routes serving it.
+    `graph` is the _TransitGraph of the track the feeds have shown so far; it
+    is shared between snapshots until that changes. `timetable` holds the
+    upcoming rides of every live trip, for time-dependent planning.
+
+    `fragments` is the one mutable part: a cache of encoded or serialized
+    output derived from this snapshot, filled on demand and dropped along
+    with it.'''
+
+    __slots__ = ('generation', 'stations', 'routes', 'last_update', 'arrivals', 'route_stations', 'station_routes',
+                 'graph', 'timetable', 'fragments')
+
+    def __init__(self, generation, stations, routes, last_update, arrivals, route_stations=None,
+                 station_routes=None, graph=None, timetable=None):
+        set_ = super(_Snapshot, self).__setattr__
+        set_('generation', generation)
+        set_('stations', types.MappingProxyType(stations))
+        set_('routes', types.MappingProxyType({ r: frozenset(s) for r, s in routes.items() }))
+        set_('last_update', last_update)
+        set_('arrivals', arrivals)
+        set_('route_stations', types.MappingProxyType({ r: tuple(s) for r, s in (route_stations or {}).items() }))
+        set_('station_routes', types.MappingProxyType(
+            { k: tuple(sorted(r)) for k, r in (station_routes or {}).items() }))
+        set_('graph', graph)
+        set_('timetable', timetable)
+        set_('fragments', {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError('_Snapshot is immutable')
+
+    def __repr__(self):
+        return '<_Snapshot generation=%d stations=%d routes=%d>' % (
+            self.generation, len(self.stations), len(self.routes))
@@ -0,0 +1,131 @@
+import math, heapq
+import numpy as np
+
+
+EARTH_RADIUS_KM = 6371.0088
+EARTH_RADIUS_MILES = 3958.7613
+
+def _unit_vector(point):
+    lat, lon = math.radians(point[0]), math.radians(point[1])
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+def _chord_to_km(chord_sq):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_sq) / 2))
+
+def _km_to_chord(km):
+    return 2 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2)
+
+def haversine(p1, p2):
+    '''Great-circle distance in km between two (lat, lon) points.'''
+    lat1, lon1, lat2, lon2 = map(math.radians, (p1[0], p1[1], p2[0], p2[1]))
+    a = math.sin((lat2 - lat1) / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def _radians(points):
+    return np.radians(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+
+def haversine_matrix(points, locations, earth_radius=EARTH_RADIUS_KM):
+    '''Great-circle distances from one or many (lat, lon) points to every
+    location in one vectorized pass: shape (len(locations),) for a single
+    point, (len(points), len(locations)) for a sequence of points. `locations`
+    may be an (n, 2) array of degrees or a precomputed _StationIndex.
+    Distances are in the unit of `earth_radius`.'''
+    single = np.ndim(points) == 1
+    p = _radians(points)
+    if isinstance(locations, _StationIndex):
+        lat, lon, cos_lat = locations._lat, locations._lon, locations._cos_lat
+    else:
+        q = _radians(locations)
+        lat, lon, cos_lat = q[:, 0], q[:, 1], np.cos(q[:, 0])
+
+    p_lat, p_lon = p[:, 0:1], p[:, 1:2]
+    a = np.sin((lat - p_lat) / 2)**2 + np.cos(p_lat) * cos_lat * np.sin((lon - p_lon) / 2)**2
+    d = 2 * earth_radius * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    return d[0] if single else d
+
+
+class _StationIndex(object):
+    '''A static k-d tree over station locations for nearest and radius queries.
+
+    Locations are stored as unit vectors on the sphere: straight-line (chord)
+    distance between them orders points exactly as great-circle distance does,
+    so the tree can prune with plain coordinate differences and the results
+    are still geodesically correct. Distances are returned in km.
+
+    The tree is implicit: `_order` holds point indices arranged so that the
+    node for range [lo, hi) is at the middle of it, split on axis depth % 3.
+
+    The locations are also kept as a coordinate matrix in radians for
+    distances(), which measures every station at once.'''
+
+    def __init__(self, points):
+        coordinates = _radians(points)
+        self._lat, self._lon = coordinates[:, 0], coordinates[:, 1]
+        self._cos_lat = np.cos(self._lat)
+        self._vectors = [ _unit_vector(p) for p in points ]
+        self._order = list(range(len(points)))
+        self._build(0, len(self._order), 0)
+
+    def __len__(self):
+        return len(self._order)
+
+    def distances(self, points, earth_radius=EARTH_RADIUS_KM):
+        '''Distances from one point, or each of many, to every indexed location;
+        see haversine_matrix.'''
+        return haversine_matrix(points, self, earth_radius)
+
+    def _build(self, lo, hi, depth):
+        if hi - lo <= 1:
+            return
+        axis = depth % 3
+        self._order[lo:hi] = sorted(self._order[lo:hi], key=lambda i: self._vectors[i][axis])
+        mid = (lo + hi) // 2
+        self._build(lo, mid, depth + 1)
+        self._build(mid + 1, hi, depth + 1)
+
+    def _search(self, q, lo, hi, depth, visit, bound):
+        '''Walk the subtree for [lo, hi), nearer side first, calling visit(i, d2)
+        for each point; bound() is the current squared search radius.'''
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        i = self._order[mid]
+        v = self._vectors[i]
+        d2 = (v[0] - q[0])**2 + (v[1] - q[1])**2 + (v[2] - q[2])**2
+        if d2 <= bound():
+            visit(i, d2)
+
+        diff = q[depth % 3] - v[depth % 3]
+        near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+        self._search(q, near[0], near[1], depth + 1, visit, bound)
+        if diff * diff <= bound():
+            self._search(q, far[0], far[1], depth + 1, visit, bound)
+
+    def nearest(self, point, k=1):
+        '''The k points nearest to `point` as [(distance_km, index)], nearest first.'''
+        if k <= 0:
+            return []
+        q = _unit_vector(point)
+        best = []  # max-heap of (-d2, -index)
+
+        def visit(i, d2):
+            if len(best) < k:
+                heapq.heappush(best, (-d2, -i))
+            elif (-d2, -i) > best[0]:
+                heapq.heapreplace(best, (-d2, -i))
+
+        def bound():
+            return -best[0][0] if len(best) >= k else float('inf')
+
+        self._search(q, 0, len(self._order), 0, visit, bound)
+        return [ (_chord_to_km(-d2), -i) for d2, i in sorted(best, reverse=True) ]
+
+    def within(self, point, radius):
+        '''Every point within `radius` km of `point` as [(distance_km, index)],
+        nearest first.'''
+        q = _unit_vector(point)
+        limit = _km_to_chord(radius)**2
+        found = []
+
+        self._search(q, 0, len(self._order), 0, lambda i, d2: found.append((d2, i)), lambda: limit)
+        return [ (_chord_to_km(d2), i) for d2, i in sorted(found) ]
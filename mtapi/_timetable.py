@@ -0,0 +1,109 @@
+import bisect
+import numpy as np
+
+
+class _Timetable(object):
+    '''Every upcoming ride between consecutive stops of a live trip, as parallel
+    arrays of "connections" sorted by departure time, the order a connection
+    scan walks them in:
+
+        dep_station, dep_time -> arr_station, arr_time  on `trip`, a code into
+                                                        trip_ids, of `route`,
+                                                        a code into route_names
+
+    Feeds give one time per stop, so a connection departs when the train
+    arrives at its first stop. Unlike the arrival table nothing is truncated
+    to the display window: trips are kept to the end of what the feeds
+    predict.'''
+
+    __slots__ = ('dep_station', 'arr_station', 'dep_time', 'arr_time', 'route', 'trip', 'trip_ids',
+                 'route_names', '_rows', '_dep_times')
+
+    def __init__(self, dep_station, arr_station, dep_time, arr_time, route, trip, trip_ids, route_names,
+                 presorted=False):
+        if not presorted:
+            order = np.lexsort((arr_time, dep_time))
+            dep_station, arr_station, dep_time, arr_time, route, trip = (
+                dep_station[order], arr_station[order], dep_time[order], arr_time[order], route[order], trip[order])
+        self.dep_station = dep_station
+        self.arr_station = arr_station
+        self.dep_time = dep_time
+        self.arr_time = arr_time
+        self.route = route
+        self.trip = trip
+        self.trip_ids = tuple(trip_ids)
+        self.route_names = tuple(route_names)
+
+        for column in (self.dep_station, self.arr_station, self.dep_time, self.arr_time, self.route, self.trip):
+            column.flags.writeable = False
+
+        self._rows = self._dep_times = None
+
+    @classmethod
+    def from_slices(cls, feed_slices, route_names, min_time=None):
+        '''Merge the connections of several feed slices, dropping rides that
+        depart before `min_time`. Trip codes are renumbered so trips of
+        different feeds never share one.'''
+        blocks = []
+        trip_ids = []
+        for feed_slice in feed_slices:
+            if len(feed_slice.connections):
+                block = feed_slice.connections.copy()
+                block[:, 5] += len(trip_ids)
+                blocks.append(block)
+            trip_ids.extend(feed_slice.trip_ids)
+
+        if not blocks:
+            empty = np.empty(0, dtype=np.int64)
+            return cls(empty.astype(np.int32), empty.astype(np.int32), empty, empty, empty.astype(np.int16),
+                       empty.astype(np.int32), (), route_names)
+
+        connections = np.concatenate(blocks)
+        if min_time is not None:
+            connections = connections[connections[:, 2] >= min_time]
+        dep_station, arr_station, dep_time, arr_time, route, trip = connections.T
+
+        return cls(dep_station.astype(np.int32), arr_station.astype(np.int32), dep_time.copy(), arr_time.copy(),
+                   route.astype(np.int16), trip.astype(np.int32), trip_ids, route_names)
+
+    def since(self, min_time):
+        '''The same timetable without rides departing before `min_time`, a
+        slice of this one's columns.'''
+        start = int(np.searchsorted(self.dep_time, min_time))
+        timetable = _Timetable(self.dep_station[start:], self.arr_station[start:], self.dep_time[start:],
+                               self.arr_time[start:], self.route[start:], self.trip[start:], self.trip_ids,
+                               self.route_names, presorted=True)
+        if self._rows is not None:
+            timetable._rows, timetable._dep_times = self._rows[start:], self._dep_times[start:]
+        return timetable
+
+    def __len__(self):
+        return len(self.dep_time)
+
+    def _build_rows(self):
+        # built by the first query rather than on every update; racing queries
+        # just build the same lists twice
+        dep_times = self.dep_time.tolist()
+        self._rows = list(zip(dep_times, self.arr_time.tolist(), self.dep_station.tolist(),
+                              self.arr_station.tolist(), self.trip.tolist()))
+        self._dep_times = dep_times
+
+    @property
+    def rows(self):
+        '''(dep_time, arr_time, dep_station, arr_station, trip) of every
+        connection as plain tuples, which a Python scan walks far faster than
+        array rows.'''
+        if self._rows is None:
+            self._build_rows()
+        return self._rows
+
+    def first_departing(self, time):
+        '''Index of the first connection departing at or after `time`.'''
+        if self._dep_times is None:
+            self._build_rows()
+        return bisect.bisect_left(self._dep_times, time)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, c).nbytes for c in ('dep_station', 'arr_station', 'dep_time', 'arr_time',
+                                                     'route', 'trip'))
@@ -0,0 +1,153 @@
+import collections, hashlib, json
+import numpy as np
+
+
+TRANSFER = 'transfer'
+
+class _TransitGraph(object):
+    '''The subway as an undirected graph over station indices, with an edge
+    between consecutive stations of every route, compiled into compressed
+    sparse row arrays:
+
+        indices[indptr[i]:indptr[i + 1]]      stations adjacent to station i
+        edge_routes[indptr[i]:indptr[i + 1]]  the route of each of those edges,
+                                              as a code into route_names
+
+    A pair of stations served consecutively by several routes has one edge per
+    route. Changing trains between two different stations is an edge of the
+    pseudo-route TRANSFER, listed last in route_names when there are any.
+
+    `transfer_seconds[i]` is the minimum time to change trains at station i,
+    or -1 where the station graph file doesn't say; `footpaths(i)` are the
+    (station, seconds) transfers to other stations. The graph is immutable
+    and shared by every planner query.'''
+
+    __slots__ = ('ids', 'names', 'route_names', 'indptr', 'indices', 'edge_routes', 'transfer_seconds', '_by_name',
+                 '_adjacency', '_footpaths', '_digest')
+
+    def __init__(self, stations, route_hops, transfers=None):
+        '''`stations` are in index order; `route_hops` maps each route to the
+        (station index, station index) pairs it runs between, and `transfers`
+        maps (station index, station index) pairs to minimum transfer
+        seconds.'''
+        transfers = transfers or {}
+        self.ids = tuple(s['id'] for s in stations)
+        self.names = tuple(s['name'] for s in stations)
+        self.route_names = tuple(sorted(route_hops))
+
+        edges = [ (a, b, code) for code, route in enumerate(self.route_names) for a, b in route_hops[route] ]
+        walks = sorted(pair for pair in transfers if pair[0] != pair[1])
+        if walks:
+            self.route_names += (TRANSFER,)
+            edges.extend((a, b, len(self.route_names) - 1) for a, b in walks)
+        edges = np.array(edges, dtype=np.int32).reshape(-1, 3)
+        # both directions of every hop, without duplicates, grouped by source
+        edges = np.unique(np.concatenate([ edges, edges[:, [1, 0, 2]] ]), axis=0)
+        edges = edges[edges[:, 0] != edges[:, 1]]
+
+        self.indptr = np.searchsorted(edges[:, 0], np.arange(len(stations) + 1)).astype(np.int32)
+        self.indices = np.ascontiguousarray(edges[:, 1])
+        self.edge_routes = edges[:, 2].astype(np.int16)
+
+        self.transfer_seconds = np.full(len(stations), -1, dtype=np.int32)
+        self._footpaths = [ [] for _ in stations ]
+        for (a, b), seconds in transfers.items():
+            if a == b:
+                self.transfer_seconds[a] = seconds
+            else:
+                self._footpaths[a].append((b, seconds))
+
+        for column in (self.indptr, self.indices, self.edge_routes, self.transfer_seconds):
+            column.flags.writeable = False
+
+        self._by_name = collections.defaultdict(list)
+        for i, name in enumerate(self.names):
+            self._by_name[name].append(i)
+
+        # distinct neighbours as plain lists, which searches walk fastest
+        indptr, indices = self.indptr.tolist(), self.indices.tolist()
+        self._adjacency = [ sorted(set(indices[indptr[i]:indptr[i + 1]])) for i in range(len(self.ids)) ]
+        self._digest = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    def digest(self):
+        '''A hex hash of the stations, edges and transfers, identifying the
+        graph across restarts.'''
+        if self._digest is None:
+            h = hashlib.sha1()
+            for column in (self.indptr, self.indices, self.edge_routes, self.transfer_seconds):
+                h.update(column.tobytes())
+            h.update(json.dumps([ self.ids, self.route_names, self._footpaths ]).encode('utf-8'))
+            self._digest = h.hexdigest()[:16]
+        return self._digest
+
+    def neighbors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def footpaths(self, i):
+        '''(station index, seconds) of every transfer from station i to another.'''
+        return self._footpaths[i]
+
+    def stations_named(self, name):
+        '''Indices of every station called `name`; several stations can share one.'''
+        return list(self._by_name.get(name, ()))
+
+    def routes_between(self, a, b):
+        '''Names of the routes running directly between stations a and b.'''
+        start, end = self.indptr[a], self.indptr[a + 1]
+        row = self.indices[start:end]
+        return set(self.route_names[r] for r in self.edge_routes[start:end][row == b].tolist())
+
+    def shortest_path(self, sources, targets):
+        '''The fewest-stops path from any of `sources` to any of `targets` as a
+        list of station indices, or None if they aren't connected.
+
+        Searches breadth-first from both ends at once, a whole level at a time
+        from whichever side has the smaller frontier, and stops at the first
+        level where the two meet. Each side keeps one parent pointer per
+        station it reached; the path is only assembled at the end.'''
+        adjacency = self._adjacency
+        forward = { i: (i, 0) for i in sources }
+        backward = { i: (i, 0) for i in targets }
+        met = [ i for i in forward if i in backward ]
+        forward_frontier, backward_frontier = list(forward), list(backward)
+
+        while not met and forward_frontier and backward_frontier:
+            if len(forward_frontier) <= len(backward_frontier):
+                seen, other, frontier = forward, backward, forward_frontier
+            else:
+                seen, other, frontier = backward, forward, backward_frontier
+
+            following = []
+            for i in frontier:
+                depth = seen[i][1] + 1
+                for j in adjacency[i]:
+                    if j not in seen:
+                        seen[j] = (i, depth)
+                        following.append(j)
+                        if j in other:
+                            met.append(j)
+
+            if seen is forward:
+                forward_frontier = following
+            else:
+                backward_frontier = following
+
+        if not met:
+            return None
+
+        # the best meeting point of the level
+        middle = min(met, key=lambda i: forward[i][1] + backward[i][1])
+        path = [middle]
+        while forward[path[-1]][0] != path[-1]:
+            path.append(forward[path[-1]][0])
+        path.reverse()
+        while backward[path[-1]][0] != path[-1]:
+            path.append(backward[path[-1]][0])
+        return path
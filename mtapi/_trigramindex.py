@@ -0,0 +1,86 @@
+import re
+import numpy as np
+
+from mtapi._nameindex import normalize
+
+
+# spelled-out words and the abbreviations station names use
+ABBREVIATIONS = {
+    'street': 'st', 'streets': 'sts', 'avenue': 'av', 'ave': 'av', 'avenues': 'avs', 'square': 'sq',
+    'road': 'rd', 'boulevard': 'blvd', 'parkway': 'pkwy', 'pky': 'pkwy', 'heights': 'hts', 'highway': 'hwy',
+    'plaza': 'plz', 'place': 'pl', 'center': 'ctr', 'centre': 'ctr', 'terminal': 'term', 'east': 'e',
+    'west': 'w', 'north': 'n', 'south': 's'
+}
+
+_ORDINAL = re.compile(r'\b(\d+)(?:st|nd|rd|th)\b')
+
+def canonical(text):
+    '''The normalized text with ordinals as plain numbers and common words
+    abbreviated, so "West 14th Street" and "W 14 St" read the same.'''
+    text = _ORDINAL.sub(r'\1', normalize(text))
+    return ' '.join(ABBREVIATIONS.get(word, word) for word in text.split(' ') if word)
+
+def trigrams(text):
+    '''Distinct three-character windows of each word, padded with two spaces
+    in front and one behind, as PostgreSQL's pg_trgm does.'''
+    grams = set()
+    for word in text.split(' '):
+        padded = '  %s ' % word
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class _TrigramIndex(object):
+    '''Typo-tolerant search over station names.
+
+    Every station is entered under its whole name and under each part of a
+    complex's "A / B" name. Each entry's canonical trigrams are precomputed
+    into postings, trigram -> entry numbers, so a query only visits entries
+    sharing a trigram with it. An entry scores the Jaccard similarity of its
+    trigrams and the query's, and a station takes the best score of its
+    entries.'''
+
+    __slots__ = ('names', '_postings', '_sizes', '_stations', '_lengths')
+
+    def __init__(self, names):
+        '''`names` are the stations' names in index order.'''
+        self.names = tuple(names)
+
+        entries = []
+        for i, name in enumerate(self.names):
+            forms = set([canonical(name)] + [ canonical(part) for part in name.split('/') ])
+            entries.extend((i, form) for form in sorted(forms) if form)
+
+        postings = {}
+        sizes = []
+        for entry, (_, form) in enumerate(entries):
+            grams = trigrams(form)
+            sizes.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(entry)
+
+        self._postings = { gram: np.array(p, dtype=np.int32) for gram, p in postings.items() }
+        self._sizes = np.array(sizes, dtype=np.int32)
+        self._stations = np.array([ i for i, _ in entries ], dtype=np.int32)
+        self._lengths = np.array([ len(name) for name in self.names ], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.names)
+
+    def search(self, query, limit=5, min_score=0.0):
+        '''Up to `limit` (score, station index) pairs for stations whose names
+        resemble `query`, best first. Scores run from 0 to 1; ties go to the
+        shorter name.'''
+        grams = trigrams(canonical(query))
+        hits = [ self._postings[g] for g in grams if g in self._postings ]
+        if not hits:
+            return []
+
+        common = np.bincount(np.concatenate(hits), minlength=len(self._sizes))
+        scores = common / (len(grams) + self._sizes - common)
+
+        best = np.zeros(len(self.names))
+        np.maximum.at(best, self._stations, scores)
+        candidates = np.flatnonzero(best > min_score)
+
+        ranked = candidates[np.lexsort((candidates, self._lengths[candidates], -best[candidates]))[:limit]]
+        return [ (float(best[i]), i) for i in ranked.tolist() ]
@@ -0,0 +1,150 @@
+import threading, time, random, logging
+
+
+logger = logging.getLogger(__name__)
+
+class _FeedSchedule(object):
+    '''What the scheduler knows about one feed: when to poll it next, the
+    newest header timestamp seen and the feed's learned update period.'''
+
+    __slots__ = ('next_poll', 'timestamp', 'period', 'misses', 'failures')
+
+    def __init__(self, next_poll):
+        self.next_poll = next_poll
+        self.timestamp = None
+        self.period = None
+        self.misses = 0
+        self.failures = 0
+
+
+class _UpdateScheduler(object):
+    '''Polls each feed on its own schedule from one long-lived thread.
+
+    `poll(urls)` updates from those feeds and returns their header timestamps
+    keyed by URL, None for a feed that failed. Feeds due within `batch_window`
+    seconds of each other are polled together, so one update serves them all.
+
+    A feed's period is learned from the gaps between the timestamps it
+    publishes, and it is next polled `lag` seconds after its next version
+    should be out. A poll that finds nothing new retries after `min_interval`
+    seconds, doubling each time, and no feed waits longer than `max_interval`.
+    Failures back off exponentially up to `max_backoff`. Every delay gets up
+    to `jitter` seconds added, and backoffs are randomized, so the feeds don't
+    fall into step.
+
+    `clock` must be the clock feed timestamps are compared with.'''
+
+    def __init__(self, poll, feed_urls, max_interval=60, min_interval=5, lag=2, jitter=1, max_backoff=300,
+                 batch_window=1, clock=None, rng=None):
+        self._poll = poll
+        self.MAX_INTERVAL = max_interval
+        self.MIN_INTERVAL = min(min_interval, max_interval)
+        self.LAG = lag
+        self.JITTER = jitter
+        self.MAX_BACKOFF = max(max_backoff, max_interval)
+        self.BATCH_WINDOW = batch_window
+        self._clock = clock or time.time
+        self._random = rng or random.Random()
+        now = self._clock()
+        self._feeds = { url: _FeedSchedule(now) for url in feed_urls }
+        self._stopped = False
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def start(self, timestamps=None):
+        '''Start the worker thread. `timestamps` are the results of a poll of
+        every feed just made, which then schedule the first polls.'''
+        if timestamps is not None:
+            with self._lock:
+                now = self._clock()
+                for url, feed in self._feeds.items():
+                    self._reschedule(feed, timestamps.get(url), now)
+
+        logger.info('Starting update thread...')
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='mtapi-update')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        '''Cancel every pending poll and wait up to `timeout` seconds for a
+        poll in progress to finish. Returns whether the worker has exited.'''
+        with self._lock:
+            self._stopped = True
+            self._lock.notify_all()
+
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def restart_if_dead(self):
+        if self._stopped or self.is_alive():
+            return False
+
+        logger.warning('Update thread died')
+        self.start()
+        return True
+
+    def next_polls(self):
+        '''When each feed is polled next, in clock seconds, keyed by URL.'''
+        with self._lock:
+            return { url: feed.next_poll for url, feed in self._feeds.items() }
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._stopped:
+                    now = self._clock()
+                    due = min((feed.next_poll for feed in self._feeds.values()), default=None)
+                    if due is not None and due <= now:
+                        break
+                    self._lock.wait(None if due is None else due - now)
+                if self._stopped:
+                    return
+
+                urls = [ url for url, feed in self._feeds.items() if feed.next_poll <= now + self.BATCH_WINDOW ]
+
+            try:
+                timestamps = self._poll(urls)
+            except Exception:
+                logger.exception('Update of %d feeds failed', len(urls))
+                timestamps = {}
+
+            with self._lock:
+                now = self._clock()
+                for url in urls:
+                    self._reschedule(self._feeds[url], timestamps.get(url), now)
+
+    def _reschedule(self, feed, timestamp, now):
+        if timestamp is None:
+            feed.failures += 1
+            delay = min(self.MIN_INTERVAL * 2 ** feed.failures, self.MAX_BACKOFF)
+            feed.next_poll = now + self._random.uniform(delay / 2, delay)
+            return
+        feed.failures = 0
+
+        if feed.timestamp is not None and timestamp > feed.timestamp:
+            gap = timestamp - feed.timestamp
+            # a shorter gap is taken at once; a longer one may span missed
+            # versions, so it only nudges the estimate
+            if feed.period is None or gap < feed.period:
+                feed.period = gap
+            else:
+                feed.period += (gap - feed.period) / 4
+            feed.period = min(max(feed.period, self.MIN_INTERVAL), self.MAX_INTERVAL)
+
+        if timestamp != feed.timestamp and feed.period is not None:
+            feed.misses = 0
+            next_poll = timestamp + feed.period + self.LAG
+        else:
+            # nothing new yet, or no period learned
+            next_poll = now + min(self.MIN_INTERVAL * 2 ** feed.misses, self.MAX_INTERVAL)
+            feed.misses += 1
+
+        feed.timestamp = timestamp
+        next_poll = min(max(next_poll, now + self.MIN_INTERVAL), now + self.MAX_INTERVAL)
+        feed.next_poll = next_poll + self._random.uniform(0, self.JITTER)
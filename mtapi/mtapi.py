@@ -1,60 +1,140 @@
-import urllib, contextlib, datetime, copy
+import datetime, itertools, heapq, time
 from collections import defaultdict
-from itertools import islice
-from operator import itemgetter
-import csv, math, json
+import json
+import numpy as np
 import threading
 import logging
 import google.protobuf.message
-from mtaproto.feedresponse import FeedResponse, Trip, TripStop, TZ
-from mtapi._mtapithreader import _MtapiThreader
+from mtaproto.feedresponse import FeedResponse, TZ
+from mtapi._updatescheduler import _UpdateScheduler
+from mtapi._feedfetcher import _FeedFetcher
+from mtapi._snapshot import _Snapshot
+from mtapi._arrivaltable import _ArrivalTable, DIRECTION_CODES
+from mtapi._transitgraph import _TransitGraph
+from mtapi._timetable import _Timetable
+from mtapi._pathmatrix import _PathMatrix
+from mtapi._nameindex import _NameIndex
+from mtapi._trigramindex import _TrigramIndex
+from mtapi import _planner
+from mtapi._stationindex import _StationIndex, EARTH_RADIUS_KM, EARTH_RADIUS_MILES
 
 logger = logging.getLogger(__name__)
 
-def distance(p1, p2):
-    return math.sqrt((p2[0] - p1[0])**2 + (p2[1] - p1[1])**2)
+# the lowest search_stations score taken as meaning the station typed
+FUZZY_MIN_SCORE = 0.3
+
+def _json_default(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    elif isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError('%r is not JSON serializable' % obj)
 
 class Mtapi(object):
 
     class _Station(object):
-        last_update = None
+        '''A station from the stations file. Its trains live in the snapshot's
+        arrival table at row block `index`.'''
 
-        def __init__(self, json):
+        def __init__(self, json, index):
             self.json = json
-            self.trains = {}
-            self.clear_train_data()
+            self.index = index
 
         def __getitem__(self, key):
             return self.json[key]
 
-        def add_train(self, route_id, direction, train_time, feed_time):
-            self.routes.add(route_id)
-            self.trains[direction].append({
+        @staticmethod
+        def _serialize_train(route_id, train_time, minutes):
+            return {
                 'route': route_id,
-                'time': train_time
-            })
-            self.last_update = feed_time
-
-        def clear_train_data(self):
-            self.trains['N'] = []
-            self.trains['S'] = []
-            self.routes = set()
-            self.last_update = None
-
-        def sort_trains(self, max_trains):
-            self.trains['S'] = sorted(self.trains['S'], key=itemgetter('time'))[:max_trains]
-            self.trains['N'] = sorted(self.trains['N'], key=itemgetter('time'))[:max_trains]
+                'time': datetime.datetime.fromtimestamp(train_time, TZ),
+                'epoch': train_time,
+                'remaining_minutes': minutes
+            }
 
-        def serialize(self):
+        def serialize(self, arrivals, max_trains):
+            '''The station and its next trains. Each train's remaining_minutes
+            is precomputed against the time of the update that built the
+            snapshot.'''
+            last_update = int(arrivals.last_update[self.index])
             out = {
-                'N': self.trains['N'],
-                'S': self.trains['S'],
-                'routes': self.routes,
-                'last_update': self.last_update
+                'N': [ self._serialize_train(*t) for t in arrivals.trains(self.index, 'N', max_trains) ],
+                'S': [ self._serialize_train(*t) for t in arrivals.trains(self.index, 'S', max_trains) ],
+                'routes': arrivals.routes(self.index),
+                'last_update': datetime.datetime.fromtimestamp(last_update, TZ) if last_update else None
             }
             out.update(self.json)
             return out
 
+    class _FeedSlice(object):
+        '''The arrivals one feed contributed during its last successful update,
+        as columns ready to merge into an _ArrivalTable, so that an update only
+        decodes the feeds that changed.
+
+        Only the `max_trains` soonest arrivals per station and direction are
+        kept: each is collected in a bounded max-heap on time, so a busy
+        station never holds more than that many entries during ingest.
+
+        `station_routes` maps each station index to the routes the feed
+        showed there, before truncation.
+
+        `hops` records, per route, every pair of consecutive stations some
+        trip made, oriented southbound, in the order first seen; they give
+        the route's line order.
+
+        `connections` keeps every upcoming ride between consecutive stops as
+        (from, to, departure, arrival, route code, trip code) rows for the
+        _Timetable, with trip codes into `trip_ids`.'''
+
+        def __init__(self, timestamp, max_trains):
+            self.timestamp = timestamp
+            self.max_trains = max_trains
+            self.routes = defaultdict(set)
+            self.station_routes = defaultdict(set)
+            self.hops = defaultdict(dict)
+            self.trip_ids = []
+            self._connections = []
+            self._heaps = defaultdict(list)
+
+        def add_hop(self, route_id, direction, from_index, to_index):
+            hop = (from_index, to_index) if direction == 'S' else (to_index, from_index)
+            self.hops[route_id][hop] = None
+
+        def add_trip(self, trip_id):
+            self.trip_ids.append(trip_id)
+            return len(self.trip_ids) - 1
+
+        def add_connection(self, from_index, to_index, departure, arrival, route_code, trip_code):
+            self._connections.append((from_index, to_index, departure, arrival, route_code, trip_code))
+
+        def add_train(self, station_index, stop_id, route_id, route_code, direction, train_time):
+            self.routes[route_id].add(stop_id)
+            self.station_routes[station_index].add(route_id)
+
+            heap = self._heaps[station_index, DIRECTION_CODES[direction]]
+            entry = (-train_time, route_code)
+            if len(heap) < self.max_trains:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+        def freeze(self):
+            station, route, direction, time = [], [], [], []
+            for (station_index, direction_code), heap in self._heaps.items():
+                for neg_time, route_code in heap:
+                    station.append(station_index)
+                    route.append(route_code)
+                    direction.append(direction_code)
+                    time.append(-neg_time)
+
+            self.station = np.array(station, dtype=np.int32)
+            self.route = np.array(route, dtype=np.int16)
+            self.direction = np.array(direction, dtype=np.int8)
+            self.time = np.array(time, dtype=np.int64)
+            self.connections = np.array(self._connections, dtype=np.int64).reshape(-1, 6)
+            del self._heaps, self._connections
+            return self
+
 
     _FEED_URLS = [
         'https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs',  # 1234567S
@@ -67,34 +147,82 @@ class Mtapi(object):
         'https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-g'  # G
     ]
 
-    def __init__(self, key, stations_file, expires_seconds=60, max_trains=10, max_minutes=30, threaded=False):
+    def __init__(self, key, stations_file, expires_seconds=60, max_trains=10, max_minutes=30, threaded=False,
+                 feed_urls=None, fetch_workers=8, fetch_timeout=10, fetch_deadline=30, train_tiers=None,
+                 feed_source=None, clock=None, graph_file=None, path_matrix_dir=None, path_matrix_delay=30):
         self._KEY = key
         self._MAX_TRAINS = max_trains
+        self._TRAIN_TIERS = dict(train_tiers or {})
+        # ingest keeps enough trains for the largest tier
+        self._INGEST_TRAINS = max([max_trains] + list(self._TRAIN_TIERS.values()))
         self._MAX_MINUTES = max_minutes
         self._EXPIRES_SECONDS = expires_seconds
         self._THREADED = threaded
-        self._stations = {}
         self._stops_to_stations = {}
-        self._routes = {}
-        self._read_lock = threading.RLock()
+        self._route_codes = {}
+        self._feed_latency = {}
+        self._feed_errors = {}
+        self._update_timings = {}
+        self._feed_slices = {}
+        self._generations = itertools.count()
+        self._update_lock = threading.Lock()
+        self._update_listeners = []
+        # every southbound hop seen per route, scheduled ones first, in first-seen order
+        self._graph_hops = defaultdict(dict)
+        # each route's stations in line order over the graph's hops, until they grow
+        self._route_orders = {}
+        self._transfers = {}
+        self._path_matrix = None
+        self._path_matrix_dir = path_matrix_dir
+        self._PATH_MATRIX_DELAY = path_matrix_delay
+        self._pending_graph = None
+        self._building_matrix = False
+        self._matrix_lock = threading.Condition()
+
+        if feed_urls is not None:
+            self._FEED_URLS = list(feed_urls)
+        # feed_source replaces the HTTP fetcher, e.g. with a ReplayFeedSource; clock
+        # is what "now" means when filtering arrivals (recorded time on replay)
+        self._fetcher = feed_source or \
+            _FeedFetcher(key, workers=fetch_workers, timeout=fetch_timeout, deadline=fetch_deadline)
+        self._clock = clock or time.time
 
         # initialize the stations database
         try:
             with open(stations_file, 'r') as f:
-                self._stations = json.load(f)
-                for id in self._stations:
-                    self._stations[id] = self._Station(self._stations[id])
-                self._stops_to_stations = self._build_stops_index(self._stations)
+                stations = json.load(f)
+                for index, id in enumerate(stations):
+                    stations[id] = self._Station(stations[id], index)
+                self._stations = stations
+                self._stops_to_stations = self._build_stops_index(stations)
+                self._stop_indices = { stop_id: stations[station_id].index
+                                       for stop_id, station_id in self._stops_to_stations.items() }
+                # station rows in index order, for mapping _StationIndex hits back
+                self._station_list = list(stations.values())
+                self._station_ids = tuple(stations)
+                self._station_index = _StationIndex([ s['location'] for s in self._station_list ])
+                self._name_index = _NameIndex([ s['name'] for s in self._station_list ])
+                self._trigram_index = _TrigramIndex([ s['name'] for s in self._station_list ])
+                if graph_file is not None:
+                    self._load_station_graph(graph_file)
+                self._graph = _TransitGraph(self._station_list, self._graph_hops, self._transfers)
+                self._snapshot = _Snapshot(next(self._generations), stations, {}, None,
+                                           _ArrivalTable.from_slices([], len(stations), []), graph=self._graph,
+                                           timetable=_Timetable.from_slices([], []))
 
         except IOError as e:
             print('Couldn\'t load stations file '+stations_file)
             exit()
 
+        self._request_path_matrix(self._graph)
+
         self._update()
 
+        self._scheduler = None
         if threaded:
-            self.threader = _MtapiThreader(self, expires_seconds)
-            self.threader.start_timer()
+            self._scheduler = _UpdateScheduler(self._poll_feeds, self._FEED_URLS, max_interval=expires_seconds or 60,
+                                               clock=self._clock)
+            self._scheduler.start(self._feed_timestamps(self._FEED_URLS))
 
     @staticmethod
     def _build_stops_index(stations):
@@ -105,121 +233,550 @@ class Mtapi(object):
 
         return stops
 
-    def _load_mta_feed(self, feed_url):
+    def _load_station_graph(self, graph_file):
+        '''Seed the transit graph with the route segments and transfer times of
+        a file made by scripts/make_station_graph.py. Live trips then only add
+        track the schedule doesn't have, and the scheduled segments give each
+        route's line order.'''
+        start = time.perf_counter()
         try:
-            request = urllib.request.Request(feed_url)
-            request.add_header('x-api-key', self._KEY)
-            with contextlib.closing(urllib.request.urlopen(request)) as r:
-                data = r.read()
-                return FeedResponse(data)
-
-        except (urllib.error.URLError, google.protobuf.message.DecodeError, ConnectionResetError) as e:
-            logger.error('Couldn\'t connect to MTA server: ' + str(e))
-            return False
-
-    def _update(self):
-        logger.info('updating...')
-        self._last_update = datetime.datetime.now(TZ)
-
-        # create working copy for thread safety
-        stations = copy.deepcopy(self._stations)
-
-        # clear old times
-        for id in stations:
-            stations[id].clear_train_data()
-
-        routes = defaultdict(set)
-
-        for i, feed_url in enumerate(self._FEED_URLS):
-            mta_data = self._load_mta_feed(feed_url)
+            with open(graph_file, 'r') as f:
+                graph = json.load(f)
+        except (IOError, ValueError) as e:
+            logger.error('Couldn\'t load station graph %s: %s', graph_file, e)
+            return
+
+        stations = self._stations
+        skipped = 0
+        for route_id, segments in graph['routes'].items():
+            hops = self._graph_hops[route_id]
+            for a, b in segments:
+                if a in stations and b in stations:
+                    hops[stations[a].index, stations[b].index] = None
+                else:
+                    skipped += 1
+
+        for a, b, seconds in graph['transfers']:
+            if a in stations and b in stations:
+                self._transfers[stations[a].index, stations[b].index] = seconds
+            else:
+                skipped += 1
+
+        if skipped:
+            logger.warning('%d segments and transfers in %s name unknown stations', skipped, graph_file)
+        logger.info('Loaded station graph %s in %.1fms', graph_file, (time.perf_counter() - start) * 1000)
+
+    def _load_mta_feeds(self, feed_urls):
+        '''Fetch the feeds concurrently and parse the ones that changed, yielding
+        (url, FeedResponse) pairs in `feed_urls` order. Unchanged feeds and
+        feeds that failed to load or parse are skipped; their previous slice
+        stays in place.'''
+        start = time.perf_counter()
+        results = self._fetcher.fetch_all(feed_urls)
+        self._feed_latency.update((r.url, r.latency) for r in results)
+        self._update_timings['fetch'] = time.perf_counter() - start
+
+        for result in results:
+            self._feed_errors[result.url] = result.error
+            if result.not_modified:
+                if result.url not in self._feed_slices:
+                    self._fetcher.forget(result.url)
+                continue
+            elif not result:
+                continue
 
-            if not mta_data:
+            try:
+                yield result.url, FeedResponse(result.data)
+            except google.protobuf.message.DecodeError as e:
+                logger.error('Couldn\'t parse feed %s: %s', result.url, e)
+                self._feed_errors[result.url] = e
+                self._fetcher.forget(result.url)
+
+    def _route_code(self, route_id):
+        if route_id not in self._route_codes:
+            self._route_codes[route_id] = len(self._route_codes)
+        return self._route_codes[route_id]
+
+    def _build_feed_slice(self, mta_data, now, max_time):
+        feed_slice = self._FeedSlice(mta_data.header.timestamp, self._INGEST_TRAINS)
+        stop_indices = self._stop_indices
+
+        last_entity = last_index = last_time = trip_code = route_code = None
+        for stop_id, route_id, direction, train_time, trip_id, entity in mta_data.stop_times():
+            if direction not in DIRECTION_CODES:
                 continue
 
-            max_time = self._last_update + datetime.timedelta(minutes = self._MAX_MINUTES)
+            station_index = stop_indices.get(stop_id)
+            if station_index is None:
+                logger.info('Stop %s not found', stop_id)
+                continue
 
-            for entity in mta_data.entity:
-                trip = Trip(entity)
+            # every stop a trip lists counts towards line order, even ones
+            # outside the arrival window
+            if entity != last_entity:
+                trip_code = feed_slice.add_trip(trip_id)
+                route_code = self._route_code(route_id)
+            elif station_index != last_index:
+                feed_slice.add_hop(route_id, direction, last_index, station_index)
+                # the planner rides anything still ahead, past the arrival window
+                if last_time >= now and train_time >= last_time:
+                    feed_slice.add_connection(last_index, station_index, last_time, train_time,
+                                              route_code, trip_code)
+            last_entity, last_index, last_time = entity, station_index, train_time
+
+            if train_time < now or train_time > max_time:
+                continue
 
-                if not trip.is_valid():
-                    continue
+            feed_slice.add_train(station_index,
+                                 stop_id,
+                                 route_id,
+                                 route_code,
+                                 direction,
+                                 train_time)
 
-                direction = trip.direction[0]
-                route_id = trip.route_id.upper()
+        return feed_slice.freeze()
 
-                for update in entity.trip_update.stop_time_update:
-                    trip_stop = TripStop(update)
+    def _line_order(self, members, route_id):
+        '''Order the station indices in `members` north to south along the
+        route's line, from the order of every station its hops reach; members
+        no trip passed through are appended by name.'''
+        order = self._route_orders.get(route_id)
+        if order is None:
+            order = self._route_orders[route_id] = self._hop_order(self._graph_hops[route_id])
 
-                    if trip_stop.time < self._last_update or trip_stop.time > max_time:
-                        continue
+        ordered = [ n for n in order if n in members ]
+        if len(ordered) < len(members):
+            ordered.extend(sorted(members.difference(ordered), key=lambda i: self._station_list[i]['name']))
+        return ordered
 
-                    stop_id = trip_stop.stop_id
+    @staticmethod
+    def _hop_order(hops):
+        '''Stations north to south given southbound (from, to) hops between
+        consecutive stations.
+
+        This is a topological sort of the hop graph, which also passes through
+        stations that currently have no trains, so that branches and
+        short-turning trips still merge into one consistent order. Ties go to
+        the station seen first, and a loop is broken at the node with the
+        fewest remaining predecessors.'''
+        successors = defaultdict(list)
+        indegree = {}
+        rank = {}
+        for a, b in hops:
+            successors[a].append(b)
+            indegree[b] = indegree.get(b, 0) + 1
+            for node in (a, b):
+                if node not in rank:
+                    rank[node] = len(rank)
+                    indegree.setdefault(node, 0)
+
+        ready = [ (rank[n], n) for n, d in indegree.items() if d == 0 ]
+        heapq.heapify(ready)
+        order = []
+        while indegree:
+            if not ready:
+                n = min(indegree, key=lambda n: (indegree[n], rank[n]))
+                ready.append((rank[n], n))
+            r, n = heapq.heappop(ready)
+            if n not in indegree:
+                continue
+            del indegree[n]
+            order.append(n)
+            for m in successors[n]:
+                if m in indegree:
+                    indegree[m] -= 1
+                    if indegree[m] == 0:
+                        heapq.heappush(ready, (rank[m], m))
+        return order
+
+    def _request_path_matrix(self, graph):
+        # path matrices are built off the update path, newest graph only
+        with self._matrix_lock:
+            self._pending_graph = graph
+            if self._building_matrix:
+                return
+            self._building_matrix = True
+
+        thread = threading.Thread(target=self._build_path_matrices, name='path-matrix')
+        thread.daemon = True
+        thread.start()
+
+    def _build_path_matrices(self):
+        while True:
+            with self._matrix_lock:
+                # a rebuild holds the GIL for most of a second, so once there is a
+                # matrix, wait for new track to stop turning up; a burst of it
+                # then costs one build, and none waits past ten delays
+                if self._path_matrix is not None and self._PATH_MATRIX_DELAY:
+                    deadline = time.monotonic() + 10 * self._PATH_MATRIX_DELAY
+                    graph = None
+                    while self._pending_graph is not graph and time.monotonic() < deadline:
+                        graph = self._pending_graph
+                        self._matrix_lock.wait(min(self._PATH_MATRIX_DELAY, deadline - time.monotonic()))
+
+                graph, self._pending_graph = self._pending_graph, None
+                if graph is None:
+                    self._building_matrix = False
+                    return
+
+            start = time.perf_counter()
+            try:
+                if self._path_matrix_dir is None:
+                    matrix = _PathMatrix.build(graph)
+                else:
+                    matrix = _PathMatrix.load(graph, self._path_matrix_dir)
+            except Exception:
+                logger.exception('Couldn\'t build the path matrix')
+                continue
 
-                    if stop_id not in self._stops_to_stations:
-                        logger.info('Stop %s not found', stop_id)
-                        continue
+            logger.info('Path matrix %s ready in %.1fms', matrix.digest, (time.perf_counter() - start) * 1000)
+            with self._matrix_lock:
+                self._path_matrix = matrix
+                self._matrix_lock.notify_all()
+
+    def _update(self, feed_urls=None):
+        '''Publish a new snapshot, fetching `feed_urls` (default all feeds) and
+        keeping the other feeds' last slices.'''
+        with self._update_lock:
+            self._publish(self._build_snapshot(self._FEED_URLS if feed_urls is None else feed_urls))
+
+    def _feed_timestamps(self, feed_urls):
+        # header timestamp of each feed's current slice, None if its last fetch failed
+        timestamps = {}
+        for url in feed_urls:
+            feed_slice = self._feed_slices.get(url)
+            if self._feed_errors.get(url) is None and feed_slice is not None:
+                timestamps[url] = feed_slice.timestamp
+            else:
+                timestamps[url] = None
+        return timestamps
+
+    def _poll_feeds(self, feed_urls):
+        # the update scheduler's poll
+        self._update(feed_urls)
+        return self._feed_timestamps(feed_urls)
+
+    def _publish(self, snapshot):
+        # a single reference assignment; readers see either the old snapshot or the new one
+        self._snapshot = snapshot
+
+        for listener in self._update_listeners:
+            try:
+                listener(snapshot)
+            except Exception:
+                logger.exception('Update listener %r failed', listener)
+
+    def add_update_listener(self, listener):
+        '''Call listener(snapshot) with every snapshot published from now on,
+        on the thread that ran the update.'''
+        self._update_listeners.append(listener)
+
+    def _build_snapshot(self, feed_urls):
+        logger.info('updating...')
+        timings = self._update_timings = {}
+        start = time.perf_counter()
+
+        # only feeds that changed are decoded again
+        feeds = list(self._load_mta_feeds(feed_urls))
+        timings['parse'] = time.perf_counter() - start - timings['fetch']
+
+        now = self._clock()
+        last_update = datetime.datetime.fromtimestamp(now, TZ)
+        max_time = now + self._MAX_MINUTES * 60
+
+        stage = time.perf_counter()
+        for feed_url, mta_data in feeds:
+            self._feed_slices[feed_url] = self._build_feed_slice(mta_data, now, max_time)
+        timings['ingest'] = time.perf_counter() - stage
+
+        stage = time.perf_counter()
+        previous = self._snapshot
+        if not feeds:
+            # no slice changed, so only trains that have left drop out
+            arrivals = previous.arrivals.since(now)
+            timetable = previous.timetable.since(now)
+            timings['merge'] = time.perf_counter() - stage
+            timings['total'] = time.perf_counter() - start
+            return _Snapshot(next(self._generations), self._stations, previous.routes, last_update, arrivals,
+                             previous.route_stations, previous.station_routes, previous.graph, timetable)
+
+        # every slice is merged again, unchanged ones included: that is a
+        # concatenate and sort of some thousands of rows for the whole
+        # network, quicker than decoding a single feed, and simpler to keep
+        # right than tracking which rows of the previous tables each feed owns
+        route_names = sorted(self._route_codes, key=self._route_codes.get)
+        arrivals = _ArrivalTable.from_slices(self._feed_slices.values(), len(self._stations), route_names, now)
+        timetable = _Timetable.from_slices(self._feed_slices.values(), route_names, now)
+
+        # the graph covers all track seen since startup, and is only recompiled
+        # when a trip runs somewhere new
+        grown = False
+        for feed_url, _ in feeds:
+            for route_id, route_hops in self._feed_slices[feed_url].hops.items():
+                known = self._graph_hops[route_id]
+                if not known.keys() >= route_hops.keys():
+                    known.update(route_hops)
+                    self._route_orders.pop(route_id, None)
+                    grown = True
+        if grown:
+            self._graph = _TransitGraph(self._station_list, self._graph_hops, self._transfers)
+            logger.info('Transit graph rebuilt: %d stations, %d edges', len(self._graph), self._graph.n_edges)
+            self._request_path_matrix(self._graph)
 
-                    station_id = self._stops_to_stations[stop_id]
-                    stations[station_id].add_train(route_id,
-                                                   direction,
-                                                   trip_stop.time,
-                                                   mta_data.timestamp)
+        routes = defaultdict(set)
+        for feed_slice in self._feed_slices.values():
+            for route_id, stops in feed_slice.routes.items():
+                routes[route_id].update(stops)
 
-                    routes[route_id].add(stop_id)
+        route_stations = {}
+        for route_id, stops in routes.items():
+            members = set(self._stations[self._stops_to_stations[k]].index for k in stops)
+            route_stations[route_id] = tuple(self._station_list[i] for i in self._line_order(members, route_id))
 
+        station_routes = { station_id: arrivals.station_routes.get(station.index, ())
+                           for station_id, station in self._stations.items() }
 
-        # sort by time
-        for id in stations:
-            stations[id].sort_trains(self._MAX_TRAINS)
+        timings['merge'] = time.perf_counter() - stage
+        timings['total'] = time.perf_counter() - start
 
-        with self._read_lock:
-            self._routes = routes
-            self._stations = stations
+        logger.info('%d arrivals in %d bytes, %d connections in %d bytes',
+                    len(arrivals), arrivals.nbytes, len(timetable), timetable.nbytes)
 
-    def last_update(self):
-        return self._last_update
+        return _Snapshot(next(self._generations), self._stations, routes, last_update, arrivals, route_stations,
+                         station_routes, self._graph, timetable)
 
-    def get_by_point(self, point, limit=5):
+    def snapshot(self):
+        '''The current snapshot. It never changes once returned, so everything
+        read from it is consistent with its `generation`.'''
         if self.is_expired():
             self._update()
 
-        with self._read_lock:
-            sortable_stations = copy.deepcopy(self._stations).values()
+        return self._snapshot
 
-        sorted_stations = sorted(sortable_stations, key=lambda s: distance(s['location'], point))
-        serialized_stations = map(lambda s: s.serialize(), sorted_stations)
+    def last_update(self):
+        return self._snapshot.last_update
+
+    def feed_latency(self):
+        '''Seconds each feed took to load when last fetched, keyed by URL.'''
+        return dict(self._feed_latency)
+
+    def next_polls(self):
+        '''When each feed will next be polled, as datetimes keyed by URL. Empty
+        unless threaded.'''
+        if self._scheduler is None:
+            return {}
+        return { url: datetime.datetime.fromtimestamp(t, TZ) for url, t in self._scheduler.next_polls().items() }
+
+    def close(self):
+        '''Stop polling feeds and release the fetcher's threads and connections.'''
+        if self._scheduler is not None:
+            self._scheduler.stop()
+        self._fetcher.shutdown()
+
+    def update_timings(self):
+        '''Seconds spent in each stage of the last update: fetch, parse, ingest,
+        merge and total.'''
+        return dict(self._update_timings)
+
+    def max_trains(self, tier=None):
+        '''Trains listed per direction for a request tier; unknown or missing
+        tiers get the default max_trains.'''
+        return self._TRAIN_TIERS.get(tier, self._MAX_TRAINS)
+
+    def stations_near(self, point, limit=5, radius=None):
+        '''Stations nearest to a (lat, lon) point as [(distance_km, station)],
+        nearest first: the `limit` nearest, or with `radius` (km) every station
+        within it, capped at `limit` unless that is None. Stations are the
+        snapshot's own objects, not copies.'''
+        if radius is None:
+            hits = self._station_index.nearest(point, limit)
+        else:
+            hits = self._station_index.within(point, radius)[:limit]
+
+        return [ (d, self._station_list[i]) for d, i in hits ]
+
+    def station_ids(self):
+        '''Station IDs in the column order of station_distances().'''
+        return self._station_ids
+
+    def station_distances(self, points, earth_radius=EARTH_RADIUS_KM):
+        '''Great-circle distance from a (lat, lon) point to every station, as an
+        array ordered like station_ids(). Given a sequence of points, returns
+        a points x stations matrix. Distances are in km unless another
+        `earth_radius` is given, e.g. EARTH_RADIUS_MILES.'''
+        return self._station_index.distances(points, earth_radius)
+
+    def get_by_point(self, point, limit=5, tier=None):
+        snapshot = self.snapshot()
+        max_trains = self.max_trains(tier)
+
+        return [ station.serialize(snapshot.arrivals, max_trains)
+                 for d, station in self.stations_near(point, limit) ]
+
+    def get_nearest(self, point, limit=5, tier=None, earth_radius=EARTH_RADIUS_KM):
+        '''The `limit` stations nearest to a (lat, lon) point with their
+        arrivals, nearest first, each with its great-circle 'distance' from the
+        point: km, or the unit of another `earth_radius` such as
+        EARTH_RADIUS_MILES.'''
+        snapshot = self.snapshot()
+        max_trains = self.max_trains(tier)
+        scale = earth_radius / EARTH_RADIUS_KM
+
+        out = []
+        for d, station in self.stations_near(point, limit):
+            serialized = station.serialize(snapshot.arrivals, max_trains)
+            serialized['distance'] = d * scale
+            out.append(serialized)
+        return out
+
+    def encode_stations(self, snapshot, stations, tier=None):
+        '''JSON-encoded stations as of `snapshot`, in the format documented in
+        docs/endpoints.md. Each station is encoded once per snapshot and train
+        tier and cached on the snapshot, so the cache goes when it does.'''
+        max_trains = self.max_trains(tier)
+        fragments = snapshot.fragments
+
+        out = []
+        for station in stations:
+            key = (station.index, max_trains)
+            fragment = fragments.get(key)
+            if fragment is None:
+                serialized = station.serialize(snapshot.arrivals, max_trains)
+                serialized['hasData'] = bool(serialized['N'] or serialized['S'])
+                fragment = fragments[key] = json.dumps(serialized, default=_json_default, sort_keys=True)
+            out.append(fragment)
+        return out
 
-        return list(islice(serialized_stations, limit))
+    def encode_routes(self, snapshot):
+        '''The snapshot's routes as a JSON array, cached like encode_stations.'''
+        fragment = snapshot.fragments.get('routes')
+        if fragment is None:
+            fragment = snapshot.fragments['routes'] = json.dumps(sorted(snapshot.routes))
+        return fragment
+
+    def station_routes(self):
+        '''{station_id: (route, ...)} for every station, as of the last update.'''
+        return self._snapshot.station_routes
+
+    def transit_graph(self):
+        '''The _TransitGraph of consecutive stations on every route, as of the
+        last update.'''
+        return self._snapshot.graph
+
+    def stations_named(self, name):
+        '''Every station called `name`, ignoring case and punctuation, or
+        matching one part of a complex's "A / B" name.'''
+        return [ self._station_list[i] for i in self._name_index.lookup(name) ]
+
+    def search_stations(self, query, limit=5, min_score=0.0):
+        '''Stations whose names resemble `query`, typos, spelled-out words and
+        ordinals included, as [(score, station)] best first. Scores run
+        from 0 to 1, and only those above `min_score` are kept.'''
+        return [ (score, self._station_list[i]) for score, i in self._trigram_index.search(query, limit, min_score) ]
+
+    def complete_station_name(self, prefix, limit=10):
+        '''Up to `limit` station names starting with `prefix`, or with a word of
+        the name starting with it, best first. If none does, the names that
+        search_stations finds instead.'''
+        names = self._name_index.complete(prefix, limit)
+        if names:
+            return names
+
+        for _, station in self.search_stations(prefix, limit, FUZZY_MIN_SCORE):
+            if station['name'] not in names:
+                names.append(station['name'])
+        return names
+
+    def _resolve_station(self, station):
+        if station in self._stations:
+            return [ self._stations[station].index ]
+        indices = self._name_index.lookup(station)
+        if not indices:
+            # the closest name, if anything is close
+            for _, match in self.search_stations(station, 1, FUZZY_MIN_SCORE):
+                indices = self._name_index.lookup(match['name'])
+        if not indices:
+            raise KeyError(station)
+        return indices
+
+    def plan_route(self, source, destination):
+        '''The fewest-stops Journey between two stations, each given by ID or by
+        name as for stations_named (any station of that name will do, and a
+        close search_stations match stands in for a mistyped name), or None if
+        the transit graph doesn't connect them. Raises KeyError for an unknown
+        station. Once the graph's path matrix is ready, the path is read from
+        it, and among stations sharing a name, ties in stops go to the pair
+        whose path needs the fewest transfers.'''
+        graph = self.transit_graph()
+        matrix = self._path_matrix
+        if matrix is not None and matrix.digest != graph.digest():
+            matrix = None  # still building for this graph; search instead
+        return _planner.plan(graph, self._resolve_station(source), self._resolve_station(destination),
+                             matrix)
+
+    def path_matrix(self, timeout=0):
+        '''The _PathMatrix of the current transit graph, waiting up to `timeout`
+        seconds while it is built after a change; None if it isn't ready.'''
+        digest = self.transit_graph().digest()
+        with self._matrix_lock:
+            self._matrix_lock.wait_for(
+                lambda: self._path_matrix is not None and self._path_matrix.digest == digest, timeout)
+            matrix = self._path_matrix
+        return matrix if matrix is not None and matrix.digest == digest else None
+
+    def plan_trip(self, source, destination, depart=None, transfer_seconds=_planner.TRANSFER_SECONDS):
+        '''The earliest-arriving Journey between two stations on the trains the
+        feeds predict, leaving at `depart` epoch seconds or now, with the time
+        of every leg and the wait before it. Stations are given as for
+        plan_route. None if no live trip gets there.'''
+        snapshot = self.snapshot()
+        graph = snapshot.graph
+        if depart is None:
+            depart = int(self._clock())
+        return _planner.earliest_arrival(graph, snapshot.timetable, self._resolve_station(source),
+                                         self._resolve_station(destination), depart, transfer_seconds)
 
     def get_routes(self):
-        return self._routes.keys()
+        return self._snapshot.routes.keys()
 
-    def get_by_route(self, route):
+    def get_by_route(self, route, tier=None):
+        '''The route's stations in line order with their arrivals. A route is
+        serialized once per snapshot, with as many trains as the largest tier
+        lists, and cached on the snapshot; each tier's list is cut from that
+        and cached too, so repeated requests return the same list.'''
         route = route.upper()
-
-        if self.is_expired():
-            self._update()
-
-        with self._read_lock:
-            out = [ self._stations[self._stops_to_stations[k]].serialize() for k in self._routes[route] ]
-
-        out.sort(key=lambda x: x['name'])
+        snapshot = self.snapshot()
+        stations = snapshot.route_stations[route]
+        max_trains = self.max_trains(tier)
+
+        fragments = snapshot.fragments
+        full = fragments.get(('route', route))
+        if full is None:
+            full = fragments[('route', route)] = [ station.serialize(snapshot.arrivals, self._INGEST_TRAINS)
+                                                   for station in stations ]
+        if max_trains == self._INGEST_TRAINS:
+            return full
+
+        out = fragments.get(('route', route, max_trains))
+        if out is None:
+            out = fragments[('route', route, max_trains)] = [ dict(s, N=s['N'][:max_trains], S=s['S'][:max_trains])
+                                                              for s in full ]
         return out
 
-    def get_by_id(self, ids):
-        if self.is_expired():
-            self._update()
+    def get_by_id(self, ids, tier=None):
+        snapshot = self.snapshot()
+        max_trains = self.max_trains(tier)
 
-        with self._read_lock:
-            out = [ self._stations[k].serialize() for k in ids ]
-
-        return out
+        return [ snapshot.stations[k].serialize(snapshot.arrivals, max_trains) for k in ids ]
 
     def is_expired(self):
-        if self._THREADED and self.threader and self.threader.restart_if_dead():
+        if self._THREADED:
+            # the update thread keeps to each feed's schedule and backoff, so a
+            # request never updates in its place
+            self._scheduler.restart_if_dead()
             return False
         elif self._EXPIRES_SECONDS:
-            age = datetime.datetime.now(TZ) - self._last_update
-            return age.total_seconds() > self._EXPIRES_SECONDS
+            age = self._clock() - self._snapshot.last_update.timestamp()
+            return age > self._EXPIRES_SECONDS
         else:
             return False
@@ -1,9 +1,38 @@
 from mtaproto import nyct_subway_pb2
+from google.protobuf.message import DecodeError
 from pytz import timezone
 import datetime
 
 TZ = timezone('US/Eastern')
 
+# first letter of NyctTripDescriptor.Direction names, by enum value
+_DIRECTIONS = { v.number: v.name[0] for v in nyct_subway_pb2.NyctTripDescriptor.Direction.DESCRIPTOR.values }
+
+def header_timestamp(response_string):
+    '''Read FeedMessage.header.timestamp without decoding the whole message.
+    Returns None if the message doesn't start with its header.'''
+
+    # the header is field 1, length-delimited: tag byte 0x0a then a varint length
+    if not response_string or response_string[0] != 0x0a:
+        return None
+
+    length, shift, pos = 0, 0, 1
+    while pos < len(response_string):
+        byte = response_string[pos]
+        length |= (byte & 0x7f) << shift
+        pos += 1
+        if not byte & 0x80:
+            break
+        shift += 7
+
+    header = nyct_subway_pb2.gtfs__realtime__pb2.FeedHeader()
+    try:
+        header.ParseFromString(response_string[pos:pos + length])
+    except DecodeError:
+        return None
+
+    return header.timestamp or None
+
 class FeedResponse(object):
 
     def __init__(self, response_string):
@@ -18,6 +47,41 @@ class FeedResponse(object):
 
         return getattr(self._pb_data, name)
 
+    def stop_times(self):
+        '''Yield (stop_id, route_id, direction, epoch_seconds, trip_id, entity)
+        for every stop time update in the feed, in one pass over the message.
+        A trip's stops are yielded together, in the order the trip makes them,
+        and `entity` is the index of the trip's entity in the feed: trip_id
+        alone can't tell trips apart, as it may be empty or repeated.
+
+        This is the same data Trip and TripStop expose, without building a
+        wrapper object or timezone-aware datetime per field access: stop_id is
+        cut to its station part, route_id is upper-cased with GS mapped to S,
+        direction is 'N', 'S', 'E' or 'W' and the time is the arrival time,
+        falling back to departure.'''
+        trip_descriptor = nyct_subway_pb2.nyct_trip_descriptor
+        directions = _DIRECTIONS
+
+        for index, entity in enumerate(self._pb_data.entity):
+            if not entity.HasField('trip_update'):
+                continue
+
+            trip_update = entity.trip_update
+            trip = trip_update.trip
+            route_id = trip.route_id.upper()
+            if route_id == 'GS':
+                route_id = 'S'
+            direction = directions[trip.Extensions[trip_descriptor].direction]
+            trip_id = trip.trip_id
+
+            for update in trip_update.stop_time_update:
+                yield (update.stop_id[:3],
+                       route_id,
+                       direction,
+                       update.arrival.time or update.departure.time,
+                       trip_id,
+                       index)
+
 
 class Trip(object):
     def __init__(self, pb_data):
@@ -0,0 +1,76 @@
+# Given a stations.json and GTFS trips.txt, stop_times.txt and transfers.txt, creates a station_graph.json for
+# Mtapi's station graph (the STATION_GRAPH_FILE setting).
+# "routes" lists each route's segments between consecutive stations, southbound, longest trips first, so segments
+# come out in line order. "transfers" lists [from_station, to_station, min_transfer_time] from transfers.txt, where
+# transfers inside one station complex (grouped by make_stations_csv.py) give that station's own transfer time.
+# Stops are matched to stations by the first three characters of the stop ID, as in the realtime feeds.
+
+import argparse, csv, json, sys
+from collections import defaultdict
+
+def route_name(route_id):
+    # the realtime feeds' route names
+    route_id = route_id.upper()
+    return 'S' if route_id == 'GS' else route_id
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the station graph JSON file used by Mtapi.')
+    parser.add_argument('stations_file', default='stations.json')
+    parser.add_argument('trips_file', default='trips.txt')
+    parser.add_argument('stop_times_file', default='stop_times.txt')
+    parser.add_argument('transfers_file', default='transfers.txt')
+    args = parser.parse_args()
+
+    with open(args.stations_file, 'r') as f:
+        stations = json.load(f)
+    stop_stations = { stop_id: station_id for station_id, station in stations.items() for stop_id in station['stops'] }
+
+    trip_routes = {}
+    with open(args.trips_file, 'r') as f:
+        for row in csv.DictReader(f):
+            trip_routes[row['trip_id']] = route_name(row['route_id'])
+
+    trip_stops = defaultdict(list)
+    with open(args.stop_times_file, 'r') as f:
+        for row in csv.DictReader(f):
+            trip_stops[row['trip_id']].append((int(row['stop_sequence']), row['stop_id']))
+
+    # segments in first-seen order, longest trips first
+    routes = defaultdict(dict)
+    for trip_id in sorted(trip_stops, key=lambda t: (-len(trip_stops[t]), t)):
+        if trip_id not in trip_routes:
+            continue
+
+        last = None
+        for _, stop_id in sorted(trip_stops[trip_id]):
+            station_id = stop_stations.get(stop_id[:3])
+            if station_id is None:
+                continue
+            if last is not None and station_id != last:
+                segment = (station_id, last) if stop_id.endswith('N') else (last, station_id)
+                routes[trip_routes[trip_id]][segment] = None
+            last = station_id
+
+    # the longest transfer between any two stops of two stations, so a planned
+    # connection can always be made
+    transfers = {}
+    with open(args.transfers_file, 'r') as f:
+        for row in csv.DictReader(f):
+            from_station = stop_stations.get(row['from_stop_id'][:3])
+            to_station = stop_stations.get(row['to_stop_id'][:3])
+            if from_station is None or to_station is None:
+                continue
+
+            seconds = int(row['min_transfer_time'] or 0)
+            key = (from_station, to_station)
+            transfers[key] = max(seconds, transfers.get(key, 0))
+
+    graph = {
+        'routes': { route: [ list(segment) for segment in segments ] for route, segments in routes.items() },
+        'transfers': [ [a, b, seconds] for (a, b), seconds in sorted(transfers.items()) ]
+    }
+    json.dump(graph, sys.stdout, sort_keys=True, indent=4, separators=(',', ': '))
+
+
+if __name__ == '__main__':
+    main()
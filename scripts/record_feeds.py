@@ -0,0 +1,37 @@
+# Polls the MTA GTFS-RT feeds and archives every new body, for offline replay
+# with ReplayFeedSource or serve_feeds.py.
+#
+#   python -m scripts.record_feeds MTA_KEY recordings/monday --interval 30 --duration 3600
+
+import argparse, time, logging
+
+from mtapi import Mtapi
+from mtapi._feedfetcher import _FeedFetcher
+from mtapi._replay import FeedRecorder
+
+def main():
+    parser = argparse.ArgumentParser(description='Record MTA GTFS-RT feeds to an archive directory')
+    parser.add_argument('key', help='MTA API key')
+    parser.add_argument('archive', help='directory to record into')
+    parser.add_argument('--interval', type=float, default=30, help='seconds between polls')
+    parser.add_argument('--duration', type=float, default=None, help='stop after this many seconds')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    fetcher = _FeedFetcher(args.key, workers=len(Mtapi._FEED_URLS), recorder=FeedRecorder(args.archive))
+    stop_at = time.time() + args.duration if args.duration else None
+
+    try:
+        while stop_at is None or time.time() < stop_at:
+            started = time.time()
+            fetcher.fetch_all(Mtapi._FEED_URLS)
+            time.sleep(max(0, args.interval - (time.time() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fetcher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
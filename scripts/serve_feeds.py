@@ -0,0 +1,35 @@
+# Serves a recorded feed archive over HTTP at real or accelerated speed, so the
+# app can run against it by setting FEED_URLS to the printed URLs.
+#
+#   python -m scripts.serve_feeds recordings/monday --speed 10 --rebase --port 8001
+
+import argparse, time, logging
+
+from mtapi._feedserver import StandInFeedServer
+from mtapi._replay import FeedArchive
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a recorded feed archive')
+    parser.add_argument('archive', help='directory written by record_feeds.py')
+    parser.add_argument('--speed', type=float, default=1.0, help='playback speed relative to real time')
+    parser.add_argument('--rebase', action='store_true', help='shift feed timestamps to the present')
+    parser.add_argument('--loop', action='store_true', help='start over at the end of the recording')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    with StandInFeedServer(args.host, args.port) as server:
+        urls = server.play(FeedArchive(args.archive), speed=args.speed, rebase=args.rebase, loop=args.loop)
+        print('FEED_URLS = %r' % urls)
+
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
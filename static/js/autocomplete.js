@@ -0,0 +1,32 @@
+// Fills the datalist of every input marked data-autocomplete with station
+// names from /api/station-names as the user types, instead of shipping the
+// whole list with the page.
+
+document.querySelectorAll('input[data-autocomplete]').forEach(function(input) {
+    var datalist = document.getElementById(input.getAttribute('list'));
+    var pending = null;
+
+    input.addEventListener('input', function() {
+        var query = input.value.trim();
+        if (pending) {
+            pending.abort();
+        }
+        if (!query) {
+            datalist.innerHTML = '';
+            return;
+        }
+
+        pending = new AbortController();
+        fetch(input.dataset.autocomplete + '?q=' + encodeURIComponent(query), { signal: pending.signal })
+            .then(function(response) { return response.json(); })
+            .then(function(body) {
+                datalist.innerHTML = '';
+                body.data.forEach(function(name) {
+                    var option = document.createElement('option');
+                    option.value = name;
+                    datalist.appendChild(option);
+                });
+            })
+            .catch(function() {});
+    });
+});
@@ -0,0 +1,64 @@
+import os, shutil, time
+import pytest
+from mtaproto import nyct_subway_pb2
+from benchmarks.synthetic import STATIONS_FILE
+
+@pytest.fixture(scope='session', autouse=True)
+def app_settings(tmp_path_factory):
+    '''Configure app.py for tests: no feeds, no update thread, and station
+    routes persisted to a scratch copy rather than data/stations_test.json.'''
+    root = tmp_path_factory.mktemp('app')
+    station_routes_file = str(root / 'stations_test.json')
+    shutil.copy(os.path.join(os.path.dirname(STATIONS_FILE), 'stations_test.json'), station_routes_file)
+
+    settings = root / 'settings.cfg'
+    settings.write_text('\n'.join([
+        'MTA_KEY = \'\'',
+        'STATIONS_FILE = %r' % STATIONS_FILE,
+        'STATION_ROUTES_FILE = %r' % station_routes_file,
+        'PATH_MATRIX_DIR = %r' % str(root),
+        'FEED_URLS = []',
+        'THREADED = False',
+        'CACHE_SECONDS = None',
+        ''
+    ]))
+
+    previous = os.environ.get('MTAPI_SETTINGS')
+    os.environ['MTAPI_SETTINGS'] = str(settings)
+    yield str(settings)
+    if previous is None:
+        del os.environ['MTAPI_SETTINGS']
+    else:
+        os.environ['MTAPI_SETTINGS'] = previous
+
+def build_feed(route_id, stop_ids, trips=4, timestamp=None):
+    '''A FeedMessage of `trips` trips of `route_id` through `stop_ids`,
+    alternately northbound and southbound, the first train a minute out.'''
+    msg = nyct_subway_pb2.gtfs__realtime__pb2.FeedMessage()
+    msg.header.gtfs_realtime_version = '1.0'
+    msg.header.timestamp = timestamp or int(time.time())
+
+    for t in range(trips):
+        entity = msg.entity.add()
+        entity.id = '%s-%d' % (route_id, t)
+        entity.trip_update.trip.trip_id = entity.id
+        entity.trip_update.trip.route_id = route_id
+        entity.trip_update.trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor].direction = 1 if t % 2 == 0 else 3
+
+        for i, stop_id in enumerate(stop_ids):
+            update = entity.trip_update.stop_time_update.add()
+            update.stop_id = stop_id + ('N' if t % 2 == 0 else 'S')
+            update.arrival.time = msg.header.timestamp + 60 * (t + i + 1)
+
+    return msg
+
+@pytest.fixture
+def feed_message():
+    return build_feed
+
+@pytest.fixture
+def make_feed():
+    '''build_feed, serialized.'''
+    def make_feed(*args, **kwargs):
+        return build_feed(*args, **kwargs).SerializeToString()
+    return make_feed
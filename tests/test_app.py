@@ -0,0 +1,137 @@
+import json
+import pytest
+from mtapi import Mtapi
+from mtapi._feedserver import StandInFeedServer
+from benchmarks.synthetic import STATIONS_FILE
+
+@pytest.fixture
+def client(monkeypatch, make_feed):
+    import app as webapp
+    with StandInFeedServer() as server:
+        url = server.set_feed(Mtapi._FEED_URLS[0], make_feed('1', ['127', '128']))
+        mta = Mtapi('', STATIONS_FILE, feed_urls=[url], expires_seconds=None)
+        monkeypatch.setattr(webapp, 'mta', mta)
+        yield webapp.app.test_client(), mta
+
+def test_app_uses_test_settings(app_settings):
+    import app as webapp
+    assert webapp.app.config['STATION_ROUTES_FILE'] != './data/stations_test.json'
+    assert webapp.app.config['FEED_URLS'] == [] and not webapp.app.config['THREADED']
+    assert not webapp.mta._THREADED
+
+def test_api_by_id(client):
+    client, mta = client
+    response = client.get('/api/by-id/127,128')
+    assert response.status_code == 200
+    body = json.loads(response.data)
+
+    assert [ s['id'] for s in body['data'] ] == ['127', '128']
+    assert body['data'][0]['routes'] == ['1']
+    assert body['data'][0]['hasData'] is True
+    assert len(body['data'][0]['N']) == 2
+    assert body['updated'] == mta.last_update().isoformat()
+
+    assert client.get('/api/by-id/127,bogus').status_code == 404
+
+def test_api_cached_per_snapshot(client):
+    client, mta = client
+    first = client.get('/api/by-route/1')
+    etag = first.headers['ETag']
+    assert set(s['id'] for s in json.loads(first.data)['data']) == {'127', '128'}
+
+    assert client.get('/api/by-route/1', headers={ 'If-None-Match': etag }).status_code == 304
+    assert client.get('/api/routes', headers={ 'If-None-Match': etag }).status_code == 304
+    assert client.get('/api/by-route/Z', headers={ 'If-None-Match': etag }).status_code == 404
+    assert client.get('/api/by-id/bogus', headers={ 'If-None-Match': etag }).status_code == 404
+    assert mta.snapshot().fragments
+
+    mta._update()
+    second = client.get('/api/by-route/1', headers={ 'If-None-Match': etag })
+    assert second.status_code == 200
+    assert second.headers['ETag'] != etag
+    assert not mta.snapshot().fragments.get('routes')
+
+def test_api_by_location_and_routes(client):
+    client, mta = client
+    body = json.loads(client.get('/api/by-location?lat=40.75529&lon=-73.98752&tier=compact').data)
+    assert [ s['id'] for s in body['data'] ][0] == '127'
+    assert len(body['data']) == 5
+
+    assert json.loads(client.get('/api/routes').data)['data'] == ['1']
+    assert client.get('/api/by-location?lat=north').status_code == 400
+    assert client.get('/api/by-route/X').status_code == 404
+
+def test_station_routes_persisted_on_change(client, tmpdir, monkeypatch):
+    import app as webapp
+    from mtapi._jsonwriter import BackgroundJSONWriter
+    client, mta = client
+    path = str(tmpdir.join('stations_test.json'))
+    writer = BackgroundJSONWriter(path)
+    monkeypatch.setattr(webapp, 'station_routes_writer', writer)
+    monkeypatch.setattr(webapp, 'stations', { k: dict(v) for k, v in webapp.stations.items() })
+
+    assert mta.station_routes()['127'] == ('1',)
+    webapp.persist_station_routes(mta.snapshot())
+    assert writer.flush(5)
+    with open(path, 'r') as f:
+        assert json.load(f)['127']['route'] == ['1']
+
+    # an update that changes nothing leaves the file alone
+    mtime = tmpdir.join('stations_test.json').mtime()
+    tmpdir.join('stations_test.json').setmtime(mtime - 100)
+    webapp.persist_station_routes(mta.snapshot())
+    assert writer.flush(5)
+    assert tmpdir.join('stations_test.json').mtime() == mtime - 100
+    assert tmpdir.listdir() == [ tmpdir.join('stations_test.json') ]
+
+def test_plan_route_page(client):
+    client, mta = client
+    names = [ mta.get_by_id(['127'])[0]['name'], mta.get_by_id(['128'])[0]['name'] ]
+    response = client.post('/plan-route', data={ 'source': names[0], 'destination': names[1] })
+    assert response.status_code == 200
+    assert b'Shortest path is 1 stop(s)' in response.data
+    assert b'icons/1.svg' in response.data
+    assert b'departs' in response.data
+
+    response = client.post('/plan-route', data={ 'source': names[0], 'destination': 'Nowhere' })
+    assert response.status_code == 200
+    assert b'No path found.' in response.data
+
+def test_api_station_names(client):
+    client, mta = client
+    response = client.get('/api/station-names?q=times')
+    assert response.status_code == 200
+    assert json.loads(response.data)['data'] == ['Times Sq-42 St']
+    assert response.cache_control.max_age == 3600
+
+    names = json.loads(client.get('/api/station-names?q=s&limit=3').data)['data']
+    assert len(names) == 3
+    assert json.loads(client.get('/api/station-names').data)['data'] == []
+    assert client.get('/api/station-names?q=s&limit=x').status_code == 400
+    for limit in (0, -5, 1000):
+        names = json.loads(client.get('/api/station-names?q=s&limit=%d' % limit).data)['data']
+        assert 1 <= len(names) <= 50
+        results = json.loads(client.get('/api/station-search?q=st&limit=%d' % limit).data)['data']
+        assert 1 <= len(results) <= 50
+
+def test_by_stations_lookup(client):
+    client, mta = client
+    response = client.post('/by-stations', data={ 'station_name': 'times sq 42 st' })
+    assert response.status_code == 302
+    assert '/by-location?lat=40.75' in response.headers['Location']
+    assert b'<option' not in client.get('/by-stations').data
+
+def test_station_search(client):
+    client, mta = client
+    body = json.loads(client.get('/api/station-search?q=jay+st+metro+tech&limit=2').data)
+    assert body['data'][0]['name'] == 'Jay St-MetroTech'
+    assert len(body['data']) == 2
+
+    # mistyped names still complete, and still find their station
+    assert json.loads(client.get('/api/station-names?q=bleeker').data)['data'] == \
+        ['Bleecker St / Broadway-Lafayette St']
+    response = client.post('/by-stations', data={ 'station_name': 'times square' })
+    assert response.status_code == 302
+
+    response = client.post('/by-stations', data={ 'station_name': 'qqqq' })
+    assert b'No station matches' in response.data
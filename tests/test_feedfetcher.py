@@ -0,0 +1,85 @@
+import threading, time
+from mtaproto.feedresponse import header_timestamp
+from mtapi._feedfetcher import _FeedFetcher
+from mtapi._feedserver import StandInFeedServer
+
+FEED_URLS = [
+    'https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs',
+    'https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-l',
+    'https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-g'
+]
+
+def test_fetch_all_is_concurrent():
+    # no feed is answered until every request is in flight
+    barrier = threading.Barrier(len(FEED_URLS), timeout=5)
+    with StandInFeedServer() as server:
+        urls = [ server.set_feed(url, url.encode(), hold=barrier.wait) for url in FEED_URLS ]
+        results = _FeedFetcher('', workers=len(urls)).fetch_all(urls)
+
+    assert not barrier.broken
+    assert [ r.data for r in results ] == [ url.encode() for url in FEED_URLS ]
+
+def test_fetch_timeout_and_deadline():
+    with StandInFeedServer() as server:
+        fast = server.set_feed(FEED_URLS[0], b'fast')
+        slow = server.set_feed(FEED_URLS[1], b'slow', delay=1)
+
+        results = _FeedFetcher('', timeout=0.2).fetch_all([fast, slow])
+        assert results[0].data == b'fast'
+        assert not results[1] and results[1].error
+
+        results = _FeedFetcher('', timeout=5, deadline=0.2).fetch_all([fast, slow])
+        assert results[0].data == b'fast'
+        assert isinstance(results[1].error, TimeoutError)
+
+def test_fetch_missing_feed():
+    with StandInFeedServer() as server:
+        result, = _FeedFetcher('').fetch_all([server.base_url + '/nope'])
+
+    assert not result
+    assert result.error.code == 404
+
+def test_header_timestamp(make_feed):
+    assert header_timestamp(make_feed('1', ['101'], timestamp=1700000000)) == 1700000000
+    assert header_timestamp(b'') is None
+    assert header_timestamp(b'\x12\x00') is None
+
+def test_conditional_fetch_reuses_connections(make_feed):
+    with StandInFeedServer() as server:
+        url = server.set_feed(FEED_URLS[0], make_feed('1', ['101'], timestamp=1700000000))
+        fetcher = _FeedFetcher('', workers=1)
+
+        first, = fetcher.fetch_all([url])
+        assert first and not first.not_modified
+
+        # same body: the server answers 304
+        second, = fetcher.fetch_all([url])
+        assert second.not_modified and second.data is None
+
+        # new body with the same header timestamp is treated as unchanged
+        server.set_feed(FEED_URLS[0], make_feed('2', ['101'], timestamp=1700000000))
+        third, = fetcher.fetch_all([url])
+        assert third.not_modified
+
+        server.set_feed(FEED_URLS[0], make_feed('1', ['101'], timestamp=1700000030))
+        fourth, = fetcher.fetch_all([url])
+        assert fourth and not fourth.not_modified
+
+        assert server.connections == 1
+
+def test_late_result_after_deadline_is_discarded(make_feed):
+    with StandInFeedServer() as server:
+        url = server.set_feed(FEED_URLS[0], make_feed('1', ['101'], timestamp=1700000000), delay=0.3)
+        fetcher = _FeedFetcher('', timeout=5, deadline=0.1)
+
+        late, = fetcher.fetch_all([url])
+        assert isinstance(late.error, TimeoutError)
+        # let the abandoned request finish
+        time.sleep(0.4)
+        assert url not in fetcher._validators
+
+        # so the feed is fetched in full, not reported unchanged
+        server.set_feed(FEED_URLS[0], make_feed('1', ['101'], timestamp=1700000000))
+        fetcher.DEADLINE = 5
+        result, = fetcher.fetch_all([url])
+        assert result and not result.not_modified
@@ -0,0 +1,28 @@
+from mtaproto.feedresponse import FeedResponse, Trip, TripStop
+
+def shuttle_feed(feed_message):
+    msg = feed_message('GS', ['901', '902'], trips=1, timestamp=1700000000)
+    # the last stop only has a departure time
+    update = msg.entity[0].trip_update.stop_time_update[1]
+    update.ClearField('arrival')
+    update.departure.time = 1700000120
+
+    # vehicle positions carry no stop time updates
+    msg.entity.add().id = '2'
+    return msg.SerializeToString()
+
+def test_stop_times_matches_wrappers(feed_message):
+    feed = FeedResponse(shuttle_feed(feed_message))
+
+    expected = []
+    for index, entity in enumerate(feed.entity):
+        trip = Trip(entity)
+        for update in entity.trip_update.stop_time_update:
+            stop = TripStop(update)
+            expected.append((stop.stop_id, trip.route_id, trip.direction[0], int(stop.time.timestamp()),
+                             entity.trip_update.trip.trip_id, index))
+
+    assert list(feed.stop_times()) == expected == [
+        ('901', 'S', 'N', 1700000060, 'GS-0', 0),
+        ('902', 'S', 'N', 1700000120, 'GS-0', 0)
+    ]
@@ -1,4 +1,10 @@
+import threading, time
+import pytest
+from mtaproto import nyct_subway_pb2
 from mtapi import Mtapi
+from mtapi._stationindex import EARTH_RADIUS_KM, EARTH_RADIUS_MILES
+from mtapi._feedserver import StandInFeedServer
+from benchmarks.synthetic import STATIONS_FILE
 
 def test_init():
     from app import app
@@ -9,3 +15,211 @@ def test_init():
         max_minutes=app.config['MAX_MINUTES'],
         expires_seconds=app.config['CACHE_SECONDS'],
         threaded=app.config['THREADED'])
+
+def test_update_rebuilds_only_changed_feeds(make_feed):
+    with StandInFeedServer() as server:
+        now = int(time.time())
+        urls = [
+            server.set_feed(Mtapi._FEED_URLS[0], make_feed('1', ['101', '103'], timestamp=now)),
+            server.set_feed(Mtapi._FEED_URLS[1], make_feed('L', ['L05', 'L06'], timestamp=now))
+        ]
+        mta = Mtapi('', STATIONS_FILE, feed_urls=urls, expires_seconds=None)
+
+        assert sorted(mta.get_routes()) == ['1', 'L']
+        station, = mta.get_by_id(['101'])
+        assert station['routes'] == {'1'}
+        assert [ t['route'] for t in station['N'] ] == ['1', '1']
+
+        before = mta.snapshot()
+        slices = dict(mta._feed_slices)
+        server.set_feed(Mtapi._FEED_URLS[1], make_feed('L', ['L05', 'L06', 'L08'], timestamp=now + 30))
+        mta._update()
+        after = mta.snapshot()
+
+        assert after.generation == before.generation + 1
+        assert mta._feed_slices[urls[0]] is slices[urls[0]]
+        assert mta._feed_slices[urls[1]] is not slices[urls[1]]
+        assert mta.get_by_id(['L08'])[0]['routes'] == {'L'}
+        assert mta.get_by_id(['103'])[0]['routes'] == {'1'}
+
+        # nothing changed: the table is filtered, everything else is kept
+        mta._clock = lambda: now + 90
+        mta._update()
+        unchanged = mta.snapshot()
+        assert unchanged.generation == after.generation + 1
+        assert unchanged.routes == after.routes
+        assert unchanged.route_stations['L'] is after.route_stations['L']
+        assert unchanged.station_routes is not after.station_routes
+        assert unchanged.station_routes['L08'] == ('L',)
+        assert unchanged.arrivals.route_names is after.arrivals.route_names
+        assert unchanged.arrivals.reference_time == now + 90
+        assert len(unchanged.arrivals) < len(after.arrivals)
+        assert unchanged.arrivals.time.min() >= now + 90
+        assert len(unchanged.timetable) < len(after.timetable)
+
+def test_snapshot_is_immutable(make_feed):
+    with StandInFeedServer() as server:
+        url = server.set_feed(Mtapi._FEED_URLS[0], make_feed('1', ['101']))
+        mta = Mtapi('', STATIONS_FILE, feed_urls=[url], expires_seconds=None)
+
+        snapshot = mta.snapshot()
+        with pytest.raises(AttributeError):
+            snapshot.generation = 0
+        with pytest.raises(TypeError):
+            snapshot.stations['101'] = None
+
+        with pytest.raises(ValueError):
+            snapshot.arrivals.time[0] = 0
+
+def test_arrivals_sorted_and_truncated(make_feed):
+    with StandInFeedServer() as server:
+        now = int(time.time())
+        urls = [
+            server.set_feed(Mtapi._FEED_URLS[0], make_feed('1', ['127'], trips=8, timestamp=now)),
+            server.set_feed(Mtapi._FEED_URLS[2], make_feed('N', ['R16'], trips=8, timestamp=now + 5))
+        ]
+        mta = Mtapi('', STATIONS_FILE, feed_urls=urls, expires_seconds=None, max_trains=3)
+
+        station, = mta.get_by_id(['127'])
+        assert station['routes'] == {'1', 'N'}
+        assert station['last_update'].timestamp() == now + 5
+        for direction in ('N', 'S'):
+            times = [ t['time'] for t in station[direction] ]
+            assert len(times) == 3 and times == sorted(times)
+
+def test_train_tiers(make_feed):
+    with StandInFeedServer() as server:
+        url = server.set_feed(Mtapi._FEED_URLS[0], make_feed('1', ['101'], trips=40))
+        mta = Mtapi('', STATIONS_FILE, feed_urls=[url], expires_seconds=None,
+                    max_trains=5, train_tiers={'compact': 2, 'full': 15})
+
+        # ingest keeps no more than the largest tier per station and direction
+        assert len(mta._feed_slices[url].time) == 30
+
+        assert len(mta.get_by_id(['101'])[0]['N']) == 5
+        assert len(mta.get_by_id(['101'], tier='compact')[0]['N']) == 2
+        assert len(mta.get_by_id(['101'], tier='full')[0]['N']) == 15
+        assert len(mta.get_by_id(['101'], tier='bogus')[0]['S']) == 5
+
+        # by route: serialized once per snapshot, cut down per tier
+        compact = mta.get_by_route('1', tier='compact')
+        assert mta.get_by_route('1', tier='compact') is compact
+        assert len(compact[0]['N']) == 2 and len(mta.get_by_route('1', tier='full')[0]['N']) == 15
+        assert compact[0]['N'] == mta.get_by_id(['101'], tier='compact')[0]['N']
+        mta._update()
+        assert mta.get_by_route('1', tier='compact') is not compact
+
+def test_stations_near(make_feed):
+    with StandInFeedServer() as server:
+        url = server.set_feed(Mtapi._FEED_URLS[0], make_feed('1', ['127']))
+        mta = Mtapi('', STATIONS_FILE, feed_urls=[url], expires_seconds=None)
+
+        # Times Sq - 42 St
+        nearest = mta.stations_near((40.75529, -73.98752), 3)
+        assert len(nearest) == 3
+        assert nearest[0][1] is mta.snapshot().stations['127']
+        assert [ d for d, _ in nearest ] == sorted(d for d, _ in nearest)
+
+        within = mta.stations_near((40.75529, -73.98752), limit=None, radius=0.5)
+        assert within and all(d <= 0.5 for d, _ in within)
+
+        assert [ s['id'] for s in mta.get_by_point((40.75529, -73.98752), 3) ] == \
+            [ s['id'] for _, s in nearest ]
+
+        stations = mta.get_nearest((40.75529, -73.98752), 3, earth_radius=EARTH_RADIUS_MILES)
+        assert [ s['id'] for s in stations ] == [ s['id'] for _, s in nearest ]
+        assert [ s['distance'] for s in stations ] == \
+            pytest.approx([ d * EARTH_RADIUS_MILES / EARTH_RADIUS_KM for d, _ in nearest ])
+        assert [ t['route'] for t in stations[0]['N'] ] == ['1', '1']
+
+def test_route_stations_in_line_order():
+    now = int(time.time())
+    msg = nyct_subway_pb2.gtfs__realtime__pb2.FeedMessage()
+    msg.header.gtfs_realtime_version = '1.0'
+    msg.header.timestamp = now
+    trips = [
+        ('S', ['101', '103', '104']),
+        # northbound trips count in reverse
+        ('N', ['110', '109', '108', '107', '106', '104']),
+        # a branch off 104; two stops of the same station (Times Sq) appear once
+        ('S', ['104', '127', '725', '128'])
+    ]
+    for t, (direction, stops) in enumerate(trips):
+        entity = msg.entity.add()
+        entity.id = entity.trip_update.trip.trip_id = 'trip-%d' % t
+        entity.trip_update.trip.route_id = '1'
+        entity.trip_update.trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor].direction = \
+            1 if direction == 'N' else 3
+        for i, stop_id in enumerate(stops):
+            update = entity.trip_update.stop_time_update.add()
+            update.stop_id = stop_id + direction
+            update.arrival.time = now + 60 * (i + 1)
+
+    with StandInFeedServer() as server:
+        url = server.set_feed(Mtapi._FEED_URLS[0], msg.SerializeToString())
+        mta = Mtapi('', STATIONS_FILE, feed_urls=[url], expires_seconds=None)
+
+        assert [ s['id'] for s in mta.get_by_route('1') ] == \
+            ['101', '103', '104', '106', '107', '108', '109', '110', '127', '128']
+
+def test_trips_split_per_entity(feed_message):
+    now = int(time.time())
+    msg = feed_message('1', ['101', '103'], trips=1, timestamp=now)
+    # the next entity is another train with the same, empty, trip_id
+    msg.entity.add().CopyFrom(feed_message('1', ['106', '107'], trips=1, timestamp=now).entity[0])
+    for entity in msg.entity:
+        entity.trip_update.trip.trip_id = ''
+
+    with StandInFeedServer() as server:
+        url = server.set_feed(Mtapi._FEED_URLS[0], msg.SerializeToString())
+        mta = Mtapi('', STATIONS_FILE, feed_urls=[url], expires_seconds=None)
+
+    graph = mta.transit_graph()
+    stations = { graph.ids[i]: i for i in range(len(graph)) }
+    assert stations['103'] in graph.neighbors(stations['101']).tolist()
+    # no hop from the end of one trip to the start of the next
+    assert graph.neighbors(stations['103']).tolist() == [stations['101']]
+    assert mta.plan_trip('101', '107') is None
+
+def test_remaining_minutes_precomputed(make_feed):
+    with StandInFeedServer() as server:
+        now = int(time.time())
+        url = server.set_feed(Mtapi._FEED_URLS[0], make_feed('1', ['127'], trips=6, timestamp=now))
+        mta = Mtapi('', STATIONS_FILE, feed_urls=[url], expires_seconds=None)
+
+        snapshot = mta.snapshot()
+        updated = snapshot.last_update.timestamp()
+        station, = mta.get_by_id(['127'])
+        for train in station['N'] + station['S']:
+            assert train['epoch'] == train['time'].timestamp()
+            assert train['remaining_minutes'] == int((train['epoch'] - updated) // 60)
+
+        # counted from the update's clock, not the feed's header time
+        assert snapshot.arrivals.reference_time == pytest.approx(updated)
+
+def test_threaded_polls_each_feed(make_feed):
+    with StandInFeedServer() as server:
+        now = int(time.time())
+        urls = [
+            server.set_feed(Mtapi._FEED_URLS[0], make_feed('1', ['101', '103'], timestamp=now)),
+            server.set_feed(Mtapi._FEED_URLS[1], make_feed('L', ['L05', 'L06'], timestamp=now)),
+            server.base_url + '/missing'
+        ]
+        mta = Mtapi('', STATIONS_FILE, feed_urls=urls, threaded=True)
+        try:
+            polls = mta.next_polls()
+            assert set(polls) == set(urls)
+            assert all(polls[url].timestamp() > now for url in urls)
+            assert mta._scheduler._feeds[urls[2]].failures == 1
+            assert mta._scheduler._feeds[urls[0]].timestamp == now
+
+            # however old the snapshot, requests leave updating to the thread
+            updates = []
+            mta._update = lambda feed_urls=None: updates.append(threading.current_thread())
+            mta._clock = lambda: now + 3600
+            assert not mta.is_expired()
+            assert mta.snapshot().last_update.timestamp() < now + 60
+            assert threading.current_thread() not in updates
+        finally:
+            mta.close()
+        assert not mta._scheduler.is_alive()
@@ -0,0 +1,33 @@
+from mtapi._nameindex import _NameIndex, normalize
+
+NAMES = ['Times Sq-42 St', 'Broadway-Lafayette St / Bleecker St', '86 St', '86 St', 'Lafayette Av',
+         'Jay St-MetroTech', 'Bedford Av', 'Bay Ridge Av']
+
+def test_normalize():
+    assert normalize('Times Sq-42 St') == 'times sq 42 st'
+    assert normalize('  Jay St - MetroTech ') == 'jay st metrotech'
+    assert normalize('Café Av') == 'cafe av'
+
+def test_lookup():
+    index = _NameIndex(NAMES)
+    assert index.lookup('times sq 42 st') == [0]
+    assert index.lookup('TIMES SQ-42 ST') == [0]
+    # either part of a complex's name, or the whole of it
+    assert index.lookup('Bleecker St') == [1]
+    assert index.lookup('broadway lafayette st / bleecker st') == [1]
+    assert index.lookup('86 St') == [2, 3]
+    assert index.lookup('times') == []
+
+def test_complete():
+    index = _NameIndex(NAMES)
+    assert index.complete('times') == ['Times Sq-42 St']
+    # starts of names first, then later words, each shortest first
+    assert index.complete('b') == ['Bedford Av', 'Bay Ridge Av', 'Broadway-Lafayette St / Bleecker St']
+    assert index.complete('lafay') == ['Lafayette Av', 'Broadway-Lafayette St / Bleecker St']
+    assert index.complete('86') == ['86 St']
+    assert index.complete('a', limit=1) == ['Bedford Av']
+    assert index.complete('a', limit=0) == [] and index.complete('a', limit=-3) == []
+    # short prefixes are ranked once whatever the limit
+    assert list(index._short) == ['b', '86', 'a']
+    assert index.complete('') == [] and index.complete('-') == []
+    assert index.complete('zz') == []
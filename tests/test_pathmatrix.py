@@ -0,0 +1,135 @@
+import os
+import numpy as np
+
+from mtapi import Mtapi
+from mtapi._pathmatrix import _PathMatrix
+from mtapi._transitgraph import _TransitGraph
+from benchmarks.synthetic import SyntheticFeedGenerator, SyntheticFeedSource, STATIONS_FILE
+
+def make_graph(extra=()):
+    stations = [ { 'id': str(i), 'name': 'Station %d' % i } for i in range(7) ]
+    # 0 - 1 - 2 - 3 on A, and 0 - 4 - 5 - 3 as long but on B, C and B
+    return _TransitGraph(stations, { 'A': [(0, 1), (1, 2), (2, 3)] + list(extra),
+                                     'B': [(0, 4), (5, 3)], 'C': [(4, 5)] })
+
+def test_build():
+    graph = make_graph()
+    matrix = _PathMatrix.build(graph)
+    assert matrix.hops.dtype == np.int16 and matrix.hops.shape == (7, 7)
+
+    assert matrix.hops[0, 3] == 3 and matrix.transfers[0, 3] == 0
+    assert matrix.path(0, 3) == [0, 1, 2, 3]
+    assert matrix.path(4, 3) == [4, 5, 3] and matrix.transfers[4, 3] == 1
+    assert matrix.path(2, 2) == [2] and matrix.next_hop[2, 2] == -1
+    assert matrix.hops[0, 6] == -1 and matrix.path(0, 6) is None
+    assert np.array_equal(matrix.hops, matrix.hops.T)
+
+    assert matrix.shortest_path([4, 6], [2, 3]) == [4, 5, 3]
+    assert matrix.shortest_path([6], [0, 3]) is None
+
+def route_edges(graph):
+    edges = {}
+    for a in range(len(graph)):
+        start, end = graph.indptr[a], graph.indptr[a + 1]
+        for b, route in zip(graph.indices[start:end].tolist(), graph.edge_routes[start:end].tolist()):
+            edges.setdefault((a, b), set()).add(route)
+    return edges
+
+def path_transfers(edges, path):
+    # the fewest changes of route along a given path: ride each route as far
+    # as it goes, working back from the target
+    changes, riding = 0, None
+    for a, b in reversed(list(zip(path, path[1:]))):
+        if riding is not None and not riding & edges[a, b]:
+            changes += 1
+            riding = None
+        riding = edges[a, b] if riding is None else riding & edges[a, b]
+    return changes
+
+def test_transfers_follow_next_hop():
+    stations = [ { 'id': str(i), 'name': 'Station %d' % i } for i in range(7) ]
+    # 5 reaches 3 in two stops on A via 2 or on B via 4; 6 joins at 5 on B
+    graph = _TransitGraph(stations, { 'A': [(5, 2), (2, 3)], 'B': [(6, 5), (5, 4), (4, 3)] })
+    matrix = _PathMatrix.build(graph)
+    assert matrix.hops[6, 3] == 3
+    assert matrix.transfers[6, 3] == path_transfers(route_edges(graph), matrix.path(6, 3))
+
+    source = SyntheticFeedSource(SyntheticFeedGenerator(), cycles=1)
+    mta = Mtapi('', STATIONS_FILE, feed_source=source, clock=source.clock, expires_seconds=None)
+    graph = mta.transit_graph()
+    matrix = _PathMatrix.build(graph)
+    edges = route_edges(graph)
+
+    for a in range(0, len(graph), 3):
+        for b in range(0, len(graph), 5):
+            path = matrix.path(a, b)
+            if path is not None:
+                assert matrix.transfers[a, b] == path_transfers(edges, path)
+
+def test_matches_graph_search():
+    source = SyntheticFeedSource(SyntheticFeedGenerator(), cycles=1)
+    mta = Mtapi('', STATIONS_FILE, feed_source=source, clock=source.clock, expires_seconds=None)
+    graph = mta.transit_graph()
+    matrix = _PathMatrix.build(graph)
+
+    for a in range(0, len(graph), 7):
+        for b in range(0, len(graph), 11):
+            path = graph.shortest_path([a], [b])
+            if path is None:
+                assert matrix.path(a, b) is None
+            else:
+                assert matrix.hops[a, b] == len(path) - 1
+                assert len(matrix.path(a, b)) == len(path)
+
+def test_saved_per_graph(tmpdir):
+    graph = make_graph()
+    matrix = _PathMatrix.load(graph, str(tmpdir))
+    assert os.listdir(str(tmpdir)) == [ 'pathmatrix-%s.npy' % graph.digest() ]
+
+    loaded = _PathMatrix.load(make_graph(), str(tmpdir))
+    assert isinstance(loaded.hops, np.memmap)
+    assert np.array_equal(loaded.next_hop, matrix.next_hop)
+
+    # new track, new digest, new matrix in place of the old one
+    grown = make_graph([(3, 6)])
+    assert grown.digest() != graph.digest()
+    assert _PathMatrix.load(grown, str(tmpdir)).hops[0, 6] == 4
+    assert os.listdir(str(tmpdir)) == [ 'pathmatrix-%s.npy' % grown.digest() ]
+
+def test_rebuilt_when_graph_changes(tmpdir):
+    source = SyntheticFeedSource(SyntheticFeedGenerator(trips_per_route=2, stops_per_trip=3), cycles=1)
+    mta = Mtapi('', STATIONS_FILE, feed_source=source, clock=source.clock, expires_seconds=None,
+                path_matrix_dir=str(tmpdir), path_matrix_delay=0)
+    matrix = mta.path_matrix(timeout=30)
+    assert matrix.digest == mta.transit_graph().digest()
+
+    mta._fetcher = SyntheticFeedSource(SyntheticFeedGenerator(trips_per_route=10), cycles=1)
+    mta._update()
+    rebuilt = mta.path_matrix(timeout=30)
+    assert rebuilt.digest == mta.transit_graph().digest() != matrix.digest
+
+    graph = mta.transit_graph()
+    a, b = graph.indices[0], graph.indices[-1]
+    journey = mta.plan_route(graph.ids[a], graph.ids[b])
+    assert len(journey) == rebuilt.hops[a, b] + 1
+
+def test_rebuild_waits_for_the_graph_to_settle(monkeypatch):
+    source = SyntheticFeedSource(SyntheticFeedGenerator(trips_per_route=2, stops_per_trip=3), cycles=1)
+    mta = Mtapi('', STATIONS_FILE, feed_source=source, clock=source.clock, expires_seconds=None,
+                path_matrix_delay=1)
+    assert mta.path_matrix(timeout=30) is not None
+
+    builds = []
+    build = _PathMatrix.build
+    monkeypatch.setattr(_PathMatrix, 'build', classmethod(lambda cls, graph: builds.append(graph) or build(graph)))
+
+    graphs = []
+    for stops in (6, 30):
+        mta._fetcher = SyntheticFeedSource(SyntheticFeedGenerator(trips_per_route=4, stops_per_trip=stops), cycles=1)
+        mta._update()
+        graphs.append(mta.transit_graph())
+    assert graphs[0] is not graphs[1]
+    assert mta.path_matrix() is None
+
+    assert mta.path_matrix(timeout=30).digest == graphs[1].digest()
+    assert builds == [graphs[1]]
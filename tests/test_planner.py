@@ -0,0 +1,99 @@
+import time
+import numpy as np
+
+from mtapi import Mtapi, _planner
+from mtapi._timetable import _Timetable
+from mtapi._transitgraph import _TransitGraph
+from mtapi._feedserver import StandInFeedServer
+from benchmarks.synthetic import STATIONS_FILE
+
+def make_timetable():
+    stations = [ { 'id': str(i), 'name': 'Station %d' % i } for i in range(5) ]
+    graph = _TransitGraph(stations, { 'A': [(0, 1), (1, 2)], 'B': [(2, 3)], 'C': [(0, 3)] })
+
+    # X rides 0 - 1 - 2 on A, then Y or the earlier Z carry on to 3 on B, and
+    # W goes straight from 0 to 3 on C, but much later
+    connections = [
+        # from, to, departure, arrival, route, trip
+        (0, 1, 100, 160, 0, 0),
+        (1, 2, 160, 220, 0, 0),
+        (2, 3, 290, 330, 1, 1),
+        (2, 3, 225, 260, 1, 2),
+        (0, 3, 500, 600, 2, 3)
+    ]
+    columns = [ np.array(c) for c in zip(*connections) ]
+    timetable = _Timetable(*columns, trip_ids=['X', 'Y', 'Z', 'W'], route_names=['A', 'B', 'C'])
+    return graph, timetable
+
+def test_timetable_sorted_by_departure():
+    graph, timetable = make_timetable()
+    assert timetable.dep_time.tolist() == [100, 160, 225, 290, 500]
+    assert timetable.first_departing(200) == 2
+    assert timetable.rows[2] == (225, 260, 2, 3, 2)
+
+def test_earliest_arrival_with_transfer_waits():
+    graph, timetable = make_timetable()
+
+    journey = _planner.earliest_arrival(graph, timetable, [0], [3], 0)
+    assert journey.stations == ['0', '1', '2', '3']
+    assert journey.arrive == 330 and journey.depart == 0
+    assert journey.routes == ['A', 'B'] and journey.transfers == ['2']
+    assert journey.legs[0] == { 'route': 'A', 'from': '0', 'to': '2', 'stops': 2, 'trip': 'X',
+                                'depart': 100, 'arrive': 220, 'wait': 100 }
+    # Z leaves 5s after X gets in, too soon to change trains
+    assert journey.legs[1]['trip'] == 'Y' and journey.legs[1]['wait'] == 70
+
+    journey = _planner.earliest_arrival(graph, timetable, [0], [3], 0, transfer_seconds=0)
+    assert journey.legs[1]['trip'] == 'Z' and journey.arrive == 260
+
+    # X already gone
+    journey = _planner.earliest_arrival(graph, timetable, [0], [3], 101)
+    assert journey.routes == ['C'] and journey.arrive == 600
+
+    assert _planner.earliest_arrival(graph, timetable, [0], [4], 0) is None
+    assert _planner.earliest_arrival(graph, timetable, [3], [0], 0) is None
+    assert _planner.earliest_arrival(graph, timetable, [2], [2], 0).stations == ['2']
+
+def test_plan_trip_on_live_feed(make_feed):
+    now = int(time.time())
+    with StandInFeedServer() as server:
+        url = server.set_feed(Mtapi._FEED_URLS[0], make_feed('1', ['127', '128', '129'], timestamp=now))
+        mta = Mtapi('', STATIONS_FILE, feed_urls=[url], expires_seconds=None)
+
+        journey = mta.plan_trip('127', '129', depart=now)
+        assert journey.stations == ['127', '128', '129']
+        assert journey.legs[0]['trip'] == '1-0'
+        assert journey.arrive == now + 180
+        assert journey.serialize()['arrive'] == now + 180
+
+        # the first train has left 127 by then
+        assert mta.plan_trip('127', '129', depart=now + 61).legs[0]['trip'] == '1-1'
+        assert mta.plan_trip('127', '129', depart=now + 3600) is None
+
+def test_earliest_arrival_walks_transfers():
+    stations = [ { 'id': str(i), 'name': 'Station %d' % i } for i in range(4) ]
+    # changing at 1 is quick, and 2 is a short walk from 1
+    graph = _TransitGraph(stations, { 'A': [(0, 1)], 'B': [(1, 3), (2, 3)] }, { (1, 1): 10, (1, 2): 30 })
+    connections = [
+        (0, 1, 100, 160, 0, 0),
+        (1, 3, 175, 400, 1, 1),
+        (2, 3, 200, 300, 1, 2)
+    ]
+    columns = [ np.array(c) for c in zip(*connections) ]
+    timetable = _Timetable(*columns, trip_ids=['X', 'Y', 'Z'], route_names=['A', 'B'])
+
+    journey = _planner.earliest_arrival(graph, timetable, [0], [3], 0)
+    assert journey.stations == ['0', '1', '2', '3']
+    assert journey.routes == ['A', 'transfer', 'B']
+    assert journey.legs[1] == { 'route': 'transfer', 'from': '1', 'to': '2', 'stops': 1, 'trip': None,
+                                'depart': 160, 'arrive': 190, 'wait': 0 }
+    assert journey.legs[2]['wait'] == 10 and journey.arrive == 300
+    assert _planner.earliest_arrival(graph, timetable, [1], [2], 0).legs[0]['route'] == 'transfer'
+
+    # without the walk, Y leaves 15s after X gets in, which only the
+    # station's own transfer time allows
+    graph = _TransitGraph(stations, { 'A': [(0, 1)], 'B': [(1, 3), (2, 3)] }, { (1, 1): 10 })
+    journey = _planner.earliest_arrival(graph, timetable, [0], [3], 0, transfer_seconds=60)
+    assert journey.routes == ['A', 'B'] and journey.arrive == 400
+    graph = _TransitGraph(stations, { 'A': [(0, 1)], 'B': [(1, 3), (2, 3)] })
+    assert _planner.earliest_arrival(graph, timetable, [0], [3], 0, transfer_seconds=60) is None
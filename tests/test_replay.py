@@ -0,0 +1,77 @@
+import time
+from mtaproto import nyct_subway_pb2
+from mtaproto.feedresponse import header_timestamp
+from mtapi import Mtapi
+from mtapi._feedfetcher import _FeedFetcher
+from mtapi._feedserver import StandInFeedServer
+from mtapi._replay import FeedArchive, FeedRecorder, ReplayFeedSource, feed_key, rebase_feed
+from benchmarks.synthetic import STATIONS_FILE
+
+RECORDED_AT = 1700000000
+
+def record(tmpdir, make_feed, cycles=3):
+    archive = FeedArchive(str(tmpdir))
+    for i in range(cycles):
+        timestamp = RECORDED_AT + 30 * i
+        archive.write(Mtapi._FEED_URLS[0], timestamp, make_feed('1', ['101'], trips=1, timestamp=timestamp))
+    return archive
+
+def test_feed_key():
+    assert feed_key(Mtapi._FEED_URLS[1]) == 'nyct-gtfs-l'
+    assert feed_key('http://127.0.0.1:8001/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-l') == 'nyct-gtfs-l'
+
+def test_recorder(tmpdir, make_feed):
+    with StandInFeedServer() as server:
+        url = server.set_feed(Mtapi._FEED_URLS[0], make_feed('1', ['101'], trips=1, timestamp=RECORDED_AT))
+        fetcher = _FeedFetcher('', recorder=FeedRecorder(str(tmpdir)))
+        fetcher.fetch_all([url])
+        fetcher.fetch_all([url])
+
+    archive = FeedArchive(str(tmpdir))
+    assert archive.feeds() == { 'nyct-gtfs': url }
+    captures = archive.captures('nyct-gtfs')
+    assert len(captures) == 1
+    assert archive.read('nyct-gtfs', captures[0]) == make_feed('1', ['101'], trips=1, timestamp=RECORDED_AT)
+
+def test_replay_steps_through_cycles(tmpdir, make_feed):
+    record(tmpdir, make_feed)
+    source = ReplayFeedSource(str(tmpdir))
+    mta = Mtapi('', STATIONS_FILE, feed_urls=Mtapi._FEED_URLS[:1], feed_source=source,
+                clock=source.clock, expires_seconds=None)
+
+    assert mta.last_update().timestamp() == RECORDED_AT
+    station, = mta.get_by_id(['101'])
+    assert [ t['time'].timestamp() for t in station['N'] ] == [RECORDED_AT + 60]
+
+    mta._update()
+    assert mta.last_update().timestamp() == RECORDED_AT + 30
+
+    mta._update()
+    mta._update()
+    assert mta.last_update().timestamp() == RECORDED_AT + 60
+    assert source.fetch_all(Mtapi._FEED_URLS[:1])[0].not_modified
+
+def test_server_plays_archive(tmpdir, make_feed):
+    archive = record(tmpdir, make_feed)
+    now = [RECORDED_AT + 3600]
+    with StandInFeedServer() as server:
+        url, = server.play(archive, rebase=True, clock=lambda: now[0])
+        fetcher = _FeedFetcher('')
+
+        first, = fetcher.fetch_all([url])
+        assert header_timestamp(first.data) == RECORDED_AT + 3600
+
+        # the next cycle was recorded 30s later
+        now[0] += 30
+        for _ in range(500):
+            last, = fetcher.fetch_all([url])
+            if not last.not_modified:
+                break
+            time.sleep(0.01)
+        assert last and header_timestamp(last.data) == RECORDED_AT + 3630
+
+def test_rebase_feed(make_feed):
+    feed = nyct_subway_pb2.gtfs__realtime__pb2.FeedMessage()
+    feed.ParseFromString(rebase_feed(make_feed('1', ['101'], trips=1, timestamp=RECORDED_AT), 100))
+    assert feed.header.timestamp == RECORDED_AT + 100
+    assert feed.entity[0].trip_update.stop_time_update[0].arrival.time == RECORDED_AT + 160
@@ -0,0 +1,61 @@
+import json, random
+import pytest
+import numpy as np
+from mtapi._stationindex import _StationIndex, haversine, haversine_matrix, EARTH_RADIUS_MILES, EARTH_RADIUS_KM
+from benchmarks.synthetic import STATIONS_FILE
+
+@pytest.fixture(scope='module')
+def locations():
+    with open(STATIONS_FILE, 'r') as f:
+        return [ tuple(s['location']) for s in json.load(f).values() ]
+
+def brute_force(locations, point):
+    return sorted((haversine(point, p), i) for i, p in enumerate(locations))
+
+def test_haversine():
+    # Times Sq - 42 St to Grand Central - 42 St is about 0.9km
+    assert haversine((40.755983, -73.986229), (40.751776, -73.976848)) == pytest.approx(0.90, abs=0.02)
+    assert haversine((40.75, -73.98), (40.75, -73.98)) == 0
+
+def test_nearest_matches_brute_force(locations):
+    index = _StationIndex(locations)
+    rng = random.Random(0)
+    for _ in range(200):
+        point = (40.5 + rng.random() * 0.45, -74.1 + rng.random() * 0.4)
+        expected = brute_force(locations, point)[:7]
+        found = index.nearest(point, 7)
+        assert [ i for _, i in found ] == [ i for _, i in expected ]
+        assert [ d for d, _ in found ] == pytest.approx([ d for d, _ in expected ])
+
+def test_within_matches_brute_force(locations):
+    index = _StationIndex(locations)
+    rng = random.Random(1)
+    for _ in range(50):
+        point = (40.5 + rng.random() * 0.45, -74.1 + rng.random() * 0.4)
+        radius = rng.random() * 3
+        expected = [ (d, i) for d, i in brute_force(locations, point) if d <= radius ]
+        assert [ i for _, i in index.within(point, radius) ] == [ i for _, i in expected ]
+
+def test_edge_cases(locations):
+    index = _StationIndex(locations)
+    assert index.nearest((40.7, -74.0), 0) == []
+    assert len(index.nearest((40.7, -74.0), len(locations) + 5)) == len(locations)
+    assert _StationIndex([]).nearest((40.7, -74.0), 3) == []
+
+def test_haversine_matrix(locations):
+    index = _StationIndex(locations)
+    points = [ (40.6, -73.9), (40.8, -73.95), (40.75529, -73.98752) ]
+
+    one = index.distances(points[0])
+    assert one.shape == (len(locations),)
+    assert one.tolist() == pytest.approx([ haversine(points[0], p) for p in locations ])
+
+    many = haversine_matrix(points, locations)
+    assert many.shape == (3, len(locations))
+    for row, point in zip(many, points):
+        assert row.tolist() == pytest.approx([ haversine(point, p) for p in locations ])
+    assert np.allclose(index.distances(points), many)
+
+    miles = index.distances(points, EARTH_RADIUS_MILES)
+    assert np.allclose(miles, many * EARTH_RADIUS_MILES / EARTH_RADIUS_KM)
+    assert int(many[2].argmin()) == index.nearest(points[2])[0][1]
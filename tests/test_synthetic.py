@@ -0,0 +1,21 @@
+from mtaproto.feedresponse import FeedResponse
+from mtapi import Mtapi
+from benchmarks.synthetic import SyntheticFeedGenerator, SyntheticFeedSource, STATIONS_FILE
+
+def test_generated_feeds_are_valid():
+    generator = SyntheticFeedGenerator(trips_per_route=4, stops_per_trip=5, scale=2)
+    feed = FeedResponse(generator.feed(1, now=1700000000))
+
+    stop_times = list(feed.stop_times())
+    assert feed.header.timestamp == 1700000000
+    assert len(feed.entity) == 8
+    assert set(route for _, route, _, _, _, _ in stop_times) == {'L'}
+    assert set(direction for _, _, direction, _, _, _ in stop_times) == {'N', 'S'}
+    assert all(stop_id.startswith('L') for stop_id, _, _, _, _, _ in stop_times)
+
+def test_synthetic_source_drives_mtapi():
+    source = SyntheticFeedSource(SyntheticFeedGenerator(trips_per_route=2), cycles=2)
+    mta = Mtapi('', STATIONS_FILE, feed_source=source, clock=source.clock, expires_seconds=None)
+
+    assert {'1', 'L', 'A', 'G', 'SI'} <= set(mta.get_routes())
+    assert len(mta.snapshot().arrivals) > 0
@@ -0,0 +1,154 @@
+import json, os, subprocess, sys
+import pytest
+
+from mtapi import Mtapi, _planner
+from mtapi._transitgraph import _TransitGraph
+from benchmarks.synthetic import SyntheticFeedGenerator, SyntheticFeedSource, STATIONS_FILE
+
+def make_graph():
+    stations = [ { 'id': str(i), 'name': 'Station %d' % i } for i in range(6) ]
+    stations[5]['name'] = 'Station 1'
+    # 0 - 1 - 2 - 3 on A, 1 - 2 on B as well, 4 and 5 on their own
+    return _TransitGraph(stations, { 'A': [(0, 1), (1, 2), (3, 2), (1, 2)], 'B': [(2, 1)], 'C': [(5, 5)] })
+
+def test_csr_layout():
+    graph = make_graph()
+    assert len(graph) == 6
+    assert graph.route_names == ('A', 'B', 'C')
+    assert graph.indptr.tolist() == [0, 1, 4, 7, 8, 8, 8]
+    assert graph.neighbors(1).tolist() == [0, 2, 2]
+    assert [ graph.route_names[r] for r in graph.edge_routes[graph.indptr[2]:graph.indptr[3]] ] == ['A', 'B', 'A']
+    assert graph.neighbors(4).tolist() == []
+
+def test_shortest_path():
+    graph = make_graph()
+    assert graph.shortest_path([0], [3]) == [0, 1, 2, 3]
+    assert graph.shortest_path([3], [0]) == [3, 2, 1, 0]
+    assert graph.shortest_path([2], [2]) == [2]
+    assert graph.shortest_path([0], [4]) is None
+    # names can be shared, and any station of the name will do
+    assert graph.stations_named('Station 1') == [1, 5]
+    assert graph.shortest_path([3], graph.stations_named('Station 1')) == [3, 2, 1]
+
+def test_graph_rebuilt_only_on_change():
+    source = SyntheticFeedSource(SyntheticFeedGenerator(trips_per_route=2, stops_per_trip=3), cycles=2)
+    mta = Mtapi('', STATIONS_FILE, feed_source=source, clock=source.clock, expires_seconds=None)
+
+    mta._update()
+    graph = mta.transit_graph()
+    assert graph.n_edges > 0
+    assert set(graph.route_names) == set(mta.get_routes())
+
+    # both cycles again: no new track, same graph
+    mta._update()
+    mta._update()
+    assert mta.transit_graph() is graph
+
+    # longer trips cover more of each line
+    mta._fetcher = SyntheticFeedSource(SyntheticFeedGenerator(trips_per_route=10), cycles=1)
+    mta._update()
+    assert mta.transit_graph().n_edges > graph.n_edges
+
+def test_plan_legs_and_transfers():
+    stations = [ { 'id': str(i), 'name': 'Station %d' % i } for i in range(7) ]
+    # 0 - 1 - 2 on A, 2 - 3 - 4 on B, 1 - 2 - 3 on C, 6 on its own
+    graph = _TransitGraph(stations, { 'A': [(0, 1), (1, 2)], 'B': [(2, 3), (3, 4)], 'C': [(1, 2), (2, 3)] })
+
+    journey = _planner.plan(graph, [0], [4])
+    assert journey.stations == ['0', '1', '2', '3', '4']
+    assert list(journey) == [ 'Station %d' % i for i in range(5) ]
+    # C covers the middle but A and B still take two legs between them
+    assert journey.routes == ['A', 'B']
+    assert journey.transfers == ['2']
+    assert journey.legs[0] == { 'route': 'A', 'from': '0', 'to': '2', 'stops': 2 }
+    assert journey.serialize()['legs'][1] == { 'route': 'B', 'from': '2', 'to': '4', 'stops': 2 }
+
+    journey = _planner.plan(graph, [1], [3])
+    assert journey.routes == ['C'] and journey.transfers == []
+    assert _planner.plan(graph, [0], [6]) is None
+
+def forward_hops(graph, source, target):
+    # plain BFS over the CSR arrays, the reference the bidirectional search must match
+    hops = { source: 0 }
+    frontier = [source]
+    while frontier and target not in hops:
+        following = []
+        for i in frontier:
+            for j in graph.neighbors(i).tolist():
+                if j not in hops:
+                    hops[j] = hops[i] + 1
+                    following.append(j)
+        frontier = following
+    return hops.get(target)
+
+def test_bidirectional_matches_forward_search():
+    source = SyntheticFeedSource(SyntheticFeedGenerator(), cycles=1)
+    mta = Mtapi('', STATIONS_FILE, feed_source=source, clock=source.clock, expires_seconds=None)
+    graph = mta.transit_graph()
+
+    for a in range(0, len(graph), 7):
+        for b in range(0, len(graph), 11):
+            path = graph.shortest_path([a], [b])
+            expected = forward_hops(graph, a, b)
+            assert (path is None) == (expected is None)
+            if path is not None:
+                assert len(path) == expected + 1
+                assert path[0] == a and path[-1] == b
+                assert all(j in graph.neighbors(i) for i, j in zip(path, path[1:]))
+
+def test_plan_route():
+    source = SyntheticFeedSource(SyntheticFeedGenerator(), cycles=1)
+    mta = Mtapi('', STATIONS_FILE, feed_source=source, clock=source.clock, expires_seconds=None)
+    graph = mta.transit_graph()
+    a, b = graph.ids[graph.indices[0]], graph.ids[graph.indices[-1]]
+
+    by_id = mta.plan_route(a, b)
+    assert by_id.stations[0] == a and by_id.stations[-1] == b
+    assert sum(leg['stops'] for leg in by_id.legs) == len(by_id) - 1
+
+    by_name = mta.plan_route(graph.names[graph.indices[0]], graph.names[graph.indices[-1]])
+    assert len(by_name) <= len(by_id)
+
+    with pytest.raises(KeyError):
+        mta.plan_route(a, 'Nowhere')
+
+def write_gtfs(tmpdir):
+    files = {
+        'trips.txt': 'route_id,trip_id\n1,T1\n1,T2\nA,T3\n',
+        'stop_times.txt': 'trip_id,stop_id,stop_sequence\n'
+                          'T1,127S,1\nT1,128S,2\nT1,129S,3\n'
+                          'T2,129N,1\nT2,128N,2\n'
+                          'T3,A27S,1\nT3,A28S,2\n',
+        'transfers.txt': 'from_stop_id,to_stop_id,transfer_type,min_transfer_time\n'
+                         '127,127,2,120\n127,725,2,180\n725,127,2,180\n127,A27,2,300\nA27,127,2,300\n'
+    }
+    for name, text in files.items():
+        tmpdir.join(name).write(text)
+    return [ str(tmpdir.join(name)) for name in ('trips.txt', 'stop_times.txt', 'transfers.txt') ]
+
+def test_station_graph_file(tmpdir):
+    script = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'make_station_graph.py')
+    output = subprocess.check_output([sys.executable, script, STATIONS_FILE] + write_gtfs(tmpdir))
+    graph_file = tmpdir.join('station_graph.json')
+    graph_file.write_binary(output)
+
+    data = json.loads(output)
+    # the longer trip's segments first, the northbound trip adds nothing new
+    assert data['routes'] == { '1': [['127', '128'], ['128', '129']], 'A': [['A27', 'A28']] }
+    # Times Sq's transfers within the complex give its own transfer time
+    assert data['transfers'] == [['127', '127', 180], ['127', 'A27', 300], ['A27', '127', 300]]
+
+    mta = Mtapi('', STATIONS_FILE, feed_urls=[], expires_seconds=None, graph_file=str(graph_file))
+    graph = mta.transit_graph()
+    times_sq = mta.snapshot().stations['127'].index
+    assert graph.route_names == ('1', 'A', 'transfer')
+    assert graph.transfer_seconds[times_sq] == 180
+    assert [ graph.ids[i] for i, _ in graph.footpaths(times_sq) ] == ['A27']
+
+    journey = mta.plan_route('129', 'A28')
+    assert journey.stations == ['129', '128', '127', 'A27', 'A28']
+    assert journey.routes == ['1', 'transfer', 'A']
+
+    # a missing file leaves the graph to the live feeds
+    mta = Mtapi('', STATIONS_FILE, feed_urls=[], expires_seconds=None, graph_file=str(tmpdir.join('missing.json')))
+    assert mta.transit_graph().n_edges == 0
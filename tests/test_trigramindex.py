@@ -0,0 +1,36 @@
+import json
+
+from mtapi._trigramindex import _TrigramIndex, canonical, trigrams
+from benchmarks.synthetic import STATIONS_FILE
+
+def load_index():
+    with open(STATIONS_FILE, 'r') as f:
+        names = [ station['name'] for station in json.load(f).values() ]
+    return _TrigramIndex(names)
+
+def top(index, query):
+    return index.names[index.search(query, 1)[0][1]]
+
+def test_canonical():
+    assert canonical('West 14th Street') == 'w 14 st'
+    assert canonical('W 14 St') == 'w 14 st'
+    assert canonical('Jay St-MetroTech') == 'jay st metrotech'
+    assert trigrams('sq') == set(['  s', ' sq', 'sq '])
+
+def test_search():
+    index = load_index()
+    assert top(index, 'jay st metrotech') == 'Jay St-MetroTech'
+    assert top(index, 'times sq') == 'Times Sq-42 St'
+    assert top(index, '14th st') == '14 St'
+    assert top(index, 'W 4th Street') == 'W 4 St-Wash Sq'
+    # either part of a complex's name, typos and all
+    assert top(index, 'bleeker st') == 'Bleecker St / Broadway-Lafayette St'
+    assert top(index, 'broadway lafayete') == 'Bleecker St / Broadway-Lafayette St'
+
+    results = index.search('86th street', 10)
+    assert [ index.names[i] for _, i in results ].count('86 St') > 1
+    assert results[0][0] == 1.0
+    assert all(a[0] >= b[0] for a, b in zip(results, results[1:]))
+
+    assert index.search('times sq', 5, min_score=0.5) == index.search('times sq', 1)
+    assert index.search('') == [] and index.search('qqq', 5, min_score=0.3) == []
@@ -0,0 +1,88 @@
+import time
+from mtapi._updatescheduler import _UpdateScheduler
+
+FEEDS = ['ace', 'l']
+
+class Clock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_learns_feed_cadence():
+    clock = Clock(1003)
+    scheduler = _UpdateScheduler(None, FEEDS, min_interval=5, lag=2, jitter=0, clock=clock)
+    feed = scheduler._feeds['ace']
+
+    # no period known: retry soon, backing off while nothing changes
+    scheduler._reschedule(feed, 1000, clock())
+    assert feed.next_poll == 1008
+    clock.now = 1008
+    scheduler._reschedule(feed, 1000, clock())
+    assert feed.next_poll == 1018
+
+    # a new version every 15s: poll 2s after each is due
+    clock.now = 1018
+    scheduler._reschedule(feed, 1015, clock())
+    assert feed.period == 15 and feed.next_poll == 1032
+    clock.now = 1032
+    scheduler._reschedule(feed, 1030, clock())
+    assert feed.next_poll == 1047
+
+    # a skipped version only nudges the period up
+    clock.now = 1077
+    scheduler._reschedule(feed, 1060, clock())
+    assert feed.period == 18.75
+
+    # never more than max_interval between polls
+    clock.now = 2000
+    scheduler._reschedule(feed, 1999, clock())
+    scheduler.MAX_INTERVAL = 10
+    scheduler._reschedule(feed, 1999 + 60, clock())
+    assert feed.next_poll == 2010
+
+def test_failures_back_off():
+    clock = Clock(1000)
+    scheduler = _UpdateScheduler(None, FEEDS, max_interval=20, min_interval=5, max_backoff=40, clock=clock)
+    feed = scheduler._feeds['l']
+
+    for delay in (10, 20, 40, 40):
+        scheduler._reschedule(feed, None, clock())
+        assert clock.now + delay / 2 <= feed.next_poll <= clock.now + delay
+
+    scheduler._reschedule(feed, 990, clock())
+    assert feed.failures == 0 and feed.next_poll <= clock.now + 5 + 1
+
+def test_worker_polls_and_stops():
+    polls = []
+
+    def poll(urls):
+        polls.append(sorted(urls))
+        if len(polls) == 2:
+            raise ValueError('bad feed')
+        return { url: time.time() for url in urls }
+
+    scheduler = _UpdateScheduler(poll, FEEDS, max_interval=0.05, min_interval=0.01, lag=0, jitter=0.01,
+                                 batch_window=0.05)
+    scheduler.start()
+    time.sleep(0.3)
+    assert scheduler.is_alive()
+    assert set(scheduler.next_polls()) == set(FEEDS)
+
+    assert scheduler.stop(timeout=1)
+    assert not scheduler.restart_if_dead()
+    count = len(polls)
+    time.sleep(0.1)
+    assert len(polls) == count > 2
+    # due feeds are polled in one batch
+    assert polls[0] == sorted(FEEDS)
+
+def test_stop_cancels_pending_poll():
+    scheduler = _UpdateScheduler(lambda urls: {}, FEEDS, max_interval=600)
+    scheduler.start({ url: time.time() for url in FEEDS })
+
+    start = time.monotonic()
+    assert scheduler.stop(timeout=1)
+    assert time.monotonic() - start < 0.5
+    assert not scheduler.is_alive()